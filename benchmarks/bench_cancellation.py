@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark for scan cancellation latency
+
+Starts each kind of blocking work against a local server that never
+answers (a TCP listener whose backlog is full, an HTTP server that accepts
+and stays silent, a TLS port that never completes the handshake, an SSDP
+search nobody answers), cancels it after a short delay and measures how
+long cancel() takes and how long until the worker thread is free again.
+The last case stops a whole scan pipeline probing the stalled listener.
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from cancellation import CancelToken
+from fingerprint import ServiceFingerprinter
+from scan_events import ScanEventQueue
+from scan_pipeline import ScanPipeline
+from scanner import PortScanner
+from tls_inspect import TLSInspector
+from upnp_scanner import UPnPScanner
+import ssdp
+
+def stalled_listener() -> List[socket.socket]:
+    """A listener whose backlog is full, so further connects hang.
+
+    Returns the listener followed by the connections filling its backlog.
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    sockets = [server]
+    for _ in range(4):
+        client = socket.socket()
+        client.setblocking(False)
+        client.connect_ex(server.getsockname())
+        sockets.append(client)
+    time.sleep(0.1)
+    return sockets
+
+def silent_server() -> socket.socket:
+    """A listener that accepts connections and never sends anything"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(64)
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server
+
+def measure(label: str, work, delay: float):
+    """Run work(token) on a thread, cancel after delay, time the cancel"""
+    token = CancelToken()
+    thread = threading.Thread(target=work, args=(token,), daemon=True)
+    thread.start()
+    time.sleep(delay)
+    start = time.perf_counter()
+    token.cancel()
+    cancel_time = time.perf_counter() - start
+    thread.join(30)
+    freed = time.perf_counter() - start
+    print(f"{label:<34} cancel() {cancel_time * 1000:7.2f} ms   thread free {freed * 1000:8.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--delay', type=float, default=0.3, help="seconds before cancelling")
+    args = parser.parse_args()
+
+    stalled = stalled_listener()
+    silent = silent_server()
+    stalled_port = stalled[0].getsockname()[1]
+    silent_port = silent.getsockname()[1]
+
+    scanner = PortScanner(fast=True)
+    upnp = UPnPScanner()
+    fingerprinter = ServiceFingerprinter(connect_timeout=5.0, read_timeout=5.0)
+    inspector = TLSInspector(timeout=5.0)
+
+    measure("TCP connect (5 s timeout)",
+            lambda token: scanner.scan_tcp_port('127.0.0.1', stalled_port, timeout=5.0, token=token),
+            args.delay)
+    measure("Fingerprint read (5 s timeout)",
+            lambda token: fingerprinter.identify('127.0.0.1', silent_port, token),
+            args.delay)
+    measure("TLS handshake (5 s timeout)",
+            lambda token: inspector.inspect('127.0.0.1', silent_port, token=token),
+            args.delay)
+    measure("Description fetch (5 s timeout)",
+            lambda token: upnp.get_device_info(f"http://127.0.0.1:{silent_port}/desc.xml",
+                                               force_refresh=True, token=token),
+            args.delay)
+    measure("Description connect (5 s timeout)",
+            lambda token: upnp.get_device_info(f"http://127.0.0.1:{stalled_port}/desc.xml",
+                                               force_refresh=True, token=token),
+            args.delay)
+    measure("SSDP search (5 s)",
+            lambda token: ssdp.discover(timeout=5.0, token=token, targets=[('127.0.0.1', 9)],
+                                        mx=5, min_quiet=5.0),
+            args.delay)
+
+    # Whole pipeline: every probe worker blocked in a connect
+    ports = [{'port': stalled_port, 'protocols': ['TCP'], 'service': 'stalled',
+              'risk_level': 'Low'}] * 256
+    pipeline = ScanPipeline(scanner, upnp, ScanEventQueue(), probe_workers=64,
+                            discovery_timeout=0, hosts=['127.0.0.1'])
+    pipeline.start(ports)
+    time.sleep(args.delay)
+    start = time.perf_counter()
+    pipeline.stop()
+    stop_time = time.perf_counter() - start
+    pipeline._probe_pool.shutdown(wait=True)
+    freed = time.perf_counter() - start
+    print(f"{'Pipeline, 64 blocked probes':<34} stop()   {stop_time * 1000:7.2f} ms   "
+          f"threads free {freed * 1000:7.2f} ms")
+
+    for sock in stalled + [silent]:
+        sock.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
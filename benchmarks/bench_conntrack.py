@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark for tallying a large connection-tracking table
+
+Writes a synthetic table in the /proc/net/nf_conntrack format, with a mix
+of accounted TCP, unreplied UDP and IPv6 entries from many peers, and
+measures how long a tally of the monitored ports takes and how much
+memory it allocates at peak.  Peak memory should stay flat as the table
+grows, since entries are streamed.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import conntrack
+
+def write_table(path: str, entries: int):
+    """Write a synthetic table of inbound connections to ports 22, 443 and 53"""
+    with open(path, 'w') as f:
+        for i in range(entries):
+            peer = f"10.{i % 250}.{(i // 250) % 250}.{i % 7 + 1}"
+            sport = 1024 + i % 60000
+            if i % 3 == 0:
+                f.write(f"ipv4     2 tcp      6 431999 ESTABLISHED src={peer} dst=192.0.2.1 "
+                        f"sport={sport} dport=22 packets=12 bytes=2048 src=192.0.2.1 dst={peer} "
+                        f"sport=22 dport={sport} packets=10 bytes=4096 [ASSURED] mark=0 zone=0 use=2\n")
+            elif i % 3 == 1:
+                f.write(f"ipv4     2 udp      17 29 src={peer} dst=192.0.2.1 sport={sport} dport=53 "
+                        f"[UNREPLIED] src=192.0.2.1 dst={peer} sport=53 dport={sport} mark=0 zone=0 use=2\n")
+            else:
+                f.write(f"ipv6     10 tcp      6 117 SYN_RECV "
+                        f"src=2001:0db8:0000:0000:0000:0000:0000:{i % 65536:04x} "
+                        f"dst=2001:0db8:0000:0000:0000:0000:0000:0001 sport={sport} dport=443 "
+                        f"src=2001:0db8:0000:0000:0000:0000:0000:0001 "
+                        f"dst=2001:0db8:0000:0000:0000:0000:0000:{i % 65536:04x} "
+                        f"sport=443 dport={sport} mark=0 zone=0 use=2\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, nargs='+', default=[10000, 100000, 500000],
+                        help="table sizes to measure")
+    args = parser.parse_args()
+
+    local_addresses = {'192.0.2.1', '2001:db8::1'}
+    ports = {('TCP', 22), ('TCP', 443), ('UDP', 53), ('TCP', 80)}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'nf_conntrack')
+        for entries in args.entries:
+            write_table(path, entries)
+            size = os.path.getsize(path)
+
+            with open(path) as f:
+                start = time.perf_counter()
+                counts = conntrack.tally(f, local_addresses, ports)
+                elapsed = time.perf_counter() - start
+
+            tracemalloc.start()
+            with open(path) as f:
+                conntrack.tally(f, local_addresses, ports)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            counted = sum(traffic.connections for traffic in counts.values())
+            print(f"{entries:>8} entries ({size / 1e6:6.1f} MB): {elapsed:6.2f} s, "
+                  f"{elapsed * 1e6 / entries:5.2f} us/entry, peak {peak / 1024:7.1f} KiB, "
+                  f"{counted} inbound counted")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark for logging overhead during a full port sweep
+
+Sweeps all 65,535 TCP ports of the loopback address under several logging
+setups and compares them with a sweep without log handlers.  A second part
+measures the cost of one suppressed debug message in a hot loop, written
+as an f-string, with lazy formatting, and behind a level guard.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import probe_trace
+import resource_limits
+from log_setup import LOG_FORMAT, debug_enabled, start_queue_logging, stop_queue_logging
+from scanner import PortScanner
+
+def sweep(host: str, ports: range, workers: int) -> float:
+    """Probe every port once and return the elapsed time"""
+    scanner = PortScanner(fast=True)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda port: scanner.scan_tcp_port(host, port, timeout=0.5), ports))
+    return time.perf_counter() - start
+
+def use_handlers(handlers, level: int, queued: bool):
+    """Install handlers on the root logger, directly or behind a queue"""
+    root = logging.getLogger()
+    stop_queue_logging(root)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if queued:
+        return start_queue_logging(handlers, level=level)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    return None
+
+def file_handler(directory: str, name: str) -> logging.Handler:
+    handler = logging.FileHandler(os.path.join(directory, name))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+def micro(label: str, func, count: int):
+    """Time count calls of func and print the cost per call"""
+    start = time.perf_counter()
+    func(count)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<38} {elapsed / count * 1e9:8.1f} ns/call")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ports', type=int, default=65535)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--trace-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    ports = range(1, args.ports + 1)
+    workers = resource_limits.get_probe_window()
+    directory = tempfile.mkdtemp(prefix='bench_logging_')
+    print(f"Sweeping {args.ports} ports on {args.host} with {workers} workers, best of {args.repeat}")
+
+    setups = [
+        ("no handlers", lambda: use_handlers([logging.NullHandler()], logging.WARNING, False)),
+        ("file, synchronous, DEBUG", lambda: use_handlers([file_handler(directory, 'sync.log')],
+                                                          logging.DEBUG, False)),
+        ("file, queued, INFO", lambda: use_handlers([file_handler(directory, 'info.log')],
+                                                    logging.INFO, True)),
+        ("file, queued, DEBUG", lambda: use_handlers([file_handler(directory, 'debug.log')],
+                                                     logging.DEBUG, True)),
+        (f"queued INFO + {args.trace_rate:.0%} probe trace",
+         lambda: (use_handlers([file_handler(directory, 'trace_info.log')], logging.INFO, True),
+                  probe_trace.configure(args.trace_rate, os.path.join(directory, 'trace.ndjson')))),
+    ]
+
+    baseline = None
+    for label, setup in setups:
+        setup()
+        best = min(sweep(args.host, ports, workers) for _ in range(args.repeat))
+        stop_queue_logging(logging.getLogger(probe_trace.TRACE_LOGGER))
+        probe_trace.configure(0.0)
+        baseline = baseline or best
+        print(f"{label:<36} {best:7.2f} s  {(best / baseline - 1) * 100:+6.1f}%")
+
+    trace_file = os.path.join(directory, 'trace.ndjson')
+    if os.path.exists(trace_file):
+        with open(trace_file) as f:
+            print(f"Probe trace lines: {sum(1 for _ in f)}")
+
+    # Cost of a debug message that is not logged
+    use_handlers([logging.NullHandler()], logging.INFO, False)
+    host, port, error = '127.0.0.1', 8080, ConnectionRefusedError(111, 'Connection refused')
+
+    def fstring(count):
+        for _ in range(count):
+            logging.debug(f"TCP scan error on {host} port {port}: {error}")
+
+    def lazy(count):
+        for _ in range(count):
+            logging.debug("TCP scan error on %s port %d: %s", host, port, error)
+
+    def guarded(count):
+        for _ in range(count):
+            if debug_enabled():
+                logging.debug("TCP scan error on %s port %d: %s", host, port, error)
+
+    print("Suppressed debug message:")
+    for label, func in (("f-string", fstring), ("lazy formatting", lazy), ("level guard", guarded)):
+        micro(label, func, 1_000_000)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
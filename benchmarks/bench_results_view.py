@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the virtualized results view
+
+Measures how long it takes to display, scroll through and refresh 10,000
+results.  Requires a display (or Xvfb) since it creates a Tk window.
+"""
+
+import os
+import sys
+import time
+import random
+import tkinter as tk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from results_view import VirtualResultsView
+
+ROW_COUNT = 10_000
+
+def make_rows(count: int):
+    """Generate synthetic scan results"""
+    risks = ['High', 'Medium', 'Low']
+    return [{
+        'port': random.randint(1, 65535),
+        'protocol': random.choice(['TCP', 'UDP']),
+        'service': f"Service {i}",
+        'risk_level': random.choice(risks),
+        'state': 'OPEN'
+    } for i in range(count)]
+
+def format_row(port_info):
+    """Format a row the same way the GUI does"""
+    values = (port_info['port'], port_info['protocol'], port_info['service'],
+              port_info['risk_level'], port_info['state'])
+    return values, port_info['risk_level']
+
+def timed(label: str, func, repeat: int = 1):
+    """Run func repeat times and print the average duration"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<40} {elapsed * 1000:8.2f} ms")
+
+def main():
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"No display available: {e}")
+        return 1
+
+    root.geometry("1000x700")
+    view = VirtualResultsView(root,
+                              columns=[('port', 90), ('protocol', 90), ('service', 260),
+                                       ('risk_level', 110), ('state', 140)],
+                              format_row=format_row)
+    view.pack(fill=tk.BOTH, expand=True)
+    root.update()
+
+    rows = make_rows(ROW_COUNT)
+    print(f"Rows: {ROW_COUNT}, visible rows: {view.visible_count}")
+
+    timed("set_rows (10k)", lambda: (view.set_rows(rows), root.update_idletasks()), repeat=20)
+    timed("scroll one line", lambda: (view.scroll(1), root.update_idletasks()), repeat=500)
+    timed("scroll one page", lambda: (view.scroll(view.visible_count), root.update_idletasks()), repeat=200)
+    timed("refresh (language switch)", lambda: (view.refresh(), root.update_idletasks()), repeat=100)
+
+    root.destroy()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
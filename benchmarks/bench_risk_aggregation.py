@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark for fleet risk aggregation
+
+Builds synthetic findings for a fleet of hosts and times the conversion to
+arrays, the per-host and per-subnet scores, the top-N query and the delta
+between two scans.  Requires NumPy.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from risk_aggregation import build_arrays, score_deltas, score_hosts, score_subnets
+
+def make_findings(count: int, host_count: int, seed: int):
+    """Generate synthetic findings spread over host_count hosts"""
+    rng = random.Random(seed)
+    hosts = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(host_count)]
+    risks = ['High', 'Medium', 'Medium', 'Low', 'Low', 'Low']
+    return [{
+        'host': rng.choice(hosts),
+        'port': rng.randint(1, 65535),
+        'protocol': 'TCP',
+        'risk_level': rng.choice(risks),
+    } for _ in range(count)]
+
+def timed(label: str, func):
+    """Run func once and print its duration"""
+    start = time.perf_counter()
+    result = func()
+    print(f"{label:<40} {(time.perf_counter() - start) * 1000:8.2f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--findings', type=int, default=300_000)
+    parser.add_argument('--hosts', type=int, default=20_000)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    previous = make_findings(args.findings, args.hosts, seed=1)
+    current = make_findings(args.findings, args.hosts, seed=2)
+    print(f"Findings: {args.findings}, hosts: {args.hosts}")
+
+    arrays = timed("build_arrays", lambda: build_arrays(current))
+    hosts = timed("score_hosts", lambda: score_hosts(arrays))
+    timed("score_subnets", lambda: score_subnets(arrays))
+    top = timed(f"top {args.top} hosts", lambda: hosts.top(args.top))
+    previous_hosts = score_hosts(build_arrays(previous))
+    timed("score_deltas", lambda: score_deltas(previous_hosts, hosts))
+
+    print("Riskiest hosts:")
+    for row in top[:5]:
+        print(f"  {row['name']:<16} score {row['score']:6.0f}  high {row['high']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the UPnP discovery, description and port mapping paths
+
+Runs the scanner against a local stand-in responder simulating 500
+Internet Gateway Devices on loopback, so no router is needed.  Optional
+arguments set the number of devices and mappings, and simulate latency,
+lost responses, failures and truncated bodies.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from upnp_responder import UPnPResponder
+from upnp_scanner import UPnPScanner
+
+def timed(label: str, func):
+    """Run func once, print its duration and return its result"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:8.1f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--mappings', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--spread', type=float, default=0.2,
+                        help="maximum delay before a device answers a search (s)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="delay added to every HTTP request (s)")
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--truncate-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    responder = UPnPResponder(device_count=args.devices, mapping_count=args.mappings,
+                              response_spread=args.spread, http_latency=args.latency,
+                              drop_rate=args.drop_rate, failure_rate=args.failure_rate,
+                              truncate_rate=args.truncate_rate, seed=1)
+    with responder:
+        scanner = UPnPScanner(fetch_workers=args.workers, discovery_options={
+            'interfaces': ['127.0.0.1'],
+            'target': responder.ssdp_address,
+            'search_targets': ['upnp:rootdevice'],
+        })
+
+        locations = timed(f"Discover {args.devices} devices",
+                          lambda: scanner.discover_upnp_devices(timeout=5))
+        print(f"  found {len(locations)} devices")
+
+        devices_info = timed(f"Fetch {len(locations)} descriptions",
+                             lambda: scanner.get_devices_info(locations))
+        parsed = {location: info for location, info in devices_info.items() if info}
+        print(f"  parsed {len(parsed)} descriptions")
+
+        timed("Revalidate cached descriptions",
+              lambda: [scanner.get_device_info(location, force_refresh=True)
+                       for location in parsed])
+
+        def enumerate_each():
+            return sum(len(scanner.get_mapping_findings(location, info))
+                       for location, info in parsed.items())
+
+        mappings = timed("Enumerate mappings one device at a time", enumerate_each)
+        print(f"  found {mappings} port mappings")
+
+        mappings = timed(f"Enumerate mappings of {len(parsed)} devices",
+                         lambda: len(scanner.get_devices_mapping_findings(parsed)))
+        print(f"  found {mappings} port mappings")
+
+if __name__ == '__main__':
+    main()
@@ -8,34 +8,193 @@ Licensed under MIT License
 
 import sys
 import os
-import tkinter as tk
-from tkinter import messagebox
+import argparse
 import threading
 import logging
 
 # Add src directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from gui import NetworkSecurityApp
-from localization import LocalizationManager
+from scan_daemon import DEFAULT_HOST, DEFAULT_PORT, ScanDaemon, ScanService
+from scheduler import DEFAULT_SCHEDULE_FILE, ScanScheduler, load_profiles
+from distributed import DEFAULT_LEASE_SIZE, ScanCoordinator, ScanWorker, parse_address
+from exporters import RecordAnnotator, StreamingExporter, open_writer
+from port_database import PortDatabase
+from log_setup import setup_queue_logging
+import probe_trace
+import risk_aggregation
+import targets
 
-def setup_logging():
-    """Setup logging configuration"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('network_scanner.log'),
-            logging.StreamHandler()
-        ]
-    )
+def setup_logging(args: argparse.Namespace):
+    """Setup logging configuration
+    
+    Records go through a queue to the file and console handlers, which run
+    on a listener thread, so scan threads never wait for log I/O.
+    """
+    setup_queue_logging(level=logging.DEBUG if args.debug else logging.INFO)
+    if args.trace_rate:
+        probe_trace.configure(args.trace_rate, args.trace_file)
+        logging.info(f"Tracing {args.trace_rate:.2%} of probes to {args.trace_file}")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description="Network Port Security Scanner")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--daemon', action='store_true',
+                      help="run as a local scan service with an HTTP/JSON job API instead of the GUI")
+    mode.add_argument('--coordinate', metavar='HOST:PORT',
+                      help="hand out the scan to distributed workers connecting to this address")
+    mode.add_argument('--worker', metavar='HOST:PORT',
+                      help="scan for the coordinator at this address")
+    mode.add_argument('--fleet-report', metavar='FILE',
+                      help="print the riskiest hosts and subnets of an NDJSON export (needs NumPy)")
+    parser.add_argument('--schedule', nargs='?', const=DEFAULT_SCHEDULE_FILE, metavar='FILE',
+                        help="run the scan profiles of FILE on their schedules in the scan daemon "
+                             f"(implies --daemon; default file {DEFAULT_SCHEDULE_FILE})")
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help=f"loopback address the service listens on (default {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f"port the service listens on (default {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="scan jobs run at the same time (default 2)")
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help="scan jobs that may wait for a worker (default 16)")
+    parser.add_argument('--targets', default='',
+                        help="comma-separated hosts or prefixes for --coordinate (default: this system)")
+    parser.add_argument('--ports', default='',
+                        help="ports for --coordinate, e.g. 22,80,8000-8100 (default: monitored ports)")
+    parser.add_argument('--lease-size', type=int, default=DEFAULT_LEASE_SIZE,
+                        help=f"ports per lease handed to a worker (default {DEFAULT_LEASE_SIZE})")
+    parser.add_argument('--output', metavar='FILE',
+                        help="export the results of --coordinate; the format follows the extension")
+    parser.add_argument('--previous', metavar='FILE',
+                        help="earlier NDJSON export to compare the --fleet-report with")
+    parser.add_argument('--top', type=int, default=10,
+                        help="hosts and subnets listed by --fleet-report (default 10)")
+    parser.add_argument('--token', default=os.environ.get('PORTSCOPE_TOKEN'),
+                        help="shared secret between coordinator and workers, and bearer token of "
+                             "the --daemon API (default $PORTSCOPE_TOKEN)")
+    parser.add_argument('--debug', action='store_true',
+                        help="log debug messages")
+    parser.add_argument('--trace-rate', type=float, default=0.0, metavar='FRACTION',
+                        help="trace this fraction of probes, e.g. 0.01 (default: off)")
+    parser.add_argument('--trace-file', default=probe_trace.DEFAULT_TRACE_FILE,
+                        help=f"file the probe trace is written to (default {probe_trace.DEFAULT_TRACE_FILE})")
+    args = parser.parse_args(argv)
+    if args.schedule and (args.coordinate or args.worker):
+        parser.error("--schedule runs in the scan daemon, not with --coordinate or --worker")
+    if args.schedule and args.fleet_report:
+        parser.error("--schedule runs in the scan daemon, not with --fleet-report")
+    if args.previous and not args.fleet_report:
+        parser.error("--previous is only used with --fleet-report")
+    return args
+
+def run_daemon(args: argparse.Namespace):
+    """Run the scan service until interrupted"""
+    service = ScanService(workers=args.workers, max_queued=args.queue_size)
+    scheduler = ScanScheduler(service, load_profiles(args.schedule)) if args.schedule else None
+    ScanDaemon(service, host=args.host, port=args.port, scheduler=scheduler,
+               token=args.token).serve_forever()
+
+def run_coordinator(args: argparse.Namespace):
+    """Split the scan into leases and collect the results of the workers"""
+    port_db = PortDatabase()
+    target_specs = [spec for spec in args.targets.split(',') if spec.strip()]
+    hosts = targets.expand_targets(target_specs) if target_specs else targets.get_default_hosts()
+    if args.ports:
+        ports_to_scan = port_db.get_ports_for_scan(targets.parse_port_spec(args.ports))
+    else:
+        ports_to_scan = port_db.get_all_monitored_ports()
+    
+    exporter = None
+    if args.output:
+        exporter = StreamingExporter(open_writer(args.output, annotator=RecordAnnotator(port_db)))
+    host, port = parse_address(args.coordinate)
+    coordinator = ScanCoordinator(hosts, ports_to_scan, host=host, port=port,
+                                  lease_size=args.lease_size, token=args.token,
+                                  result_callback=exporter.put if exporter else None)
+    coordinator.start()
+    try:
+        while not coordinator.wait(10):
+            logging.info(f"Distributed scan {coordinator.progress()}% done, "
+                         f"{len(coordinator.merger)} open ports")
+    except KeyboardInterrupt:
+        logging.info("Distributed scan interrupted")
+    finally:
+        coordinator.stop()
+        if exporter:
+            exporter.close()
+    logging.info(f"Distributed scan finished: {len(coordinator.merger)} open ports, "
+                 f"{len(coordinator.failed)} leases given up")
+
+def run_worker(args: argparse.Namespace):
+    """Scan leases for a coordinator until it has no more work"""
+    worker = ScanWorker(parse_address(args.worker), token=args.token)
+    leases = worker.run()
+    logging.info(f"Worker finished after {leases} leases")
+
+def print_risk_table(title: str, rows: list, signed: bool = False):
+    """Print rows of a risk table under a title"""
+    sign = '+' if signed else ''
+    print(title)
+    print(f"{'score':>10} {'high':>6} {'medium':>6} {'low':>6}  name")
+    for row in rows:
+        print(f"{row['score']:>{sign}10.1f} {row['high']:>{sign}6} {row['medium']:>{sign}6} "
+              f"{row['low']:>{sign}6}  {row['name']}")
+    print()
+
+def run_fleet_report(args: argparse.Namespace):
+    """Print the per-host and per-subnet risk scores of an NDJSON export"""
+    risk_aggregation.require_numpy()
+    arrays = risk_aggregation.build_arrays(risk_aggregation.load_ndjson(args.fleet_report))
+    hosts = risk_aggregation.score_hosts(arrays)
+    subnets = risk_aggregation.score_subnets(arrays)
+    print(f"{len(arrays)} findings on {len(hosts)} hosts in {len(subnets)} subnets\n")
+    print_risk_table(f"Top {args.top} hosts", hosts.top(args.top))
+    print_risk_table(f"Top {args.top} subnets", subnets.top(args.top))
+    
+    if args.previous:
+        previous = risk_aggregation.build_arrays(risk_aggregation.load_ndjson(args.previous))
+        for name, table, previous_table in (
+                ('hosts', hosts, risk_aggregation.score_hosts(previous)),
+                ('subnets', subnets, risk_aggregation.score_subnets(previous))):
+            deltas = risk_aggregation.score_deltas(previous_table, table)
+            print_risk_table(f"Largest risk increases of {name} since {args.previous}",
+                             deltas.top(args.top), signed=True)
 
 def main():
     """Main application entry point"""
+    args = parse_args()
+    for enabled, name, run in ((args.daemon or args.schedule, "scan daemon", run_daemon),
+                               (args.coordinate, "coordinator", run_coordinator),
+                               (args.worker, "worker", run_worker),
+                               (args.fleet_report, "fleet report", run_fleet_report)):
+        if not enabled:
+            continue
+        setup_logging(args)
+        logging.info(f"Starting {name}")
+        try:
+            run(args)
+        except (OSError, ValueError, ImportError) as e:
+            logging.error(f"The {name} failed: {e}")
+            sys.exit(1)
+        return
+    
+    # Tk is only needed by the GUI, so the modes above run on headless systems
     try:
-        setup_logging()
+        import tkinter as tk
+        from tkinter import messagebox
+    except ImportError as e:
+        sys.exit(f"The GUI needs Tk ({e}); --daemon, --coordinate, --worker and "
+                 "--fleet-report run without it")
+    
+    try:
+        setup_logging(args)
         logging.info("Starting Network Port Security Scanner")
         
+        from gui import NetworkSecurityApp
+        from localization import LocalizationManager
+        
         # Create main window
         root = tk.Tk()
         
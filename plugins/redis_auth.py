@@ -0,0 +1,32 @@
+"""
+Checks whether a Redis server accepts commands without authentication
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from plugins import ProbePlugin
+
+class RedisAuthPlugin(ProbePlugin):
+    """Sends PING; a +PONG reply means anyone on the network can use the server"""
+
+    name = 'redis_auth'
+    ports = (6379,)
+    services = ('Redis',)
+    result_schema = {'authentication': bool, 'reply': str}
+    timeout = 3.0
+
+    async def probe(self, host: str, port: int, finding: Dict) -> Optional[Dict]:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(b'PING\r\n')
+            await writer.drain()
+            reply = (await reader.readline()).decode('utf-8', errors='replace').strip()
+        finally:
+            writer.close()
+        if reply.startswith('+PONG'):
+            return {'authentication': False, 'reply': reply, 'risk_level': 'High',
+                    'summary': 'Redis accepts commands without a password'}
+        if reply.startswith('-NOAUTH'):
+            return {'authentication': True, 'reply': reply}
+        return None
@@ -0,0 +1,168 @@
+"""
+TTL caches for scan inputs that change slowly between scans
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Cache sources
+SOCKETS = 'sockets'
+DISCOVERY = 'discovery'
+DESCRIPTIONS = 'descriptions'
+CONNTRACK = 'conntrack'
+
+# How long each source is served without asking again (seconds)
+DEFAULT_TTLS = {
+    SOCKETS: 5.0,
+    DISCOVERY: 60.0,
+    DESCRIPTIONS: 300.0,
+    CONNTRACK: 10.0,
+}
+
+# Most entries kept per source; least recently used entries are evicted
+DEFAULT_SIZES = {
+    SOCKETS: 4,
+    DISCOVERY: 32,
+    DESCRIPTIONS: 512,
+    CONNTRACK: 4,
+}
+
+# Marks a missing entry, since None can be a cached value
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries are fresh for `ttl` seconds.
+
+    Expired entries are not dropped right away: get_stale() still returns
+    them, e.g. for the validators of a conditional request, until they are
+    evicted by newer entries or invalidated.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, stored_at, ttl), least recently used first
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._loading: Dict[Hashable, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value if it is still fresh"""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[1] < entry[2]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return default
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value whether or not it has expired"""
+        with self.lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else default
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entries if full"""
+        with self.lock:
+            self._entries[key] = (value, self.clock(), self.ttl if ttl is None else ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, key: Hashable) -> Any:
+        """Restart the lifetime of an entry confirmed unchanged; returns its value"""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], self.clock(), entry[2])
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def invalidate(self, key: Hashable):
+        """Drop one entry"""
+        with self.lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop all entries"""
+        with self.lock:
+            self._entries.clear()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any],
+                    force_refresh: bool = False) -> Any:
+        """Get a fresh value or load and store it.
+
+        Concurrent callers missing the same key wait for one load instead of
+        each running the loader.  Failed loads raise and store nothing.
+        """
+        if not force_refresh:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+        with self.lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another caller may have loaded the value while this one waited
+            if not force_refresh:
+                with self.lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and self.clock() - entry[1] < entry[2]:
+                        return entry[0]
+            try:
+                value = loader()
+                self.put(key, value)
+                return value
+            finally:
+                with self.lock:
+                    self._loading.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Entry, hit and miss counts"""
+        with self.lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+class ScanCache:
+    """One TTLCache per scan input source.
+
+    Holds the listening-socket snapshot, SSDP discovery results, parsed
+    UPnP device descriptions and connection-tracking counts, each with its
+    own TTL and size.  Scanners sharing a ScanCache, such as the GUI's
+    consecutive scans or the scan daemon's jobs, reuse what the others have
+    read until it expires or is invalidated.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None,
+                 sizes: Optional[Dict[str, int]] = None):
+        ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+        self.sources = {name: TTLCache(ttls[name], sizes[name]) for name in DEFAULT_TTLS}
+
+    def source(self, name: str) -> TTLCache:
+        """Get the cache of a source; raises KeyError for unknown sources"""
+        return self.sources[name]
+
+    def invalidate(self, name: Optional[str] = None):
+        """Drop the entries of one source, or of every source"""
+        if name is None:
+            for cache in self.sources.values():
+                cache.clear()
+        else:
+            self.source(name).clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Entry, hit and miss counts per source"""
+        return {name: cache.stats() for name, cache in self.sources.items()}
@@ -0,0 +1,233 @@
+"""
+Cooperative cancellation shared by the scan engines
+"""
+
+import asyncio
+import itertools
+import socket
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+class CancelToken:
+    """Signals cancellation to every piece of work it was handed to.
+
+    Loops check `cancelled` between steps, and work blocked in a system call
+    registers a callback that unblocks it: sockets are shut down, asyncio
+    tasks cancelled and HTTP connections aborted.  cancel() runs the
+    callbacks on the calling thread and never waits for the work itself,
+    so it returns within milliseconds even from a GUI event handler.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._ids = itertools.count()
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel, running every registered callback once"""
+        with self.lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Sleep up to timeout, waking early on cancellation; True if cancelled"""
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback: Callable[[], None]) -> Optional[int]:
+        """Run callback on cancellation, right away if already cancelled.
+
+        Returns a handle for remove_callback(), or None if the callback
+        already ran.
+        """
+        with self.lock:
+            if not self._event.is_set():
+                handle = next(self._ids)
+                self._callbacks[handle] = callback
+                return handle
+        callback()
+        return None
+
+    def remove_callback(self, handle: Optional[int]):
+        """Unregister a callback whose work has finished"""
+        if handle is not None:
+            with self.lock:
+                self._callbacks.pop(handle, None)
+
+    @contextmanager
+    def watch(self, sock: socket.socket):
+        """Shut the socket down if cancelled while the block runs.
+
+        Shutting down rather than closing wakes a thread blocked in connect,
+        recv or send on the socket; the owner still closes it as usual.
+        """
+        handle = self.add_callback(lambda: abort_socket(sock))
+        try:
+            yield sock
+        finally:
+            self.remove_callback(handle)
+
+def abort_socket(sock: socket.socket):
+    """Shut a socket down in both directions, ignoring sockets not connected"""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def watch(token: Optional[CancelToken], sock: socket.socket):
+    """token.watch(sock), or a no-op without a token"""
+    return token.watch(sock) if token is not None else nullcontext(sock)
+
+def is_cancelled(token: Optional[CancelToken]) -> bool:
+    return token is not None and token.cancelled
+
+def create_connection(address: Tuple[str, int], timeout: Optional[float] = None,
+                      token: Optional[CancelToken] = None,
+                      source_address: Optional[Tuple[str, int]] = None,
+                      socket_options=()) -> socket.socket:
+    """socket.create_connection() whose connect attempts the token can abort"""
+    if token is None and not socket_options:
+        return socket.create_connection(address, timeout, source_address)
+
+    host, port = address
+    error: Optional[OSError] = None
+    for family, socktype, proto, _, sockaddr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        if is_cancelled(token):
+            break
+        sock = socket.socket(family, socktype, proto)
+        try:
+            for option in socket_options or ():
+                sock.setsockopt(*option)
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            with watch(token, sock):
+                sock.connect(sockaddr)
+            if is_cancelled(token):
+                raise ConnectionAbortedError("connection cancelled")
+            return sock
+        except OSError as e:
+            error = e
+            sock.close()
+    if is_cancelled(token):
+        raise ConnectionAbortedError("connection cancelled")
+    raise error or OSError(f"cannot resolve {host}")
+
+async def run_cancellable(awaitable: Awaitable, token: Optional[CancelToken],
+                          default: Any = None) -> Any:
+    """Await in a task that the token cancels; returns default if cancelled"""
+    if token is None:
+        return await awaitable
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+
+    def cancel_task():
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # Loop already closed; the task is finished
+            pass
+
+    handle = token.add_callback(cancel_task)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if token.cancelled:
+            return default
+        raise
+    finally:
+        token.remove_callback(handle)
+
+# HTTP cancellation: the token bound to the current thread
+_http_binding = threading.local()
+
+@contextmanager
+def bind_http(token: Optional[CancelToken]):
+    """Abort this thread's HTTP requests in the block when token is cancelled.
+
+    Applies to sessions with a CancellableHTTPAdapter mounted; their
+    connections are shut down, whether still connecting, waiting for the
+    response or reading its body.
+    """
+    if token is None:
+        yield
+        return
+    previous = getattr(_http_binding, 'token', None), getattr(_http_binding, 'handles', None)
+    _http_binding.token = token
+    _http_binding.handles = {}
+    try:
+        yield
+    finally:
+        for handle in _http_binding.handles.values():
+            token.remove_callback(handle)
+        _http_binding.token, _http_binding.handles = previous
+
+def _watch_connection(sock: Optional[socket.socket]):
+    """Register a connection socket with the token bound to this thread"""
+    token = getattr(_http_binding, 'token', None)
+    if token is None or sock is None or id(sock) in _http_binding.handles:
+        return
+    _http_binding.handles[id(sock)] = token.add_callback(lambda: abort_socket(sock))
+
+class _CancellableConnectionMixin:
+    """urllib3 connection that connects through create_connection() above"""
+
+    def _new_conn(self) -> socket.socket:
+        token = getattr(_http_binding, 'token', None)
+        if token is None:
+            return super()._new_conn()
+        timeout = self.timeout if isinstance(self.timeout, (int, float)) else socket.getdefaulttimeout()
+        try:
+            sock = create_connection((self._dns_host, self.port), timeout, token,
+                                     self.source_address, self.socket_options)
+        except socket.timeout as e:
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out") from e
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+        _watch_connection(sock)
+        return sock
+
+    def request(self, *args, **kwargs):
+        # Kept-alive connections are reused across bindings
+        _watch_connection(self.sock)
+        return super().request(*args, **kwargs)
+
+class _CancellableHTTPConnection(_CancellableConnectionMixin, HTTPConnection):
+    pass
+
+class _CancellableHTTPSConnection(_CancellableConnectionMixin, HTTPSConnection):
+    pass
+
+class _CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+class _CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+class CancellableHTTPAdapter(HTTPAdapter):
+    """requests adapter whose requests bind_http() can abort"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CancellableHTTPConnectionPool,
+            'https': _CancellableHTTPSConnectionPool,
+        }
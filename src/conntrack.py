@@ -0,0 +1,212 @@
+"""
+Inbound connection counts from the kernel connection-tracking table (Linux)
+"""
+
+import ipaddress
+import logging
+import re
+import shutil
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from cancellation import CancelToken, is_cancelled
+from log_setup import debug_enabled
+
+# Connection-tracking table, and the name it had before nf_conntrack
+CONNTRACK_PATHS = ('/proc/net/nf_conntrack', '/proc/net/ip_conntrack')
+
+# conntrack(8) lists the same table over netlink, in the same format
+CONNTRACK_COMMAND = ['conntrack', '-L', '-o', 'extended']
+COMMAND_TIMEOUT = 30
+
+# Addresses of the local interfaces (IPv6; IPv4 comes from ssdp)
+IF_INET6_PATH = '/proc/net/if_inet6'
+
+# Protocols whose entries are counted, as named in the table
+PROTOCOLS = {'tcp': 'TCP', 'udp': 'UDP'}
+
+# Original direction of an entry (peer, local address, local port), and the
+# byte counters written when connection accounting is enabled
+ORIGINAL_TUPLE = re.compile(r' src=(\S+) dst=(\S+) sport=\d+ dport=(\d+)')
+BYTES = re.compile(r' bytes=(\d+)')
+
+# Distinct peer addresses remembered per port; beyond it only counts grow
+MAX_PEERS = 64
+
+# Entries read between checks of the cancel token
+CANCEL_CHECK_EVERY = 4096
+
+# Key of a tally: (protocol, local port)
+PortKey = Tuple[str, int]
+
+@dataclass
+class PortTraffic:
+    """Inbound connections to one local port seen in the table"""
+    connections: int = 0
+    established: int = 0
+    unreplied: int = 0
+    bytes: int = 0
+    peers: Set[str] = field(default_factory=set)
+    more_peers: bool = False
+
+    def add(self, peer: str, assured: bool, unreplied: bool, size: int):
+        self.connections += 1
+        if assured:
+            self.established += 1
+        if unreplied:
+            self.unreplied += 1
+        self.bytes += size
+        if peer not in self.peers:
+            if len(self.peers) < MAX_PEERS:
+                self.peers.add(peer)
+            else:
+                self.more_peers = True
+
+    def summary(self) -> Dict:
+        """Counts for a finding; "peers" is a lower bound if peers_truncated"""
+        return {
+            'connections': self.connections,
+            'established': self.established,
+            'unreplied': self.unreplied,
+            'bytes': self.bytes,
+            'peers': len(self.peers),
+            'peers_truncated': self.more_peers,
+        }
+
+def address_forms(addresses: Iterable[str]) -> Set[str]:
+    """Add the forms the table may write IPv6 addresses in.
+
+    /proc writes them in full, conntrack(8) compressed.
+    """
+    forms = set()
+    for address in addresses:
+        forms.add(address)
+        if ':' in address:
+            try:
+                ip = ipaddress.IPv6Address(address)
+            except ValueError:
+                continue
+            forms.add(ip.exploded)
+            forms.add(ip.compressed)
+    return forms
+
+def get_local_ipv6_addresses() -> Set[str]:
+    """Get the IPv6 addresses of the local interfaces from /proc/net/if_inet6"""
+    addresses = {'::1'}
+    try:
+        with open(IF_INET6_PATH) as f:
+            for line in f:
+                hex_address = line.split(' ', 1)[0]
+                if len(hex_address) == 32:
+                    addresses.add(str(ipaddress.IPv6Address(int(hex_address, 16))))
+    except (OSError, ValueError):
+        pass
+    return addresses
+
+def parse_entry(line: str) -> Optional[Tuple[str, str, str, int, bool, bool, int]]:
+    """Parse the original direction of a table entry.
+
+    Returns (protocol, peer, local address, local port, assured, unreplied,
+    bytes), or None for entries of other protocols.  Addresses are returned
+    as written in the table.
+    """
+    fields = line.split(None, 3)
+    if len(fields) < 4:
+        return None
+    protocol = PROTOCOLS.get(fields[2])
+    if protocol is None:
+        return None
+    match = ORIGINAL_TUPLE.search(line)
+    if match is None:
+        return None
+    peer, local, port = match.groups()
+    size = sum(int(value) for value in BYTES.findall(line, match.end())) if ' bytes=' in line else 0
+    return (protocol, peer, local, int(port),
+            '[ASSURED]' in line, '[UNREPLIED]' in line, size)
+
+def tally(lines: Iterable[str], local_addresses: Optional[Set[str]] = None,
+          ports: Optional[Set[PortKey]] = None,
+          token: Optional[CancelToken] = None) -> Dict[PortKey, PortTraffic]:
+    """Count the inbound connections per local port in table entries.
+
+    An entry is inbound when its original destination is one of
+    local_addresses (any address if None); only `ports` are counted if
+    given.  Entries are consumed one at a time, so memory is bounded by the
+    ports counted and MAX_PEERS, not by the size of the table.
+    """
+    if local_addresses is not None:
+        local_addresses = address_forms(local_addresses)
+    counts: Dict[PortKey, PortTraffic] = {}
+    for number, line in enumerate(lines):
+        if number % CANCEL_CHECK_EVERY == 0 and is_cancelled(token):
+            break
+        entry = parse_entry(line)
+        if entry is None:
+            continue
+        protocol, peer, local, port, assured, unreplied, size = entry
+        if local_addresses is not None and local not in local_addresses:
+            continue
+        key = (protocol, port)
+        if ports is not None and key not in ports:
+            continue
+        traffic = counts.get(key)
+        if traffic is None:
+            traffic = counts[key] = PortTraffic()
+        traffic.add(peer, assured, unreplied, size)
+    return counts
+
+def read_conntrack(local_addresses: Optional[Set[str]] = None,
+                   ports: Optional[Set[PortKey]] = None,
+                   token: Optional[CancelToken] = None) -> Optional[Dict[PortKey, PortTraffic]]:
+    """Tally the connection-tracking table, or None where it is not readable.
+
+    The /proc table is tried first and the conntrack tool, which reads the
+    table over netlink, second.  Both usually need root.
+    """
+    for path in CONNTRACK_PATHS:
+        try:
+            with open(path, 'r', errors='replace') as f:
+                return tally(f, local_addresses, ports, token)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            if debug_enabled():
+                logging.debug("Cannot read %s: %s", path, e)
+
+    if shutil.which(CONNTRACK_COMMAND[0]) is None:
+        return None
+    try:
+        process = subprocess.Popen(CONNTRACK_COMMAND, stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, text=True, errors='replace')
+    except OSError as e:
+        if debug_enabled():
+            logging.debug("Cannot run %s: %s", CONNTRACK_COMMAND[0], e)
+        return None
+    stopped_early = True
+    try:
+        counts = tally(process.stdout, local_addresses, ports, token)
+        stopped_early = is_cancelled(token)
+    finally:
+        process.stdout.close()
+        if stopped_early:
+            # Cancelled or failed mid-table; the rest is not wanted
+            process.terminate()
+        try:
+            returncode = process.wait(COMMAND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            returncode = process.wait()
+    if stopped_early:
+        # Incomplete counts, discarded by the caller
+        return counts
+    if returncode != 0:
+        # Typically missing privileges
+        if debug_enabled():
+            logging.debug("%s exited with status %d", CONNTRACK_COMMAND[0], returncode)
+        return None
+    return counts
+
+def annotate(finding: Dict, traffic: PortTraffic) -> Dict:
+    """Build the finding updated with the inbound traffic to its port"""
+    return dict(finding, traffic=traffic.summary())
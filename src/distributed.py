@@ -0,0 +1,455 @@
+"""
+Distributed scanning: a coordinator hands out leases of the scan plan to
+remote workers over a small framed TCP protocol
+"""
+
+import collections
+import hmac
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import resource_limits
+import targets
+from result_merge import ResultMerger
+from scanner import PortScanner
+
+PROTOCOL_VERSION = 1
+
+# Frames are a 4-byte big-endian length followed by a UTF-8 JSON object
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_BYTES = 1 << 20
+
+DEFAULT_COORDINATOR_PORT = 9876
+
+# Probes per lease; small enough that a lost lease costs little to redo
+DEFAULT_LEASE_SIZE = 256
+
+# A lease is re-issued if its worker sends nothing for this long (seconds)
+DEFAULT_LEASE_TIMEOUT = 15.0
+
+# Leases handed out this many times without completing are given up
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Workers report found ports at least this often, which also renews the lease
+REPORT_INTERVAL = 1.0
+REPORT_BATCH = 128
+
+# How long a worker waits before asking again when all work is leased out
+RETRY_DELAY = 1.0
+
+class FrameError(ValueError):
+    """Raised for malformed or oversized frames"""
+
+def send_frame(sock: socket.socket, message: Dict):
+    """Send one message as a length-prefixed JSON frame"""
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    if len(payload) > MAX_FRAME_BYTES:
+        raise FrameError(f"frame of {len(payload)} bytes exceeds {MAX_FRAME_BYTES}")
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+def recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Read exactly size bytes; None if the peer closed before the first byte"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise FrameError("connection closed inside a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def recv_frame(sock: socket.socket) -> Optional[Dict]:
+    """Receive one message; None when the peer closed the connection"""
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise FrameError(f"frame of {length} bytes exceeds {MAX_FRAME_BYTES}")
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        raise FrameError("connection closed inside a frame")
+    try:
+        message = json.loads(payload)
+    except ValueError as e:
+        raise FrameError(f"invalid frame: {e}") from None
+    if not isinstance(message, dict) or 'type' not in message:
+        raise FrameError("frame is not a message")
+    return message
+
+def parse_found(found) -> List[Tuple[str, int, str]]:
+    """Validate the (host, port, protocol) triples of a report"""
+    if not isinstance(found, list):
+        raise FrameError("found ports must be a list")
+    triples = []
+    for entry in found:
+        if not (isinstance(entry, list) and len(entry) == 3):
+            raise FrameError(f"invalid found port {entry!r}")
+        host, port, protocol = entry
+        if (not isinstance(host, str) or isinstance(port, bool) or not isinstance(port, int)
+                or not 0 < port < 65536 or protocol not in ('TCP', 'UDP')):
+            raise FrameError(f"invalid found port {entry!r}")
+        triples.append((host, port, protocol))
+    return triples
+
+def parse_address(spec: str, default_port: int = DEFAULT_COORDINATOR_PORT) -> Tuple[str, int]:
+    """Parse "host:port", "[v6]:port" or a bare host"""
+    spec = spec.strip()
+    if spec.startswith('['):
+        host, _, rest = spec[1:].partition(']')
+        port = rest.lstrip(':')
+    elif spec.count(':') == 1:
+        host, port = spec.split(':')
+    else:
+        host, port = spec, ''
+    return host, int(port) if port else default_port
+
+@dataclass
+class Lease:
+    """A slice of the scan plan: some ports on one host"""
+    id: int
+    host: str
+    ports: List[Tuple[int, List[str]]]
+    attempts: int = 0
+    owner: Optional['_WorkerSession'] = None
+    deadline: float = 0.0
+    probed: int = 0
+
+    def to_message(self) -> Dict:
+        return {'type': 'lease', 'lease': self.id, 'host': self.host,
+                'ports': [[port, protocols] for port, protocols in self.ports]}
+
+def build_leases(hosts: List[str], ports_to_scan: List[Dict],
+                 lease_size: int = DEFAULT_LEASE_SIZE) -> List[Lease]:
+    """Split hosts x ports into leases of at most lease_size ports.
+
+    Hosts are interleaved so concurrent workers spread over the targets.
+    """
+    ports = [(port_info['port'], list(port_info.get('protocols', ['TCP'])))
+             for port_info in ports_to_scan]
+    chunks = [ports[i:i + lease_size] for i in range(0, len(ports), lease_size)]
+    leases = []
+    for chunk in chunks:
+        for host in targets.interleave_families(hosts):
+            leases.append(Lease(len(leases) + 1, host, chunk))
+    return leases
+
+class _WorkerSession:
+    """Coordinator-side state of one connected worker"""
+
+    def __init__(self, name: str, address: Tuple):
+        self.name = name
+        self.address = address
+        self.leases: Dict[int, Lease] = {}
+
+class ScanCoordinator:
+    """Hands out leases of a scan plan to workers and collects their findings.
+
+    Workers connect, identify themselves and pull one lease at a time.  A
+    lease belongs to its worker until the worker completes it, disconnects,
+    or stays silent for lease_timeout seconds; in the last two cases it goes
+    back to the front of the queue for another worker.  Leases that fail
+    max_attempts times are given up and listed in `failed`.
+
+    Findings are merged per (host, protocol, port) with the worker names as
+    sources, so a port seen by several workers, or reported twice because a
+    lease was re-issued, stays one record.  result_callback receives every
+    new or changed record.
+    """
+
+    def __init__(self, hosts: List[str], ports_to_scan: List[Dict], host: str = '127.0.0.1',
+                 port: int = DEFAULT_COORDINATOR_PORT, lease_size: int = DEFAULT_LEASE_SIZE,
+                 lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, token: Optional[str] = None,
+                 result_callback: Optional[Callable[[Dict], None]] = None):
+        self.host = host
+        self.port = port
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.token = token
+        self.result_callback = result_callback
+        self.port_infos = {port_info['port']: port_info for port_info in ports_to_scan}
+        self.port_scanner = PortScanner()
+
+        self.leases = build_leases(hosts, ports_to_scan, lease_size)
+        self.pending: Deque[Lease] = collections.deque(self.leases)
+        self.completed = 0
+        self.failed: List[Lease] = []
+        self.merger = ResultMerger()
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.leases:
+            self.finished.set()
+
+        self.server: Optional[_CoordinatorServer] = None
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """Address workers connect to"""
+        return self.server.server_address[:2]
+
+    def start(self):
+        """Listen for workers in the background"""
+        family = targets.address_family(self.host)
+        if family == socket.AF_UNSPEC:
+            family = socket.AF_INET
+        self.server = _CoordinatorServer((self.host, self.port), family, self)
+        self._threads = [
+            threading.Thread(target=self.server.serve_forever, name='coordinator', daemon=True),
+            threading.Thread(target=self._expire_leases, name='lease-reaper', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"Coordinator listening on {self.address[0]} port {self.address[1]} "
+                     f"with {len(self.leases)} leases")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every lease completed or was given up"""
+        return self.finished.wait(timeout)
+
+    def stop(self):
+        """Stop accepting workers; connected workers are told to shut down"""
+        self._stopping.set()
+        self.finished.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self) -> 'ScanCoordinator':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def progress(self) -> int:
+        """Percentage of leases completed or given up"""
+        with self.lock:
+            done = self.completed + len(self.failed)
+        return 100 * done // len(self.leases) if self.leases else 100
+
+    def serve_worker(self, sock: socket.socket, address: Tuple):
+        """Run the protocol with one connected worker"""
+        try:
+            hello = recv_frame(sock)
+        except (OSError, FrameError) as e:
+            logging.debug(f"Connection from {address[0]} failed before hello: {e}")
+            return
+        if hello is None or hello.get('type') != 'hello':
+            return
+        if hello.get('version') != PROTOCOL_VERSION:
+            send_frame(sock, {'type': 'error', 'error': f"protocol version {PROTOCOL_VERSION} required"})
+            return
+        if self.token and not hmac.compare_digest(str(hello.get('token', '')), self.token):
+            send_frame(sock, {'type': 'error', 'error': 'invalid token'})
+            logging.warning(f"Rejected worker at {address[0]}: invalid token")
+            return
+
+        session = _WorkerSession(str(hello.get('name') or address[0]), address)
+        logging.info(f"Worker {session.name} connected from {address[0]}")
+        try:
+            while not self._stopping.is_set():
+                message = recv_frame(sock)
+                if message is None:
+                    break
+                kind = message['type']
+                if not isinstance(kind, str):
+                    raise FrameError("message type must be a string")
+                if kind == 'request':
+                    send_frame(sock, self._next_lease(session))
+                elif kind in ('report', 'done'):
+                    self._handle_report(session, message, completed=kind == 'done')
+                else:
+                    raise FrameError(f"unexpected message '{kind}'")
+        except (OSError, FrameError) as e:
+            logging.warning(f"Lost worker {session.name}: {e}")
+        finally:
+            self._release(session)
+            logging.info(f"Worker {session.name} disconnected")
+
+    def _next_lease(self, session: _WorkerSession) -> Dict:
+        with self.lock:
+            if self.finished.is_set() or self._stopping.is_set():
+                return {'type': 'shutdown'}
+            if not self.pending:
+                return {'type': 'wait', 'retry': RETRY_DELAY}
+            lease = self.pending.popleft()
+            lease.attempts += 1
+            lease.owner = session
+            lease.deadline = time.monotonic() + self.lease_timeout
+            session.leases[lease.id] = lease
+            return lease.to_message()
+
+    def _handle_report(self, session: _WorkerSession, message: Dict, completed: bool):
+        """Apply a report; raises FrameError for malformed ones"""
+        lease_id = message.get('lease')
+        probed = message.get('probed')
+        if isinstance(lease_id, bool) or not isinstance(lease_id, int):
+            raise FrameError("report without a lease id")
+        if probed is not None and (isinstance(probed, bool) or not isinstance(probed, int)):
+            raise FrameError("probed must be an integer")
+        found = parse_found(message.get('found', []))
+        with self.lock:
+            lease = session.leases.get(lease_id)
+            if lease is not None:
+                lease.deadline = time.monotonic() + self.lease_timeout
+                if probed is not None:
+                    lease.probed = probed
+                if completed:
+                    del session.leases[lease_id]
+                    lease.owner = None
+                    self.completed += 1
+                    self._check_finished()
+
+        # Findings are kept even from a lease that has since been re-issued;
+        # the merge makes the repeated report harmless
+        for host, port, protocol in found:
+            port_info = self.port_infos.get(port, {'port': port})
+            finding = self.port_scanner.make_finding(port_info, protocol, 'OPEN', host)
+            record, _ = self.merger.add(f"worker {session.name}", finding)
+            if record is not None and self.result_callback:
+                self.result_callback(record)
+
+    def _release(self, session: _WorkerSession):
+        """Put the leases of a lost worker back in the queue"""
+        with self.lock:
+            for lease in list(session.leases.values()):
+                self._requeue(lease)
+            session.leases.clear()
+
+    def _requeue(self, lease: Lease):
+        """Hand a lease to another worker, or give it up (lock held)"""
+        if lease.owner is not None:
+            lease.owner.leases.pop(lease.id, None)
+        lease.owner = None
+        if lease.attempts >= self.max_attempts:
+            logging.warning(f"Giving up lease {lease.id} ({lease.host}) after {lease.attempts} attempts")
+            self.failed.append(lease)
+            self._check_finished()
+        else:
+            logging.info(f"Re-issuing lease {lease.id} ({lease.host})")
+            self.pending.appendleft(lease)
+
+    def _expire_leases(self):
+        """Re-issue leases whose workers went silent"""
+        while not self._stopping.wait(min(1.0, self.lease_timeout / 4)):
+            now = time.monotonic()
+            with self.lock:
+                for lease in self.leases:
+                    if lease.owner is not None and lease.deadline < now:
+                        logging.warning(f"Lease {lease.id} of worker {lease.owner.name} expired")
+                        self._requeue(lease)
+
+    def _check_finished(self):
+        """Signal completion once every lease is done (lock held)"""
+        if self.completed + len(self.failed) == len(self.leases):
+            self.finished.set()
+
+class _WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.coordinator.serve_worker(self.request, self.client_address)
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    """TCP server of the coordinator, on IPv4 or IPv6"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], family: int, coordinator: ScanCoordinator):
+        self.address_family = family
+        self.coordinator = coordinator
+        super().__init__(address, _WorkerHandler)
+
+class ScanWorker:
+    """Connects to a coordinator and probes the leases it hands out.
+
+    Each lease is probed with a pool of probe_workers threads.  Open ports
+    are sent back in compact [host, port, protocol] form, batched every
+    REPORT_INTERVAL seconds or REPORT_BATCH findings; the reports double as
+    heartbeats that keep the lease.
+    """
+
+    def __init__(self, address: Tuple[str, int], name: Optional[str] = None,
+                 probe_workers: Optional[int] = None, timeout: float = 0.5,
+                 token: Optional[str] = None, fast: bool = True):
+        self.address = address
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.probe_workers = probe_workers or resource_limits.get_probe_window()
+        self.timeout = timeout
+        self.token = token
+        self.port_scanner = PortScanner(fast=fast)
+        self.leases_done = 0
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stop after the current report"""
+        self._stopping.set()
+
+    def run(self) -> int:
+        """Work until the coordinator has no more leases; returns the leases done"""
+        with socket.create_connection(self.address) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_frame(sock, {'type': 'hello', 'version': PROTOCOL_VERSION,
+                              'name': self.name, 'token': self.token or ''})
+            with ThreadPoolExecutor(max_workers=self.probe_workers,
+                                    thread_name_prefix='worker-probe') as pool:
+                while not self._stopping.is_set():
+                    send_frame(sock, {'type': 'request'})
+                    message = recv_frame(sock)
+                    if message is None or message['type'] == 'shutdown':
+                        break
+                    if message['type'] == 'error':
+                        raise ConnectionError(message.get('error', 'rejected by coordinator'))
+                    if message['type'] == 'wait':
+                        self._stopping.wait(message.get('retry', RETRY_DELAY))
+                        continue
+                    if message['type'] == 'lease':
+                        self._run_lease(sock, pool, message)
+        return self.leases_done
+
+    def _run_lease(self, sock: socket.socket, pool: ThreadPoolExecutor, lease: Dict):
+        host = lease['host']
+        futures = {pool.submit(self.port_scanner.probe_port,
+                               {'port': port, 'protocols': protocols}, host, self.timeout)
+                   for port, protocols in lease['ports']}
+        pending = futures
+        found: List[List] = []
+        probed = 0
+        last_report = time.monotonic()
+
+        while pending:
+            done, pending = wait(pending, timeout=REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                probed += 1
+                finding = future.result()
+                if finding:
+                    found.append([finding['host'], finding['port'], finding['protocol']])
+            if self._stopping.is_set():
+                for future in pending:
+                    future.cancel()
+                return
+            now = time.monotonic()
+            if pending and (len(found) >= REPORT_BATCH or now - last_report >= REPORT_INTERVAL):
+                send_frame(sock, {'type': 'report', 'lease': lease['lease'],
+                                  'probed': probed, 'found': found})
+                found = []
+                last_report = now
+
+        send_frame(sock, {'type': 'done', 'lease': lease['lease'], 'probed': probed, 'found': found})
+        self.leases_done += 1
@@ -0,0 +1,398 @@
+"""
+Streaming export of scan results to NDJSON, CSV, JSON and SARIF
+"""
+
+import csv
+import dataclasses
+import io
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, TextIO, Tuple
+
+from result_merge import result_key
+
+TOOL_NAME = 'Port-Scope'
+SARIF_VERSION = '2.1.0'
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+
+# Columns of the CSV export, in order
+CSV_COLUMNS = ['host', 'port', 'protocol', 'service', 'state', 'risk_level', 'risk_text',
+               'sources', 'states', 'product', 'tls_version', 'tls_issues',
+               'inbound_connections', 'description', 'risk_explanation', 'learn_more_url']
+
+# SARIF result levels by risk
+SARIF_LEVELS = {'High': 'error', 'Medium': 'warning', 'Low': 'note'}
+
+# Localization keys of the risk levels
+RISK_TEXT_KEYS = {'High': 'high_risk', 'Medium': 'medium_risk', 'Low': 'low_risk'}
+
+# Rows written between flushes of a file export
+FLUSH_EVERY = 256
+
+# Entries kept by the annotation cache before it is reset
+MAX_ANNOTATIONS = 4096
+
+def json_default(value):
+    """Convert the objects found in scan records to JSON types"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return str(value)
+
+class RecordAnnotator:
+    """Adds port database metadata and localized text to exported records.
+
+    The metadata only depends on the port, the identified service and the
+    language, so it is resolved once per combination and cached; every
+    further record with the same combination costs a dict lookup.
+    """
+
+    def __init__(self, port_db=None, localization=None, language: Optional[str] = None):
+        self.port_db = port_db
+        self.localization = localization
+        if language is None:
+            language = localization.current_language if localization else 'en'
+        self.language = language
+        self._cache: Dict[Tuple, Dict] = {}
+
+    def annotate(self, record: Dict) -> Dict:
+        """Get the export form of a record with its metadata"""
+        fingerprint = record.get('fingerprint')
+        service = fingerprint.service if fingerprint is not None else ''
+        key = (record['port'], service, record.get('risk_level'))
+        metadata = self._cache.get(key)
+        if metadata is None:
+            if len(self._cache) >= MAX_ANNOTATIONS:
+                self._cache.clear()
+            metadata = self._cache[key] = self._lookup(record['port'], service, record.get('risk_level'))
+        return export_record(record, metadata)
+
+    def _lookup(self, port: int, service: str, risk_level: Optional[str]) -> Dict:
+        port_data = {}
+        if self.port_db is not None:
+            if service:
+                port_data = self.port_db.get_service_info(service) or {}
+            if not port_data:
+                port_data = self.port_db.get_port_info(port)
+
+        risk_text = risk_level or ''
+        if self.localization is not None and risk_level in RISK_TEXT_KEYS:
+            risk_text = self._get_text(RISK_TEXT_KEYS[risk_level])
+
+        return {
+            'risk_text': risk_text,
+            'description': port_data.get(f"description_{self.language}",
+                                          port_data.get('description_en', '')),
+            'risk_explanation': port_data.get(f"risk_explanation_{self.language}",
+                                               port_data.get('risk_explanation_en', '')),
+            'learn_more_url': port_data.get('learn_more_url', ''),
+        }
+
+    def _get_text(self, key: str) -> str:
+        translations = self.localization.translations
+        return translations.get(self.language, {}).get(key) or self.localization.get_text(key)
+
+def export_record(record: Dict, metadata: Optional[Dict] = None) -> Dict:
+    """Build the flat export form of a scan record.
+
+    The parsed description tree of UPnP devices is dropped; its summary
+    fields stay in device_info.
+    """
+    exported = {field: value for field, value in record.items() if field != 'device_info'}
+    device_info = record.get('device_info')
+    if device_info:
+        exported['device_info'] = {field: value for field, value in device_info.items()
+                                   if field != 'description'}
+    if metadata:
+        exported.update(metadata)
+    return exported
+
+class ExportWriter:
+    """Base class of the export writers.
+
+    Records are written one at a time as they arrive; nothing but the
+    current record is held, so exports run in constant memory however many
+    results a scan produces.  close() writes whatever the format needs to
+    end the document.
+    """
+
+    # Whether a later record may be written as a line that replaces an
+    # earlier one with the same key; JSON documents need one per key
+    streams_updates = False
+
+    def __init__(self, stream: TextIO, annotator: Optional[RecordAnnotator] = None,
+                 flush_every: int = FLUSH_EVERY):
+        self.stream = stream
+        self.annotator = annotator
+        self.flush_every = flush_every
+        self.count = 0
+        self.closed = False
+
+    def __enter__(self) -> 'ExportWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record: Dict):
+        """Write one scan record"""
+        exported = self.annotator.annotate(record) if self.annotator else export_record(record)
+        self._write_record(exported)
+        self.count += 1
+        if self.flush_every and self.count % self.flush_every == 0:
+            self.stream.flush()
+
+    def write_all(self, records: Iterable[Dict]):
+        """Write several scan records"""
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        """End the document and close the stream"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._finish()
+            self.stream.flush()
+        finally:
+            self.stream.close()
+
+    def _write_record(self, exported: Dict):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+class NDJSONWriter(ExportWriter):
+    """One JSON object per line.
+
+    Streamed scans write a record again each time it changes; a later line
+    replaces the earlier ones with the same (host, protocol, port).
+    """
+
+    streams_updates = True
+
+    def _write_record(self, exported: Dict):
+        self.stream.write(json.dumps(exported, default=json_default, ensure_ascii=False))
+        self.stream.write('\n')
+
+class CSVWriter(ExportWriter):
+    """One row per record with the CSV_COLUMNS columns.
+
+    Like NDJSON, streamed scans write a record again each time it changes;
+    a later row replaces the earlier ones with the same (host, protocol,
+    port).
+    """
+
+    streams_updates = True
+
+    def __init__(self, stream: TextIO, annotator: Optional[RecordAnnotator] = None,
+                 flush_every: int = FLUSH_EVERY):
+        super().__init__(stream, annotator, flush_every)
+        self.writer = csv.DictWriter(stream, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def _write_record(self, exported: Dict):
+        row = dict(exported)
+        row['sources'] = ';'.join(exported.get('sources', []))
+        row['states'] = ';'.join(exported.get('states', []))
+        fingerprint = exported.get('fingerprint')
+        if fingerprint is not None:
+            row['product'] = ' '.join(part for part in (fingerprint.product, fingerprint.version) if part)
+        tls = exported.get('tls')
+        if tls is not None:
+            row['tls_version'] = tls.version
+            row['tls_issues'] = ';'.join(tls.issues)
+        traffic = exported.get('traffic')
+        if traffic is not None:
+            row['inbound_connections'] = traffic['connections']
+        self.writer.writerow(row)
+
+class JSONWriter(ExportWriter):
+    """A single JSON document with the records in a "results" array.
+
+    The array is written element by element; close() ends it and adds the
+    record count.
+    """
+
+    def __init__(self, stream: TextIO, annotator: Optional[RecordAnnotator] = None,
+                 flush_every: int = FLUSH_EVERY):
+        super().__init__(stream, annotator, flush_every)
+        generated = datetime.now(timezone.utc).isoformat()
+        self.stream.write(f'{{"tool": {json.dumps(TOOL_NAME)}, "generated": "{generated}", "results": [')
+
+    def _write_record(self, exported: Dict):
+        self.stream.write(',\n  ' if self.count else '\n  ')
+        self.stream.write(json.dumps(exported, default=json_default, ensure_ascii=False))
+
+    def _finish(self):
+        self.stream.write(f'\n], "count": {self.count}}}\n')
+
+class SARIFWriter(ExportWriter):
+    """A SARIF 2.1.0 log with one result per open port.
+
+    Results are streamed into the run's "results" array.  One rule is
+    created per service; the rules are small and only known at the end, so
+    the tool section is written after the results.
+    """
+
+    def __init__(self, stream: TextIO, annotator: Optional[RecordAnnotator] = None,
+                 flush_every: int = FLUSH_EVERY):
+        super().__init__(stream, annotator, flush_every)
+        self.rules: Dict[str, Dict] = {}
+        self.stream.write(f'{{"$schema": "{SARIF_SCHEMA}", "version": "{SARIF_VERSION}", '
+                          f'"runs": [{{"results": [')
+
+    def _write_record(self, exported: Dict):
+        rule_id = self._rule_id(exported)
+        if rule_id not in self.rules:
+            self.rules[rule_id] = {
+                'id': rule_id,
+                'name': exported.get('service', ''),
+                'shortDescription': {'text': exported.get('description') or exported.get('service', '')},
+                'fullDescription': {'text': exported.get('risk_explanation', '')},
+                'helpUri': exported.get('learn_more_url') or None,
+            }
+
+        endpoint = f"{exported.get('host', '')}:{exported['port']}/{exported.get('protocol', '')}"
+        message = f"{exported.get('service', '')} {exported.get('state', '')} on {endpoint}"
+        tls = exported.get('tls')
+        if tls is not None and tls.issues:
+            message += f" ({', '.join(tls.issues)})"
+        result = {
+            'ruleId': rule_id,
+            'level': SARIF_LEVELS.get(exported.get('risk_level'), 'note'),
+            'message': {'text': message},
+            'locations': [{'logicalLocations': [{'name': endpoint, 'kind': 'endpoint'}]}],
+            'properties': exported,
+        }
+        self.stream.write(',\n' if self.count else '\n')
+        self.stream.write(json.dumps(result, default=json_default, ensure_ascii=False))
+
+    def _rule_id(self, exported: Dict) -> str:
+        fingerprint = exported.get('fingerprint')
+        service = fingerprint.service if fingerprint is not None and fingerprint.service else exported.get('service', '')
+        return 'open-port/' + ''.join(c if c.isalnum() else '-' for c in service.lower()).strip('-')
+
+    def _finish(self):
+        rules = [{field: value for field, value in rule.items() if value is not None}
+                 for rule in self.rules.values()]
+        tool = {'driver': {'name': TOOL_NAME, 'rules': rules}}
+        self.stream.write(f'\n], "tool": {json.dumps(tool, ensure_ascii=False)}}}]}}\n')
+
+EXPORT_FORMATS = {
+    'ndjson': NDJSONWriter,
+    'csv': CSVWriter,
+    'json': JSONWriter,
+    'sarif': SARIFWriter,
+}
+
+# File extensions of the formats
+FORMAT_EXTENSIONS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.json': 'json',
+    '.sarif': 'sarif',
+}
+
+def format_for_path(path: str) -> str:
+    """Get the export format implied by a file name, NDJSON if unknown"""
+    name = path.lower()
+    if name.endswith('.sarif.json'):
+        return 'sarif'
+    return FORMAT_EXTENSIONS.get(os.path.splitext(name)[1], 'ndjson')
+
+def open_writer(path: str, export_format: Optional[str] = None,
+                annotator: Optional[RecordAnnotator] = None) -> ExportWriter:
+    """Open an export file for writing.
+
+    The format defaults to the one implied by the file name.  Raises
+    ValueError for unknown formats.
+    """
+    export_format = export_format or format_for_path(path)
+    writer_class = EXPORT_FORMATS.get(export_format)
+    if writer_class is None:
+        raise ValueError(f"unknown export format '{export_format}'")
+    stream = open(path, 'w', encoding='utf-8', newline='' if export_format == 'csv' else None)
+    return writer_class(stream, annotator)
+
+def export_string(records: Iterable[Dict], export_format: str,
+                  annotator: Optional[RecordAnnotator] = None) -> str:
+    """Export records to a string, for small result sets"""
+    buffer = io.StringIO()
+    writer = EXPORT_FORMATS[export_format](buffer, annotator)
+    writer.write_all(records)
+    writer._finish()
+    return buffer.getvalue()
+
+class StreamingExporter:
+    """Writes records handed over by scan threads on a writer thread.
+
+    put() only enqueues the record; a bounded queue limits how many records
+    wait for the disk, and a producer that gets ahead of the writer blocks
+    until there is room.  close() drains the queue and ends the document.
+
+    A record put again supersedes its earlier version.  NDJSON and CSV
+    write every version as it arrives, in constant memory; JSON and SARIF
+    documents keep the latest version per (host, protocol, port) and write
+    those on close(), so they hold one result per port.
+    """
+
+    def __init__(self, writer: ExportWriter, max_pending: int = 1024):
+        self.writer = writer
+        self.error: Optional[Exception] = None
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='export', daemon=True)
+        self._thread.start()
+
+    def put(self, record: Dict):
+        """Queue a record for writing"""
+        if not self._closed and self.error is None:
+            self._queue.put(record)
+
+    def close(self, timeout: Optional[float] = None):
+        """Write the remaining records and end the document"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        latest: Dict[Tuple, Dict] = {}
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                if self.error is not None:
+                    continue
+                if self.writer.streams_updates:
+                    self.writer.write(record)
+                else:
+                    latest[result_key(record)] = record
+            if self.error is None:
+                self.writer.write_all(latest.values())
+        except Exception as e:
+            self.error = e
+            logging.error(f"Export failed: {e}")
+            # Keep draining so producers never block on a dead writer
+            while self._queue.get() is not None:
+                pass
+        finally:
+            try:
+                self.writer.close()
+            except Exception as e:
+                logging.error(f"Failed to close export: {e}")
@@ -0,0 +1,190 @@
+"""
+Banner grabbing and service fingerprinting for open TCP ports
+"""
+
+import logging
+import re
+import socket
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from cancellation import CancelToken, create_connection, is_cancelled, watch
+from log_setup import debug_enabled
+
+# Light probes sent after the greeting wait, in order.  The HTTP request
+# also identifies Redis, which answers it with an error on the same
+# connection; the PING is only needed for servers that closed on it.
+PROBES: List[Tuple[str, bytes]] = [
+    ('greeting', b''),
+    ('http', b'HEAD / HTTP/1.0\r\n\r\n'),
+    ('redis', b'PING\r\n'),
+]
+
+# Signature table: service name as used in ports.json, and a pattern that
+# may capture the product and version.  Checked in order, first match wins.
+SIGNATURES: List[Tuple[str, bytes]] = [
+    ('SSH', rb'^SSH-[\d.]+-(?P<product>[^\s_-]+)[_-]?(?P<version>[^\s\r\n]*)'),
+    ('FTP', rb'^220[ -][^\r\n]*?(?P<product>FileZilla|vsFTPd|ProFTPD|Pure-FTPd|FTP)[ /]*(?P<version>[\d.]*)'),
+    ('SMTP', rb'^220[ -][^\r\n]*?(?P<product>Postfix|Exim|Sendmail|Microsoft ESMTP|ESMTP|SMTP)[ /]*(?P<version>[\d.]*)'),
+    ('POP3', rb'^\+OK(?P<product>[^\r\n]*)'),
+    ('IMAP', rb'^\* OK(?P<product>[^\r\n]*)'),
+    ('MySQL', rb'^.{3}\x00\x0a(?P<version>[0-9][^\x00]*)\x00'),
+    ('VNC', rb'^RFB (?P<version>\d{3}\.\d{3})'),
+    ('Redis', rb'^(?:\+PONG|-NOAUTH|-DENIED|-ERR unknown command)'),
+    ('HTTP', rb'^HTTP/(?P<version>\d\.\d) \d{3}'),
+    ('Telnet', rb'^\xff[\xfb-\xfe]'),
+]
+
+# Server header of HTTP responses, reported as the product
+HTTP_SERVER = re.compile(rb'\r\nServer:[ \t]*(?P<product>[^\r\n]*)', re.IGNORECASE)
+
+@dataclass
+class Fingerprint:
+    """Service identified on a port"""
+    service: str
+    product: str = ''
+    version: str = ''
+    banner: str = ''
+    probe: str = ''
+
+    @property
+    def description(self) -> str:
+        """Service with product and version, for display"""
+        details = ' '.join(part for part in (self.product, self.version) if part)
+        return f"{self.service} ({details})" if details else self.service
+
+def compile_signatures(signatures: List[Tuple[str, bytes]]) -> List[Tuple[str, Pattern]]:
+    """Compile a signature table once so matching is a plain scan"""
+    return [(service, re.compile(pattern, re.DOTALL)) for service, pattern in signatures]
+
+COMPILED_SIGNATURES = compile_signatures(SIGNATURES)
+
+def match_banner(data: bytes, probe: str = '',
+                 signatures: List[Tuple[str, Pattern]] = COMPILED_SIGNATURES) -> Optional[Fingerprint]:
+    """Match a response against the signature table"""
+    for service, pattern in signatures:
+        match = pattern.match(data)
+        if not match:
+            continue
+        groups = match.groupdict()
+        product = (groups.get('product') or b'').decode('latin-1').strip()
+        version = (groups.get('version') or b'').decode('latin-1').strip()
+        if service == 'HTTP':
+            server = HTTP_SERVER.search(data)
+            product = server.group('product').decode('latin-1').strip() if server else ''
+            version = ''
+        return Fingerprint(service, product, version, make_banner(data), probe)
+    return None
+
+def make_banner(data: bytes, limit: int = 120) -> str:
+    """Printable first line of a response"""
+    line = data.split(b'\n', 1)[0].rstrip(b'\r')
+    return ''.join(chr(b) if 32 <= b < 127 else '.' for b in line[:limit])
+
+class ServiceFingerprinter:
+    """Identifies the service on an open TCP port from its responses.
+
+    The port is connected and its greeting read; servers that speak first
+    (SSH, FTP, SMTP, POP3, IMAP, MySQL, VNC) are identified from that alone.
+    Otherwise the light probes are sent in turn.  Every exchange is bounded
+    by read_timeout and max_bytes, so a silent or chatty service cannot hold
+    a worker for long.  The identified service drives the risk lookup in the
+    port database.
+    """
+
+    def __init__(self, port_db=None, connect_timeout: float = 1.0, read_timeout: float = 0.5,
+                 max_bytes: int = 1024, workers: int = 16):
+        self.port_db = port_db
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_bytes = max_bytes
+        self.workers = workers
+
+    def identify(self, host: str, port: int,
+                 token: Optional[CancelToken] = None) -> Optional[Fingerprint]:
+        """Fingerprint a port; returns None if nothing answered or cancelled"""
+        banner = b''
+        sock = None
+        try:
+            for name, payload in PROBES:
+                if is_cancelled(token):
+                    return None
+                if sock is None:
+                    sock = self._connect(host, port, token)
+                    if sock is None:
+                        return None
+                with watch(token, sock):
+                    data = self._exchange(sock, payload)
+                if data:
+                    banner = banner or data
+                    fingerprint = match_banner(data, name)
+                    if fingerprint:
+                        return fingerprint
+                if data is None:
+                    # Connection closed; the next probe needs a new one
+                    sock.close()
+                    sock = None
+        finally:
+            if sock is not None:
+                sock.close()
+
+        if banner:
+            return Fingerprint('', banner=make_banner(banner))
+        return None
+
+    def apply(self, finding: Dict, fingerprint: Fingerprint) -> Dict:
+        """Build the finding updated with an identified service and its risk"""
+        updated = dict(finding, fingerprint=fingerprint)
+        if not fingerprint.service:
+            return updated
+
+        updated['service'] = fingerprint.description
+        service_info = self.port_db.get_service_info(fingerprint.service) if self.port_db else None
+        if service_info:
+            updated['risk_level'] = service_info.get('risk_level', finding.get('risk_level'))
+        return updated
+
+    def _connect(self, host: str, port: int,
+                 token: Optional[CancelToken] = None) -> Optional[socket.socket]:
+        try:
+            sock = create_connection((host, port), self.connect_timeout, token)
+        except OSError as e:
+            if debug_enabled():
+                logging.debug("Fingerprint connect to %s port %d failed: %s", host, port, e)
+            return None
+        sock.settimeout(self.read_timeout)
+        return sock
+
+    def _exchange(self, sock: socket.socket, payload: bytes) -> Optional[bytes]:
+        """Send a probe and read the answer within the time and byte limits.
+
+        Returns b'' if nothing arrived in time and None if the peer closed
+        the connection without answering.
+        """
+        data = b''
+        try:
+            if payload:
+                sock.sendall(payload)
+            deadline = time.monotonic() + self.read_timeout
+            while len(data) < self.max_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                chunk = sock.recv(self.max_bytes - len(data))
+                if not chunk:
+                    return data or None
+                data += chunk
+                # Stop once the answer is complete enough to match: the
+                # whole header block for HTTP, the first line otherwise
+                if data.startswith(b'HTTP/'):
+                    if b'\r\n\r\n' in data:
+                        break
+                elif data.endswith(b'\n') or match_banner(data):
+                    break
+            return data
+        except socket.timeout:
+            return data
+        except OSError:
+            return None
@@ -3,16 +3,28 @@ Main GUI application using tkinter
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext, filedialog
 import webbrowser
 import logging
-from typing import Dict, List, Callable
+from typing import Dict, List, Callable, Optional, Sequence
 import threading
+import time
 
 from scanner import PortScanner
+from cache import ScanCache
 from upnp_scanner import UPnPScanner
 from port_database import PortDatabase
 from localization import LocalizationManager
+from results_view import VirtualResultsView
+from result_index import ResultIndex
+from result_merge import result_key
+from fingerprint import ServiceFingerprinter
+from tls_inspect import TLSInspector
+from plugins import PluginRunner, load_plugins
+from exporters import RecordAnnotator, open_writer
+from scan_events import ScanEventQueue
+from scan_pipeline import ScanPipeline
+from ssdp_listener import DeviceCache, SSDPListener
 import sys
 import os
 
@@ -40,19 +52,35 @@ except ImportError:
                 'small': ('Arial', 9)
             }
 
+# Interval between scan event queue drains, and the time budget per drain
+FRAME_INTERVAL_MS = 50
+FRAME_BUDGET = 0.015
+
+# Minimum interval between result list refreshes while a scan is running
+RESULTS_REFRESH_INTERVAL = 0.25
+
 class NetworkSecurityApp:
     """Main GUI application class"""
     
     def __init__(self, root: tk.Tk, localization: LocalizationManager):
         self.root = root
         self.localization = localization
-        self.port_scanner = PortScanner()
-        self.upnp_scanner = UPnPScanner()
+        # Socket table, discovery and descriptions are reused by quick rescans
+        self.scan_cache = ScanCache()
+        self.port_scanner = PortScanner(scan_cache=self.scan_cache)
+        self.device_cache = DeviceCache()
+        self.device_cache.load()
+        self.upnp_scanner = UPnPScanner(device_cache=self.device_cache, scan_cache=self.scan_cache)
+        self.ssdp_listener = SSDPListener(self.device_cache)
         self.port_db = PortDatabase()
+        self.plugin_runner = PluginRunner(load_plugins())
         self.styles = AppStyles()
         
-        self.open_ports = []
-        self.filtered_ports = []
+        self.result_index = ResultIndex()
+        self.sort_key = 'port'
+        self.sort_descending = False
+        self.event_queue = None
+        self.scan_pipeline = None
         self.is_scanning = False
         
         self.setup_window()
@@ -65,6 +93,7 @@ class NetworkSecurityApp:
         self.root.geometry("1200x800")
         self.root.minsize(800, 600)
         self.root.configure(bg=self.styles.colors['bg_primary'])
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Configure style for ttk widgets
         style = ttk.Style()
@@ -74,11 +103,25 @@ class NetworkSecurityApp:
         style.configure('TFrame', background=self.styles.colors['bg_primary'])
         style.configure('TLabel', background=self.styles.colors['bg_primary'], 
                        foreground=self.styles.colors['text_primary'])
+        style.configure('TCheckbutton', background=self.styles.colors['bg_primary'],
+                       foreground=self.styles.colors['text_primary'])
         style.configure('TButton', background=self.styles.colors['accent_primary'],
                        foreground=self.styles.colors['text_primary'])
         style.map('TButton', background=[('active', self.styles.colors['accent_secondary'])])
         style.configure('TCombobox', background=self.styles.colors['bg_secondary'])
         style.configure('TProgressbar', background=self.styles.colors['accent_primary'])
+        style.configure('Results.Treeview',
+                       background=self.styles.colors['bg_secondary'],
+                       fieldbackground=self.styles.colors['bg_secondary'],
+                       foreground=self.styles.colors['text_primary'],
+                       font=self.styles.fonts['body'],
+                       rowheight=24)
+        style.configure('Results.Treeview.Heading',
+                       background=self.styles.colors['bg_primary'],
+                       foreground=self.styles.colors['text_primary'],
+                       font=self.styles.fonts['button'])
+        style.map('Results.Treeview',
+                  background=[('selected', self.styles.colors['accent_secondary'])])
     
     def create_widgets(self):
         """Create all GUI widgets"""
@@ -102,6 +145,13 @@ class NetworkSecurityApp:
         lang_frame = ttk.Frame(header_frame)
         lang_frame.pack(side=tk.RIGHT)
         
+        # Passive UPnP listener toggle
+        self.listener_var = tk.BooleanVar(value=False)
+        self.listener_check = ttk.Checkbutton(lang_frame, text="Listen for UPnP announcements",
+                                             variable=self.listener_var,
+                                             command=self.toggle_ssdp_listener)
+        self.listener_check.pack(side=tk.LEFT, padx=(0, 20))
+        
         self.lang_label = ttk.Label(lang_frame, text="Language:")
         self.lang_label.pack(side=tk.LEFT, padx=(0, 5))
         
@@ -127,6 +177,23 @@ class NetworkSecurityApp:
                                     padx=20, pady=8)
         self.scan_button.pack(side=tk.LEFT, padx=(0, 10))
         
+        # Export button
+        self.export_button = tk.Button(control_frame,
+                                      text="Export",
+                                      command=self.export_results,
+                                      font=self.styles.fonts['button'],
+                                      bg=self.styles.colors['bg_secondary'],
+                                      fg=self.styles.colors['text_primary'],
+                                      relief=tk.FLAT,
+                                      padx=20, pady=8)
+        self.export_button.pack(side=tk.LEFT, padx=(0, 10))
+        
+        # Bypass the cached socket table, discovery and descriptions
+        self.force_refresh_var = tk.BooleanVar(value=False)
+        self.force_refresh_check = ttk.Checkbutton(control_frame, text="Force refresh",
+                                                  variable=self.force_refresh_var)
+        self.force_refresh_check.pack(side=tk.LEFT, padx=(0, 10))
+        
         # Risk filter
         filter_frame = ttk.Frame(control_frame)
         filter_frame.pack(side=tk.LEFT, padx=(20, 0))
@@ -142,6 +209,15 @@ class NetworkSecurityApp:
         self.risk_filter_combo.pack(side=tk.LEFT)
         self.risk_filter_combo.bind('<<ComboboxSelected>>', self.apply_filter)
         
+        # Search by port, service or host
+        self.search_label = ttk.Label(filter_frame, text="Search:")
+        self.search_label.pack(side=tk.LEFT, padx=(20, 5))
+        
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(filter_frame, textvariable=self.search_var, width=24)
+        self.search_entry.pack(side=tk.LEFT)
+        self.search_var.trace_add('write', lambda *args: self.apply_filter())
+        
         # Progress bar
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(control_frame, 
@@ -156,36 +232,45 @@ class NetworkSecurityApp:
         results_frame = ttk.Frame(main_frame)
         results_frame.pack(fill=tk.BOTH, expand=True)
         
-        # Create scrollable frame for port cards
-        self.canvas = tk.Canvas(results_frame, 
-                               bg=self.styles.colors['bg_primary'],
-                               highlightthickness=0)
-        self.scrollbar = ttk.Scrollbar(results_frame, orient="vertical", 
-                                      command=self.canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.canvas)
-        
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        # Virtualized results list; only the visible rows are materialized
+        self.results_view = VirtualResultsView(
+            results_frame,
+            columns=[('port', 90), ('protocol', 90), ('service', 260),
+                     ('risk_level', 110), ('state', 140), ('host', 160)],
+            format_row=self.format_port_row,
+            on_select=self.show_port_details,
+            on_heading_click=self.sort_by
         )
+        self.results_view.set_row_styles({
+            level: self.port_db.get_risk_color(level) for level in ('High', 'Medium', 'Low')
+        })
+        self.results_view.pack(fill=tk.BOTH, expand=True)
         
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        
-        self.canvas.pack(side="left", fill="both", expand=True)
-        self.scrollbar.pack(side="right", fill="y")
-        
-        # Bind mouse wheel to canvas
-        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
-        self.root.bind("<MouseWheel>", self._on_mousewheel)
+        # Detail pane for the selected port
+        self.create_detail_pane(results_frame)
         
         # Status label
         self.status_label = ttk.Label(main_frame, text="Ready to scan")
         self.status_label.pack(pady=(10, 0))
     
-    def _on_mousewheel(self, event):
-        """Handle mouse wheel scrolling"""
-        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+    def toggle_ssdp_listener(self):
+        """Start or stop the passive UPnP announcement listener"""
+        if self.listener_var.get():
+            if not self.ssdp_listener.start():
+                self.listener_var.set(False)
+                messagebox.showwarning(self.localization.get_text('error'),
+                                       self.localization.get_text('listener_failed'))
+        else:
+            self.ssdp_listener.stop()
+    
+    def on_close(self):
+        """Stop background work and persist caches before closing"""
+        if self.scan_pipeline:
+            self.scan_pipeline.stop()
+        self.ssdp_listener.stop()
+        self.plugin_runner.stop()
+        self.device_cache.save()
+        self.root.destroy()
     
     def on_language_change(self, event=None):
         """Handle language change"""
@@ -200,8 +285,12 @@ class NetworkSecurityApp:
         """Update all text elements with current language"""
         self.title_label.config(text=self.localization.get_text('app_title'))
         self.scan_button.config(text=self.localization.get_text('scan_button'))
+        self.export_button.config(text=self.localization.get_text('export_button'))
+        self.force_refresh_check.config(text=self.localization.get_text('force_refresh'))
         self.lang_label.config(text=self.localization.get_text('language') + ":")
         self.filter_label.config(text=self.localization.get_text('filter_by_risk') + ":")
+        self.search_label.config(text=self.localization.get_text('search') + ":")
+        self.listener_check.config(text=self.localization.get_text('passive_upnp'))
         
         # Update filter combo values
         filter_values = [
@@ -212,8 +301,13 @@ class NetworkSecurityApp:
         ]
         self.risk_filter_combo.config(values=filter_values)
         
-        # Refresh port display
-        self.display_ports(self.filtered_ports)
+        self.update_headings()
+        self.learn_btn.config(text=self.localization.get_text('learn_more'))
+        self.close_btn.config(text=self.localization.get_text('how_to_close'))
+        
+        # Refresh the visible rows and the detail pane in place
+        self.results_view.refresh()
+        self.show_port_details(self.results_view.get_selected())
     
     def start_scan(self):
         """Start port scanning"""
@@ -230,100 +324,163 @@ class NetworkSecurityApp:
         # Clear previous results
         self.clear_results()
         
-        # Start scanning in separate thread
-        threading.Thread(target=self.run_scan, daemon=True).start()
+        # Fresh queue per scan so late events from a stopped scan are dropped
+        self.event_queue = ScanEventQueue()
+        self.scan_progress = {}
+        self.pending_sources = {'pipeline'}
+        self.results_dirty = False
+        self.last_results_refresh = 0.0
+        
+        self.run_scan()
+        self.root.after(FRAME_INTERVAL_MS, self.process_scan_events)
     
     def stop_scan(self):
         """Stop current scan"""
         self.is_scanning = False
-        self.port_scanner.stop_scan()
-        self.upnp_scanner.stop_scan()
+        self.event_queue = None
+        if self.scan_pipeline:
+            self.scan_pipeline.stop()
         self.scan_button.config(text=self.localization.get_text('scan_button'))
-        self.status_label.config(text="Scan stopped")
+        self.status_label.config(text=self.localization.get_text('scan_stopped'))
         self.progress_var.set(0)
         self.progress_label.config(text="")
     
     def run_scan(self):
-        """Run the complete scan process"""
+        """Run the complete scan process
+        
+        The scan pipeline runs the socket-table read, active probing, SSDP
+        discovery and device description fetching concurrently; all of them
+        write into the event queue, which is drained by process_scan_events.
+        """
         try:
-            all_ports = []
-            
             # Get ports to scan
             monitored_ports = self.port_db.get_all_monitored_ports()
             
-            # Phase 1: Local port scan
-            self.port_scanner.scan_common_ports(
-                monitored_ports,
-                progress_callback=self.update_scan_progress,
-                result_callback=lambda ports: all_ports.extend(ports)
-            )
-            
-            # Wait for local scan to complete
-            while self.port_scanner.is_scanning and self.is_scanning:
-                threading.Event().wait(0.1)
-            
-            if not self.is_scanning:
-                return
-            
-            # Phase 2: UPnP scan
-            self.upnp_scanner.scan_upnp_ports(
-                progress_callback=self.update_upnp_progress,
-                result_callback=lambda ports: all_ports.extend(ports)
-            )
-            
-            # Wait for UPnP scan to complete
-            while self.upnp_scanner.is_scanning and self.is_scanning:
-                threading.Event().wait(0.1)
-            
-            if self.is_scanning:
-                # Scan completed successfully
-                self.root.after(0, self.scan_completed, all_ports)
-            
+            self.scan_pipeline = ScanPipeline(self.port_scanner, self.upnp_scanner,
+                                              self.event_queue,
+                                              fingerprinter=ServiceFingerprinter(self.port_db),
+                                              tls_inspector=TLSInspector(self.port_db.get_tls_ports()),
+                                              plugin_runner=self.plugin_runner,
+                                              force_refresh=self.force_refresh_var.get())
+            self.scan_pipeline.start(monitored_ports)
         except Exception as e:
             logging.error(f"Scan error: {e}")
-            self.root.after(0, self.scan_error, str(e))
+            self.event_queue.put_error('pipeline', str(e))
     
-    def update_scan_progress(self, progress: int):
-        """Update scan progress (0-70% for local scan)"""
-        if self.is_scanning:
-            adjusted_progress = int(progress * 0.7)
-            self.root.after(0, self._update_progress, adjusted_progress)
+    def process_scan_events(self):
+        """Drain scan events on a fixed frame budget and update the UI once"""
+        events = self.event_queue
+        if not self.is_scanning or events is None:
+            return
+        
+        batch = events.drain(FRAME_BUDGET)
+        
+        if batch.results:
+            # Records are merged per port by the pipeline; a record arriving
+            # again replaces the earlier version
+            for record in batch.results:
+                self.result_index.upsert(result_key(record), record)
+            self.results_dirty = True
+        
+        if batch.progress:
+            self.scan_progress.update(batch.progress)
+            self._update_progress(self.get_overall_progress())
+        
+        # Re-query at a lower rate than the frame rate; only the visible
+        # rows are rewritten
+        now = time.monotonic()
+        if self.results_dirty and now - self.last_results_refresh >= RESULTS_REFRESH_INTERVAL:
+            self.refresh_results()
+            self.status_label.config(
+                text=f"{self.localization.get_text('scanning')} - {len(self.result_index)} {self.localization.get_text('ports_found')}"
+            )
+        
+        if batch.errors:
+            source, error_msg = batch.errors[0]
+            self.scan_error(error_msg)
+            return
+        
+        self.pending_sources.difference_update(batch.done)
+        if not self.pending_sources:
+            self.scan_completed()
+            return
+        
+        self.root.after(FRAME_INTERVAL_MS, self.process_scan_events)
     
-    def update_upnp_progress(self, progress: int):
-        """Update UPnP scan progress (70-100%)"""
-        if self.is_scanning:
-            adjusted_progress = 70 + int(progress * 0.3)
-            self.root.after(0, self._update_progress, adjusted_progress)
+    def get_overall_progress(self) -> int:
+        """Get the overall progress reported by the scan pipeline"""
+        return self.scan_progress.get('pipeline', 0)
     
     def _update_progress(self, progress: int):
         """Update progress bar and label"""
         self.progress_var.set(progress)
         self.progress_label.config(text=f"{progress}%")
     
-    def scan_completed(self, ports: List[Dict]):
+    def scan_completed(self):
         """Handle scan completion"""
         self.is_scanning = False
+        self.event_queue = None
         self.scan_button.config(text=self.localization.get_text('scan_button'))
         self.progress_var.set(100)
         self.progress_label.config(text="100%")
         
-        self.open_ports = ports
-        self.apply_filter()
+        self.refresh_results()
         
-        if ports:
-            self.status_label.config(text=f"{self.localization.get_text('scan_complete')} - {len(ports)} ports found")
+        if len(self.result_index):
+            self.status_label.config(text=f"{self.localization.get_text('scan_complete')} - {len(self.result_index)} {self.localization.get_text('ports_found')}")
         else:
             self.status_label.config(text=self.localization.get_text('no_open_ports'))
     
     def scan_error(self, error_msg: str):
         """Handle scan error"""
         self.is_scanning = False
+        self.event_queue = None
         self.scan_button.config(text=self.localization.get_text('scan_button'))
         self.status_label.config(text=f"{self.localization.get_text('error')}: {error_msg}")
         messagebox.showerror(self.localization.get_text('error'), f"Scan failed: {error_msg}")
     
+    def export_results(self):
+        """Export all current results to a file chosen by the user"""
+        path = filedialog.asksaveasfilename(
+            title=self.localization.get_text('export_button'),
+            defaultextension='.csv',
+            filetypes=[('CSV', '*.csv'), ('JSON', '*.json'), ('NDJSON', '*.ndjson'),
+                       ('SARIF', '*.sarif')]
+        )
+        if not path:
+            return
+        
+        # The writer thread gets its own list; records are never modified
+        # in place, so sharing them is safe
+        records = list(self.result_index.records)
+        annotator = RecordAnnotator(self.port_db, self.localization)
+        threading.Thread(target=self._write_export, args=(path, records, annotator),
+                         daemon=True).start()
+    
+    def _write_export(self, path: str, records: List[Dict], annotator: RecordAnnotator):
+        """Write an export file in the background and report the outcome"""
+        try:
+            with open_writer(path, annotator=annotator) as writer:
+                writer.write_all(records)
+            message = f"{self.localization.get_text('export_complete')}: {path}"
+            self.root.after(0, lambda: self.status_label.config(text=message))
+        except (OSError, ValueError) as e:
+            logging.error(f"Export to {path} failed: {e}")
+            error = f"{self.localization.get_text('export_failed')}: {e}"
+            self.root.after(0, lambda: messagebox.showerror(self.localization.get_text('error'), error))
+    
     def apply_filter(self, event=None):
         """Apply risk level filter"""
+        self.display_ports(self.query_results())
+    
+    def refresh_results(self):
+        """Show newly arrived results, keeping the scroll position"""
+        self.results_dirty = False
+        self.last_results_refresh = time.monotonic()
+        self.results_view.update_rows(self.query_results())
+    
+    def query_results(self) -> Sequence[Dict]:
+        """Query the result index with the current filter, search and sort"""
         filter_value = self.risk_filter_var.get()
         
         # Map localized filter values to English
@@ -335,126 +492,166 @@ class NetworkSecurityApp:
         }
         
         english_filter = filter_map.get(filter_value, filter_value)
-        self.filtered_ports = self.port_db.filter_ports_by_risk(self.open_ports, english_filter)
-        self.display_ports(self.filtered_ports)
+        return self.result_index.query(
+            filters={'risk_level': english_filter},
+            text=self.search_var.get(),
+            sort_key=self.sort_key,
+            descending=self.sort_descending
+        )
+    
+    def sort_by(self, column: str):
+        """Sort results by a column, toggling the direction on repeated clicks"""
+        if column == self.sort_key:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_key = column
+            self.sort_descending = False
+        self.update_headings()
+        self.apply_filter()
+    
+    def update_headings(self):
+        """Update column headings with the sort indicator"""
+        headings = {}
+        for column in ('port', 'protocol', 'service', 'risk_level', 'state', 'host'):
+            text = self.localization.get_text(column)
+            if column == self.sort_key:
+                text += " \u25bc" if self.sort_descending else " \u25b2"
+            headings[column] = text
+        self.results_view.set_headings(headings)
     
     def clear_results(self):
-        """Clear all port result widgets"""
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
+        """Clear all port results"""
+        self.result_index.clear()
+        self.results_view.set_rows([])
     
-    def display_ports(self, ports: List[Dict]):
-        """Display port information in cards"""
-        self.clear_results()
-        
-        if not ports:
-            no_ports_label = tk.Label(self.scrollable_frame,
-                                     text=self.localization.get_text('no_open_ports'),
-                                     font=self.styles.fonts['body'],
-                                     bg=self.styles.colors['bg_primary'],
-                                     fg=self.styles.colors['text_secondary'])
-            no_ports_label.pack(pady=20)
-            return
-        
-        for i, port_info in enumerate(ports):
-            self.create_port_card(port_info, i)
+    def display_ports(self, ports: Sequence[Dict]):
+        """Display port information in the results list"""
+        self.results_view.set_rows(ports)
     
-    def create_port_card(self, port_info: Dict, index: int):
-        """Create a card widget for a port"""
-        port_data = self.port_db.get_port_info(port_info['port'])
-        risk_color = self.port_db.get_risk_color(port_info['risk_level'])
-        
-        # Main card frame
-        card_frame = tk.Frame(self.scrollable_frame,
-                             bg=self.styles.colors['bg_secondary'],
-                             relief=tk.RAISED,
-                             bd=1)
-        card_frame.pack(fill=tk.X, padx=5, pady=5)
+    def format_port_row(self, port_info: Dict):
+        """Build the column values and row tag for a port"""
+        risk_level = port_info['risk_level']
+        risk_keys = {'High': 'high_risk', 'Medium': 'medium_risk', 'Low': 'low_risk'}
+        risk_text = self.localization.get_text(risk_keys[risk_level]) if risk_level in risk_keys else risk_level
+        values = (port_info['port'], port_info['protocol'], port_info['service'],
+                  risk_text, port_info['state'], port_info.get('host', ''))
+        return values, risk_level
+    
+    def create_detail_pane(self, parent: tk.Widget):
+        """Create the detail pane shown below the results list"""
+        detail_frame = tk.Frame(parent,
+                               bg=self.styles.colors['bg_secondary'],
+                               relief=tk.RAISED,
+                               bd=1)
+        detail_frame.pack(fill=tk.X, pady=(10, 0))
         
         # Risk indicator bar
-        risk_bar = tk.Frame(card_frame, bg=risk_color, height=4)
-        risk_bar.pack(fill=tk.X)
+        self.detail_risk_bar = tk.Frame(detail_frame, bg=self.styles.colors['bg_secondary'], height=4)
+        self.detail_risk_bar.pack(fill=tk.X)
         
-        # Card content
-        content_frame = tk.Frame(card_frame, bg=self.styles.colors['bg_secondary'])
+        content_frame = tk.Frame(detail_frame, bg=self.styles.colors['bg_secondary'])
         content_frame.pack(fill=tk.BOTH, expand=True, padx=15, pady=10)
         
-        # Header row
-        header_frame = tk.Frame(content_frame, bg=self.styles.colors['bg_secondary'])
-        header_frame.pack(fill=tk.X, pady=(0, 5))
-        
-        # Port and service info
-        port_label = tk.Label(header_frame,
-                             text=f"{self.localization.get_text('port')} {port_info['port']} ({port_info['protocol']})",
-                             font=self.styles.fonts['heading'],
-                             bg=self.styles.colors['bg_secondary'],
-                             fg=self.styles.colors['text_primary'])
-        port_label.pack(side=tk.LEFT)
-        
-        # Risk level badge
-        risk_label = tk.Label(header_frame,
-                             text=port_info['risk_level'],
-                             font=self.styles.fonts['small'],
-                             bg=risk_color,
-                             fg='white',
-                             padx=8, pady=2)
-        risk_label.pack(side=tk.RIGHT)
-        
-        # Service name
-        service_label = tk.Label(content_frame,
-                               text=f"{self.localization.get_text('service')}: {port_info['service']}",
-                               font=self.styles.fonts['body'],
-                               bg=self.styles.colors['bg_secondary'],
-                               fg=self.styles.colors['text_secondary'])
-        service_label.pack(anchor=tk.W, pady=(0, 5))
-        
-        # State
-        state_label = tk.Label(content_frame,
-                              text=f"{self.localization.get_text('state')}: {port_info['state']}",
-                              font=self.styles.fonts['body'],
-                              bg=self.styles.colors['bg_secondary'],
-                              fg=self.styles.colors['text_secondary'])
-        state_label.pack(anchor=tk.W, pady=(0, 10))
-        
-        # Description
-        desc_key = f"description_{self.localization.current_language}"
-        description = port_data.get(desc_key, port_data.get('description_en', ''))
-        
-        if description:
-            desc_label = tk.Label(content_frame,
-                                 text=description,
-                                 font=self.styles.fonts['body'],
-                                 bg=self.styles.colors['bg_secondary'],
-                                 fg=self.styles.colors['text_primary'],
-                                 wraplength=600,
-                                 justify=tk.LEFT)
-            desc_label.pack(anchor=tk.W, pady=(0, 10))
+        self.detail_title = tk.Label(content_frame,
+                                    text="",
+                                    font=self.styles.fonts['heading'],
+                                    bg=self.styles.colors['bg_secondary'],
+                                    fg=self.styles.colors['text_primary'])
+        self.detail_title.pack(anchor=tk.W, pady=(0, 5))
+        
+        self.detail_description = tk.Label(content_frame,
+                                          text="",
+                                          font=self.styles.fonts['body'],
+                                          bg=self.styles.colors['bg_secondary'],
+                                          fg=self.styles.colors['text_primary'],
+                                          wraplength=900,
+                                          justify=tk.LEFT)
+        self.detail_description.pack(anchor=tk.W, pady=(0, 10))
         
         # Buttons frame
         buttons_frame = tk.Frame(content_frame, bg=self.styles.colors['bg_secondary'])
         buttons_frame.pack(fill=tk.X)
         
         # Learn more button
-        learn_btn = tk.Button(buttons_frame,
-                             text=self.localization.get_text('learn_more'),
-                             command=lambda: self.open_learn_more(port_data),
-                             font=self.styles.fonts['button'],
-                             bg=self.styles.colors['accent_primary'],
-                             fg=self.styles.colors['text_primary'],
-                             relief=tk.FLAT,
-                             padx=15, pady=5)
-        learn_btn.pack(side=tk.LEFT, padx=(0, 10))
+        self.learn_btn = tk.Button(buttons_frame,
+                                  text="Learn More",
+                                  command=self.on_learn_more,
+                                  font=self.styles.fonts['button'],
+                                  bg=self.styles.colors['accent_primary'],
+                                  fg=self.styles.colors['text_primary'],
+                                  relief=tk.FLAT,
+                                  padx=15, pady=5)
+        self.learn_btn.pack(side=tk.LEFT, padx=(0, 10))
         
         # How to close button
-        close_btn = tk.Button(buttons_frame,
-                             text=self.localization.get_text('how_to_close'),
-                             command=lambda: self.show_close_guide(port_info),
-                             font=self.styles.fonts['button'],
-                             bg=self.styles.colors['bg_primary'],
-                             fg=self.styles.colors['text_primary'],
-                             relief=tk.FLAT,
-                             padx=15, pady=5)
-        close_btn.pack(side=tk.LEFT)
+        self.close_btn = tk.Button(buttons_frame,
+                                  text="How to Close",
+                                  command=self.on_how_to_close,
+                                  font=self.styles.fonts['button'],
+                                  bg=self.styles.colors['bg_primary'],
+                                  fg=self.styles.colors['text_primary'],
+                                  relief=tk.FLAT,
+                                  padx=15, pady=5)
+        self.close_btn.pack(side=tk.LEFT)
+    
+    def show_port_details(self, port_info: Optional[Dict]):
+        """Show the details of the selected port in the detail pane"""
+        if port_info is None:
+            if self.results_view.rows:
+                hint = self.localization.get_text('select_port_hint')
+            else:
+                hint = self.localization.get_text('no_open_ports')
+            self.detail_risk_bar.config(bg=self.styles.colors['bg_secondary'])
+            self.detail_title.config(text=hint)
+            self.detail_description.config(text="")
+            self.learn_btn.config(state=tk.DISABLED)
+            self.close_btn.config(state=tk.DISABLED)
+            return
+        
+        port_data = self.get_port_data(port_info)
+        desc_key = f"description_{self.localization.current_language}"
+        description = port_data.get(desc_key, port_data.get('description_en', ''))
+        tls = port_info.get('tls')
+        if tls is not None and tls.issues:
+            description += f"\n{self.localization.get_text('tls_issues')}: {', '.join(tls.issues)}"
+        summaries = [result['summary'] for result in port_info.get('plugins', {}).values()
+                     if result.get('summary')]
+        if summaries:
+            description += f"\n{self.localization.get_text('plugin_findings')}: {'; '.join(summaries)}"
+        traffic = port_info.get('traffic')
+        if traffic:
+            peers = f"{traffic['peers']}+" if traffic['peers_truncated'] else traffic['peers']
+            description += (f"\n{self.localization.get_text('inbound_connections')}: "
+                            f"{traffic['connections']} ({peers} {self.localization.get_text('peers')})")
+        
+        self.detail_risk_bar.config(bg=self.port_db.get_risk_color(port_info['risk_level']))
+        self.detail_title.config(
+            text=f"{self.localization.get_text('port')} {port_info['port']} ({port_info['protocol']}) - {port_info['service']}"
+        )
+        self.detail_description.config(text=description)
+        self.learn_btn.config(state=tk.NORMAL)
+        self.close_btn.config(state=tk.NORMAL)
+    
+    def get_port_data(self, port_info: Dict) -> Dict:
+        """Get the database entry for a result, by identified service if known"""
+        fingerprint = port_info.get('fingerprint')
+        if fingerprint is not None and fingerprint.service:
+            port_data = self.port_db.get_service_info(fingerprint.service)
+            if port_data:
+                return port_data
+        return self.port_db.get_port_info(port_info['port'])
+    
+    def on_learn_more(self):
+        """Open the learn more page for the selected port"""
+        port_info = self.results_view.get_selected()
+        if port_info:
+            self.open_learn_more(self.get_port_data(port_info))
+    
+    def on_how_to_close(self):
+        """Show the closing guide for the selected port"""
+        port_info = self.results_view.get_selected()
+        if port_info:
+            self.show_close_guide(port_info)
     
     def open_learn_more(self, port_data: Dict):
         """Open learn more URL in browser"""
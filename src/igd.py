@@ -0,0 +1,280 @@
+"""
+Port mapping enumeration for UPnP Internet Gateway Devices
+"""
+
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+
+from cancellation import CancelToken, bind_http, is_cancelled
+from log_setup import debug_enabled
+from upnp_description import DeviceDescription, ServiceRecord
+
+# Service types that expose the port mapping actions
+WAN_SERVICE_TYPES = (
+    'urn:schemas-upnp-org:service:WANIPConnection:',
+    'urn:schemas-upnp-org:service:WANPPPConnection:',
+)
+
+# UPnP errors that mark the end of the port mapping table.  713 is the
+# standard SpecifiedArrayIndexInvalid; some routers answer 714
+# NoSuchEntryInArray instead.
+END_OF_TABLE_ERRORS = (713, 714)
+
+# Requests a table starts with; the window grows by one per entry read, so
+# it doubles each round trip up to its limit while short and empty tables,
+# the common case, cost few requests past their end
+INITIAL_WINDOW = 2
+
+# Attempts at an entry whose request failed (HTTP error, timeout, or a
+# UPnP error other than END_OF_TABLE_ERRORS) before it is given up
+MAX_ATTEMPTS = 3
+
+# Consecutive entries given up after the last one read that end the table;
+# some routers answer indices past the end with a generic error
+FAILED_RUN_LIMIT = 4
+
+SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+CONTROL_NS = 'urn:schemas-upnp-org:control-1-0'
+
+# Response arguments of GetGenericPortMappingEntry and their result keys
+MAPPING_FIELDS = {
+    'NewRemoteHost': 'remote_host',
+    'NewExternalPort': 'external_port',
+    'NewProtocol': 'protocol',
+    'NewInternalPort': 'internal_port',
+    'NewInternalClient': 'internal_client',
+    'NewEnabled': 'enabled',
+    'NewPortMappingDescription': 'description',
+    'NewLeaseDuration': 'lease_duration',
+}
+
+def find_wan_services(description: DeviceDescription) -> List[ServiceRecord]:
+    """Get the WANIPConnection/WANPPPConnection services of a device tree"""
+    return [service for service in description.iter_services()
+            if service.control_url and service.service_type.startswith(WAN_SERVICE_TYPES)]
+
+def build_soap_request(service_type: str, action: str, arguments: Dict[str, str]) -> bytes:
+    """Build a SOAP envelope for a UPnP action"""
+    args = ''.join(f'<{name}>{value}</{name}>' for name, value in arguments.items())
+    return (
+        '<?xml version="1.0"?>'
+        f'<s:Envelope xmlns:s="{SOAP_NS}" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+        f'<s:Body><u:{action} xmlns:u="{service_type}">{args}</u:{action}></s:Body>'
+        '</s:Envelope>'
+    ).encode()
+
+def parse_upnp_error(content: bytes) -> Optional[int]:
+    """Extract the UPnP errorCode from a SOAP fault"""
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError:
+        return None
+    code = root.find(f'.//{{{CONTROL_NS}}}errorCode')
+    if code is None:
+        # Some devices omit the namespace on the UPnPError element
+        code = root.find('.//errorCode')
+    try:
+        return int(code.text) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def parse_mapping_entry(content: bytes) -> Dict:
+    """Parse a GetGenericPortMappingEntry response"""
+    root = ET.fromstring(content)
+    entry = {}
+    for element in root.iter():
+        # Response arguments are unqualified, but tolerate namespaced ones
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag in MAPPING_FIELDS:
+            entry[MAPPING_FIELDS[tag]] = (element.text or '').strip()
+
+    for key in ('external_port', 'internal_port', 'lease_duration'):
+        try:
+            entry[key] = int(entry.get(key) or 0)
+        except ValueError:
+            entry[key] = 0
+    entry['enabled'] = entry.get('enabled', '1') in ('1', 'true', 'yes')
+    entry['protocol'] = entry.get('protocol', 'TCP').upper()
+    return entry
+
+class _MappingTable:
+    """Progress of the enumeration of one service's mapping table"""
+
+    def __init__(self, control_url: str, service_type: str, max_entries: int, window: int):
+        self.control_url = control_url
+        self.service_type = service_type
+        self.window = window
+        self.entries: Dict[int, Dict] = {}
+        self.end_index = max_entries
+        self.next_index = 0
+        self.in_flight = 0
+        self.attempts: Dict[int, int] = {}
+        self.failed: Set[int] = set()
+        self.last_read = -1
+
+    def result(self) -> List[Dict]:
+        return [self.entries[index] for index in sorted(self.entries) if index < self.end_index]
+
+    def missing(self) -> List[int]:
+        """Indices before the end of the table that could not be read"""
+        return sorted(index for index in self.failed if index < self.end_index)
+
+class PortMappingEnumerator:
+    """Lists the port mappings of IGD WAN connection services.
+
+    GetGenericPortMappingEntry only returns one entry per call, so each table
+    is read with a sliding window of concurrent requests over the kept-alive
+    connections of a shared session.  The window starts at INITIAL_WINDOW
+    and widens to `window` as entries arrive.  Indices are issued in order
+    and the first end-of-table error caps the window, so at most `window`
+    requests are sent past the end of a table, fewer when queued ones are
+    dropped.  Failed requests are retried; entries that still fail are
+    skipped with a warning that the table is incomplete.
+    The requests of all tables, of one device or many and from any number
+    of callers, run on one pool of `workers` threads kept by the enumerator.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, window: int = 8,
+                 timeout: float = 5.0, max_entries: int = 4096, workers: int = 8):
+        self.session = session or requests.Session()
+        self.window = window
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='igd-mapping')
+            return self._pool
+
+    def get_entry(self, control_url: str, service_type: str, index: int,
+                  token: Optional[CancelToken] = None) -> Tuple[str, Optional[Dict]]:
+        """Fetch one mapping entry.
+
+        Returns ('ok', entry), ('end', None) at the end of the table or
+        ('error', None) if the request failed.
+        """
+        action = 'GetGenericPortMappingEntry'
+        headers = {
+            'Content-Type': 'text/xml; charset="utf-8"',
+            'SOAPAction': f'"{service_type}#{action}"',
+        }
+        body = build_soap_request(service_type, action, {'NewPortMappingIndex': str(index)})
+        try:
+            with bind_http(token):
+                response = self.session.post(control_url, data=body, headers=headers,
+                                             timeout=self.timeout)
+            if response.status_code == 200:
+                return 'ok', parse_mapping_entry(response.content)
+
+            error_code = parse_upnp_error(response.content)
+            if error_code in END_OF_TABLE_ERRORS:
+                return 'end', None
+            if debug_enabled():
+                logging.debug("Port mapping %d at %s failed: HTTP %d, UPnP error %s",
+                              index, control_url, response.status_code, error_code)
+        except Exception as e:
+            if debug_enabled():
+                logging.debug("Port mapping %d at %s failed: %s", index, control_url, e)
+        return 'error', None
+
+    def enumerate_tables(self, services: List[Tuple[str, str]],
+                         token: Optional[CancelToken] = None) -> List[List[Dict]]:
+        """List the port mappings of several (control URL, service type)
+        tables at once, each in table order; stops when cancelled"""
+        initial_window = min(INITIAL_WINDOW, self.window)
+        tables = [_MappingTable(control_url, service_type, self.max_entries, initial_window)
+                  for control_url, service_type in services]
+        pool = self._get_pool()
+        in_flight = {}
+
+        def submit(table: _MappingTable, index: int):
+            future = pool.submit(self.get_entry, table.control_url, table.service_type,
+                                 index, token)
+            in_flight[future] = (table, index)
+            table.in_flight += 1
+
+        def fill_window(table: _MappingTable):
+            while (table.in_flight < table.window and table.next_index < table.end_index
+                   and not is_cancelled(token)):
+                submit(table, table.next_index)
+                table.next_index += 1
+
+        def end_table(table: _MappingTable, index: int):
+            # Requests for later indices still queued are dropped
+            table.end_index = index
+            for other, (other_table, other_index) in in_flight.items():
+                if other_table is table and other_index > index:
+                    other.cancel()
+
+        for table in tables:
+            fill_window(table)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            touched = {}
+            for future in done:
+                table, index = in_flight.pop(future)
+                table.in_flight -= 1
+                touched[id(table)] = table
+                if future.cancelled() or index >= table.end_index:
+                    continue
+                status, entry = future.result()
+                if status == 'ok':
+                    entry['index'] = index
+                    table.entries[index] = entry
+                    table.last_read = max(table.last_read, index)
+                    table.window = min(table.window + 1, self.window)
+                elif status == 'end':
+                    end_table(table, index)
+                elif table.attempts.get(index, 1) < MAX_ATTEMPTS and not is_cancelled(token):
+                    table.attempts[index] = table.attempts.get(index, 1) + 1
+                    submit(table, index)
+                else:
+                    table.failed.add(index)
+                    failed_run = [failed for failed in table.failed if failed > table.last_read]
+                    if len(failed_run) >= FAILED_RUN_LIMIT:
+                        end_table(table, min(failed_run))
+            for table in touched.values():
+                fill_window(table)
+
+        for table in tables:
+            missing = table.missing()
+            if missing and not is_cancelled(token):
+                logging.warning(f"Port mapping table at {table.control_url} is incomplete: "
+                                f"{len(missing)} entries could not be read (indices "
+                                f"{', '.join(map(str, missing[:10]))}{'...' if len(missing) > 10 else ''})")
+        return [table.result() for table in tables]
+
+    def enumerate(self, control_url: str, service_type: str,
+                  token: Optional[CancelToken] = None) -> List[Dict]:
+        """List all port mappings of a service, in table order; stops when cancelled"""
+        return self.enumerate_tables([(control_url, service_type)], token)[0]
+
+    def enumerate_devices(self, descriptions: List[DeviceDescription],
+                          token: Optional[CancelToken] = None) -> List[List[Dict]]:
+        """List the port mappings of every WAN connection service of several
+        devices at once, one list per device"""
+        services = [(position, service) for position, description in enumerate(descriptions)
+                    for service in find_wan_services(description)]
+        tables = self.enumerate_tables(
+            [(service.control_url, service.service_type) for _, service in services], token)
+        mappings: List[List[Dict]] = [[] for _ in descriptions]
+        for (position, service), entries in zip(services, tables):
+            for entry in entries:
+                entry['service_type'] = service.service_type
+                mappings[position].append(entry)
+        return mappings
+
+    def enumerate_device(self, description: DeviceDescription,
+                         token: Optional[CancelToken] = None) -> List[Dict]:
+        """List the port mappings of every WAN connection service of a device"""
+        return self.enumerate_devices([description], token)[0]
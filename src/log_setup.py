@@ -0,0 +1,73 @@
+"""
+Logging setup that keeps handler I/O off the scan threads
+"""
+
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DEFAULT_LOG_FILE = 'network_scanner.log'
+
+# Running listener per logger
+_listeners: Dict[logging.Logger, QueueListener] = {}
+
+def stop_queue_logging(logger: Optional[logging.Logger] = None):
+    """Stop the listener of a logger, writing out the records still queued"""
+    logger = logger or logging.getLogger()
+    listener = _listeners.pop(logger, None)
+    if listener is not None:
+        listener.stop()
+
+def _stop_all():
+    for logger in list(_listeners):
+        stop_queue_logging(logger)
+
+atexit.register(_stop_all)
+
+def start_queue_logging(handlers: List[logging.Handler], logger: Optional[logging.Logger] = None,
+                        level: int = logging.INFO) -> QueueListener:
+    """Route a logger through a queue to handlers run by a listener thread.
+
+    Logging calls only put the record on the queue; formatting output and
+    writing files or the console happens on the listener thread.  The
+    listener is stopped, and the queue flushed, at interpreter exit or when
+    the logger is set up again.
+    """
+    logger = logger or logging.getLogger()
+    stop_queue_logging(logger)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners[logger] = listener
+    return listener
+
+def setup_queue_logging(level: int = logging.INFO, log_file: Optional[str] = DEFAULT_LOG_FILE,
+                        console: bool = True) -> QueueListener:
+    """Log to a file and the console through a queue"""
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return start_queue_logging(handlers, level=level)
+
+def debug_enabled() -> bool:
+    """Check whether debug messages would be logged.
+
+    Hot loops test this before building a debug message, so the message
+    costs nothing when debug logging is off.
+    """
+    return logging.root.isEnabledFor(logging.DEBUG)
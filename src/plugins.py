@@ -0,0 +1,367 @@
+"""
+Plugins with custom service probes for open ports
+"""
+
+import asyncio
+import concurrent.futures
+import importlib.metadata
+import importlib.util
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cancellation import CancelToken
+from log_setup import debug_enabled
+from result_merge import most_severe
+
+# Entry point group under which installed packages register plugins
+ENTRY_POINT_GROUP = 'portscope.plugins'
+
+# Directories searched for plugin modules: the bundled plugins and the user's
+BUNDLED_PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'plugins')
+USER_PLUGIN_DIR = os.path.join(os.path.expanduser('~'), '.portscope', 'plugins')
+
+# Result fields every plugin may set besides its own schema
+COMMON_RESULT_FIELDS = {'risk_level': str, 'summary': str}
+RISK_LEVELS = ('High', 'Medium', 'Low')
+
+class ProbePlugin:
+    """Base class of probe plugins.
+
+    A plugin declares the ports and/or service names it handles and
+    implements probe() as a coroutine that examines one open port and
+    returns a result dict, or None if it found nothing.  result_schema maps
+    the fields the result may contain to their types; a result may also set
+    "risk_level" (High, Medium or Low) and a one-line "summary".  Fields
+    outside the schema are dropped, and a result with a field of the wrong
+    type is discarded.
+
+    probe() runs on the plugin event loop and must not block it: use
+    asyncio streams, or loop.run_in_executor() for blocking libraries.  It
+    is cancelled after `timeout` seconds.
+    """
+
+    name = ''
+    ports: Tuple[int, ...] = ()
+    services: Tuple[str, ...] = ()
+    protocols: Tuple[str, ...] = ('TCP',)
+    result_schema: Dict[str, type] = {}
+    timeout = 5.0
+
+    def handles(self, finding: Dict) -> bool:
+        """Check whether the plugin wants to probe a finding"""
+        return self.handles_port(finding) or self.handles_service(finding)
+
+    def handles_port(self, finding: Dict) -> bool:
+        """Check whether the plugin handles the port of a finding"""
+        return finding.get('protocol') in self.protocols and finding['port'] in self.ports
+
+    def handles_service(self, finding: Dict) -> bool:
+        """Check whether the plugin handles the service of a finding.
+
+        The service identified by fingerprinting is used where there is
+        one, else the name looked up by port number.
+        """
+        if not self.services or finding.get('protocol') not in self.protocols:
+            return False
+        fingerprint = finding.get('fingerprint')
+        service = getattr(fingerprint, 'service', None) or finding.get('service', '')
+        return any(name.lower() == str(service).lower() for name in self.services)
+
+    async def probe(self, host: str, port: int, finding: Dict) -> Optional[Dict]:
+        raise NotImplementedError
+
+def validate_result(plugin: ProbePlugin, result: Dict) -> Optional[Dict]:
+    """Keep the schema fields of a result; None if a field has the wrong type"""
+    schema = dict(COMMON_RESULT_FIELDS, **plugin.result_schema)
+    valid = {}
+    for field, value in result.items():
+        expected = schema.get(field)
+        if expected is None:
+            if debug_enabled():
+                logging.debug("Plugin %s returned field %s outside its schema", plugin.name, field)
+            continue
+        if value is not None and not isinstance(value, expected):
+            logging.warning(f"Plugin {plugin.name} returned {type(value).__name__} for {field}, "
+                            f"expected {getattr(expected, '__name__', expected)}")
+            return None
+        valid[field] = value
+    if valid.get('risk_level') not in (None,) + RISK_LEVELS:
+        logging.warning(f"Plugin {plugin.name} returned unknown risk level {valid['risk_level']}")
+        valid.pop('risk_level')
+    return valid
+
+def check_plugin(plugin: ProbePlugin) -> bool:
+    """Check that a plugin is usable, logging why it is not"""
+    if not plugin.name:
+        logging.warning(f"Ignoring plugin {type(plugin).__name__} without a name")
+        return False
+    if type(plugin).probe is ProbePlugin.probe or not asyncio.iscoroutinefunction(plugin.probe):
+        logging.warning(f"Ignoring plugin {plugin.name}: probe() is not a coroutine")
+        return False
+    if not plugin.ports and not plugin.services:
+        logging.warning(f"Ignoring plugin {plugin.name}: it declares no ports or services")
+        return False
+    return True
+
+def instantiate(obj) -> List[ProbePlugin]:
+    """Turn a plugin class, instance or list of them into instances"""
+    if isinstance(obj, (list, tuple)):
+        return [plugin for item in obj for plugin in instantiate(item)]
+    if isinstance(obj, type) and issubclass(obj, ProbePlugin):
+        return [obj()]
+    if isinstance(obj, ProbePlugin):
+        return [obj]
+    raise TypeError(f"{obj!r} is not a ProbePlugin")
+
+def load_module_plugins(path: str) -> List[ProbePlugin]:
+    """Load the plugins of a module file.
+
+    The module lists them in PLUGINS; without it, every ProbePlugin
+    subclass defined in the module is used.
+    """
+    module_name = 'portscope_plugin_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if hasattr(module, 'PLUGINS'):
+        return instantiate(module.PLUGINS)
+    return instantiate([obj for obj in vars(module).values()
+                        if isinstance(obj, type) and issubclass(obj, ProbePlugin)
+                        and obj is not ProbePlugin and obj.__module__ == module_name])
+
+def load_plugins(directories: Iterable[str] = (BUNDLED_PLUGIN_DIR, USER_PLUGIN_DIR),
+                 group: str = ENTRY_POINT_GROUP) -> List[ProbePlugin]:
+    """Load the plugins registered as entry points and found in directories.
+
+    A plugin that fails to load is logged and skipped; of several plugins
+    with the same name the first one loaded is used.
+    """
+    found: List[ProbePlugin] = []
+    for entry_point in importlib.metadata.entry_points(group=group):
+        try:
+            found.extend(instantiate(entry_point.load()))
+        except Exception as e:
+            logging.error(f"Failed to load plugin entry point {entry_point.name}: {e}")
+
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.py') or filename.startswith('_'):
+                continue
+            try:
+                found.extend(load_module_plugins(os.path.join(directory, filename)))
+            except Exception as e:
+                logging.error(f"Failed to load plugin module {filename}: {e}")
+
+    plugins: Dict[str, ProbePlugin] = {}
+    for plugin in found:
+        if not check_plugin(plugin):
+            continue
+        if plugin.name in plugins:
+            logging.warning(f"Ignoring duplicate plugin {plugin.name}")
+            continue
+        plugins[plugin.name] = plugin
+    if plugins:
+        logging.info(f"Loaded {len(plugins)} plugins: {', '.join(plugins)}")
+    return list(plugins.values())
+
+@dataclass
+class PluginStats:
+    """Run counts and timing of one plugin"""
+    name: str
+    runs: int = 0
+    results: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    def record(self, duration: float, outcome: str):
+        if outcome == 'skipped':
+            self.skipped += 1
+            return
+        self.runs += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        if outcome == 'result':
+            self.results += 1
+        elif outcome == 'timeout':
+            self.timeouts += 1
+        elif outcome == 'error':
+            self.errors += 1
+
+    def summary(self) -> Dict:
+        return {
+            'name': self.name,
+            'runs': self.runs,
+            'results': self.results,
+            'timeouts': self.timeouts,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'total_ms': round(self.total_time * 1000, 1),
+            'avg_ms': round(self.total_time * 1000 / self.runs, 1) if self.runs else 0.0,
+            'max_ms': round(self.max_time * 1000, 1),
+        }
+
+class PluginRunner:
+    """Runs plugin probes for open ports on a dedicated event loop.
+
+    At most `workers` probes run at once, and at most `per_plugin` of them
+    for any one plugin, so a slow plugin holds only its own slots.  A probe
+    that has not finished, or not even found a free slot, within the
+    plugin's timeout is cancelled, so run() never blocks a scan thread for
+    longer than the slowest timeout.  Timing is recorded per plugin so
+    expensive probes are visible.
+    """
+
+    def __init__(self, plugins: Iterable[ProbePlugin], workers: int = 8, per_plugin: int = 2):
+        self.plugins = list(plugins)
+        self.workers = workers
+        self.per_plugin = per_plugin
+        self.stats = {plugin.name: PluginStats(plugin.name) for plugin in self.plugins}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._plugin_slots: Dict[str, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.plugins)
+
+    def start(self):
+        """Start the event loop thread if it is not running"""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            # Semaphores bind to the loop that first waits on them, so each
+            # new loop gets its own
+            self._slots = asyncio.Semaphore(self.workers)
+            self._plugin_slots = {plugin.name: asyncio.Semaphore(self.per_plugin)
+                                  for plugin in self.plugins}
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._run_loop, args=(self._loop,), name='plugins',
+                             daemon=True).start()
+
+    def stop(self):
+        """Cancel the running probes and stop the event loop, without waiting"""
+        with self._start_lock:
+            if self._loop is not None:
+                asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+                self._loop = None
+
+    def wants(self, finding: Dict) -> bool:
+        """Check whether any plugin handles a finding"""
+        return any(plugin.handles(finding) for plugin in self.plugins)
+
+    def port_plugins(self, finding: Dict) -> List[ProbePlugin]:
+        """The plugins that handle the port of a finding"""
+        return [plugin for plugin in self.plugins if plugin.handles_port(finding)]
+
+    def service_plugins(self, finding: Dict) -> List[ProbePlugin]:
+        """The plugins that handle the service of a finding but not its port"""
+        return [plugin for plugin in self.plugins
+                if plugin.handles_service(finding) and not plugin.handles_port(finding)]
+
+    def run(self, finding: Dict, token: Optional[CancelToken] = None,
+            plugins: Optional[List[ProbePlugin]] = None) -> Dict[str, Dict]:
+        """Run plugins on a finding; returns results by plugin name.
+
+        Runs the given plugins, or every plugin that handles the finding.
+        Blocks the calling thread until the plugins finish, time out or the
+        token is cancelled.
+        """
+        if plugins is None:
+            plugins = [plugin for plugin in self.plugins if plugin.handles(finding)]
+        if not plugins:
+            return {}
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._run_all(plugins, finding), self._loop)
+        handle = token.add_callback(future.cancel) if token is not None else None
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            return {}
+        finally:
+            if token is not None:
+                token.remove_callback(handle)
+
+    def apply(self, finding: Dict, results: Dict[str, Dict]) -> Dict:
+        """Build the finding updated with plugin results and the risk they report.
+
+        Plugins without a risk level leave the looked-up risk in effect.
+        """
+        updated = dict(finding, plugins=results)
+        # None when no plugin reports a risk: no opinion, which the merger
+        # leaves to the other sources
+        updated['risk_level'] = most_severe(result.get('risk_level') for result in results.values())
+        return updated
+
+    def timings(self) -> List[Dict]:
+        """Timing summary per plugin, most expensive first"""
+        with self._stats_lock:
+            summaries = [stats.summary() for stats in self.stats.values()]
+        return sorted(summaries, key=lambda summary: summary['total_ms'], reverse=True)
+
+    def log_timings(self):
+        """Log the timing summary of the plugins that ran"""
+        for summary in self.timings():
+            if summary['runs']:
+                logging.info(f"Plugin {summary['name']}: {summary['runs']} runs, "
+                             f"{summary['avg_ms']} ms average, {summary['max_ms']} ms max, "
+                             f"{summary['timeouts']} timeouts, {summary['skipped']} skipped, "
+                             f"{summary['errors']} errors")
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
+    async def _run_all(self, plugins: List[ProbePlugin], finding: Dict) -> Dict[str, Dict]:
+        outcomes = await asyncio.gather(*(self._run_one(plugin, finding) for plugin in plugins))
+        return {plugin.name: result for plugin, result in zip(plugins, outcomes) if result}
+
+    async def _run_one(self, plugin: ProbePlugin, finding: Dict) -> Optional[Dict]:
+        # The deadline covers waiting for a slot, so a finding never waits
+        # longer than the plugin's timeout behind a backlog of slow probes
+        start = None
+        outcome = 'empty'
+        result = None
+        try:
+            async with asyncio.timeout(plugin.timeout):
+                async with self._slots, self._plugin_slots[plugin.name]:
+                    start = time.perf_counter()
+                    raw = await plugin.probe(finding['host'], finding['port'], finding)
+            if raw:
+                result = validate_result(plugin, raw)
+                outcome = 'error' if result is None else 'result'
+        except TimeoutError:
+            outcome = 'timeout' if start is not None else 'skipped'
+            if debug_enabled():
+                logging.debug("Plugin %s %s on %s port %d", plugin.name,
+                              'timed out' if start is not None else 'found no free slot',
+                              finding['host'], finding['port'])
+        except Exception as e:
+            outcome = 'error'
+            if debug_enabled():
+                logging.debug("Plugin %s failed on %s port %d: %s",
+                              plugin.name, finding['host'], finding['port'], e)
+        finally:
+            duration = time.perf_counter() - start if start is not None else 0.0
+            with self._stats_lock:
+                self.stats[plugin.name].record(duration, outcome)
+        return result
@@ -5,13 +5,14 @@ Port database management and risk assessment
 import json
 import os
 import logging
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Set
 
 class PortDatabase:
     """Manages the port database with risk assessments and educational content"""
     
     def __init__(self):
         self.ports_data = {}
+        self._services = None
         self.load_port_data()
     
     def load_port_data(self):
@@ -82,6 +83,28 @@ class PortDatabase:
                 "learn_more_url": "https://www.speedguide.net/ports.php"
             }
     
+    def get_service_info(self, service: str) -> Optional[Dict]:
+        """Get the entry for a service by name, e.g. an identified service
+        
+        Lets risk follow what actually runs on a port rather than the port
+        number.  Names are matched case-insensitively; the lowest port with
+        the service wins.
+        """
+        if self._services is None:
+            self._services = {}
+            for port_str in sorted(self.ports_data, key=lambda p: int(p) if p.isdigit() else 0):
+                name = self.ports_data[port_str].get('service', '').lower()
+                self._services.setdefault(name, self.ports_data[port_str])
+        return self._services.get(service.lower())
+    
+    def get_tls_ports(self) -> Set[int]:
+        """Get the ports whose service speaks TLS from the first byte"""
+        tls_ports = set()
+        for port_str, port_data in self.ports_data.items():
+            if port_data.get('tls') and port_str.isdigit():
+                tls_ports.add(int(port_str))
+        return tls_ports
+    
     def get_all_monitored_ports(self) -> List[Dict]:
         """Get all ports that should be monitored"""
         monitored_ports = []
@@ -100,6 +123,31 @@ class PortDatabase:
         
         return monitored_ports
     
+    def get_ports_for_scan(self, ports: Iterable[int]) -> List[Dict]:
+        """Build the scan list for arbitrary ports, e.g. a full range sweep
+        
+        Ports in the database keep their service, protocols and risk; other
+        ports are probed over TCP as unknown services.
+        """
+        scan_list = []
+        for port in ports:
+            port_data = self.ports_data.get(str(port))
+            if port_data:
+                scan_list.append({
+                    'port': port,
+                    'service': port_data.get('service', 'Unknown'),
+                    'protocols': port_data.get('protocols', ['TCP']),
+                    'risk_level': port_data.get('risk_level', 'Medium')
+                })
+            else:
+                scan_list.append({
+                    'port': port,
+                    'service': 'Unknown',
+                    'protocols': ['TCP'],
+                    'risk_level': 'Medium'
+                })
+        return scan_list
+    
     def get_risk_color(self, risk_level: str) -> str:
         """Get color code for risk level"""
         colors = {
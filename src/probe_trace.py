@@ -0,0 +1,56 @@
+"""
+Sampled, structured trace of individual probes for troubleshooting
+"""
+
+import errno
+import json
+import logging
+import random
+import time
+from logging.handlers import QueueListener
+from typing import Optional, Union
+
+from log_setup import start_queue_logging
+
+TRACE_LOGGER = 'portscope.trace'
+DEFAULT_TRACE_FILE = 'probe_trace.ndjson'
+
+# Fraction of probes traced; 0 disables tracing
+_rate = 0.0
+_random = random.random
+_logger = logging.getLogger(TRACE_LOGGER)
+_logger.propagate = False
+
+def configure(rate: float, path: str = DEFAULT_TRACE_FILE) -> Optional[QueueListener]:
+    """Trace a fraction of probes as JSON lines written to path.
+
+    The trace has its own queue and listener thread, so traced probes only
+    pay for building the record.
+    """
+    global _rate
+    _rate = max(0.0, min(1.0, rate))
+    if not _rate:
+        return None
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    return start_queue_logging([handler], logger=_logger, level=logging.DEBUG)
+
+def sampled() -> bool:
+    """Decide whether to trace the next probe; False right away when disabled"""
+    return _rate > 0.0 and _random() < _rate
+
+def describe_result(result: Union[int, Exception, None]) -> str:
+    """Name a probe result: "open", an errno name or the exception"""
+    if result == 0:
+        return 'open'
+    if isinstance(result, int):
+        return errno.errorcode.get(result, str(result))
+    if result is None:
+        return 'none'
+    return f"{type(result).__name__}: {result}"
+
+def emit(event: str, **fields):
+    """Write one trace record"""
+    fields['event'] = event
+    fields['time'] = time.time()
+    _logger.debug(json.dumps(fields, default=str))
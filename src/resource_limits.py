@@ -0,0 +1,94 @@
+"""
+File descriptor and ephemeral port limits used to size the probe window
+"""
+
+import logging
+import platform
+from typing import Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, which has no per-process descriptor limit
+    resource = None
+
+# Local port range used for outgoing connections (Linux)
+PROC_PORT_RANGE = '/proc/sys/net/ipv4/ip_local_port_range'
+
+# Ranges assumed when the system does not report one
+DEFAULT_PORT_RANGE = (32768, 60999)
+WINDOWS_PORT_RANGE = (49152, 65535)
+
+# Descriptors kept free for the GUI, HTTP sessions, log files and SSDP
+RESERVED_FDS = 64
+
+# Probe threads are cheap but not free; more than this gains nothing
+MAX_PROBE_WINDOW = 512
+MIN_PROBE_WINDOW = 4
+
+def get_fd_limit() -> Optional[Tuple[int, int]]:
+    """Get the (soft, hard) open file limit, None if the system has none"""
+    if resource is None:
+        return None
+    try:
+        return resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (OSError, ValueError):
+        return None
+
+def raise_fd_limit(wanted: int) -> Optional[int]:
+    """Raise the soft open file limit towards wanted, up to the hard limit.
+
+    Returns the soft limit in effect afterwards.
+    """
+    limits = get_fd_limit()
+    if limits is None:
+        return None
+    soft, hard = limits
+    if soft == resource.RLIM_INFINITY or soft >= wanted:
+        return soft
+
+    new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+        logging.info(f"Raised open file limit from {soft} to {new_soft}")
+        return new_soft
+    except (OSError, ValueError) as e:
+        logging.warning(f"Cannot raise open file limit: {e}")
+        return soft
+
+def get_ephemeral_port_range() -> Tuple[int, int]:
+    """Get the range of local ports used for outgoing connections"""
+    try:
+        with open(PROC_PORT_RANGE, 'r') as f:
+            low, high = (int(value) for value in f.read().split())
+            return low, high
+    except (OSError, ValueError):
+        pass
+    if platform.system() == "Windows":
+        return WINDOWS_PORT_RANGE
+    return DEFAULT_PORT_RANGE
+
+def get_probe_window(requested: int = MAX_PROBE_WINDOW, raise_limit: bool = True) -> int:
+    """Size the number of concurrent probes from the system limits.
+
+    Every in-flight probe holds one descriptor and one ephemeral port.  The
+    window is capped by the open file limit (raised first if allowed) minus
+    a reserve, and by the ephemeral ports that remain free while closed
+    connections wait out TIME_WAIT.
+    """
+    window = min(requested, MAX_PROBE_WINDOW)
+
+    limits = get_fd_limit()
+    if limits is not None:
+        soft = limits[0]
+        if raise_limit and soft != resource.RLIM_INFINITY and soft < window + RESERVED_FDS:
+            soft = raise_fd_limit(window + RESERVED_FDS)
+        if soft != resource.RLIM_INFINITY:
+            window = min(window, soft - RESERVED_FDS)
+
+    # Leave most of the ephemeral range for TIME_WAIT entries and other
+    # programs; a window is rarely worth more than a tenth of it
+    low, high = get_ephemeral_port_range()
+    window = min(window, max(MIN_PROBE_WINDOW, (high - low + 1) // 10))
+
+    return max(MIN_PROBE_WINDOW, window)
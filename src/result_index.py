@@ -0,0 +1,220 @@
+"""
+In-memory index over scan results for filtering, sorting and searching
+"""
+
+import bisect
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Set
+
+# Sort order for risk levels (most severe first)
+RISK_ORDER = {'High': 0, 'Medium': 1, 'Low': 2}
+
+# Sort keys for the sortable columns; every key ends with the port so
+# results with equal primary keys still come out in a stable order
+SORT_KEYS: Dict[str, Callable[[Dict], tuple]] = {
+    'port': lambda r: (r['port'], r.get('protocol', '')),
+    'protocol': lambda r: (r.get('protocol', ''), r['port']),
+    'service': lambda r: (r.get('service', '').lower(), r['port']),
+    'risk_level': lambda r: (RISK_ORDER.get(r.get('risk_level'), len(RISK_ORDER)), r['port']),
+    'state': lambda r: (r.get('state', ''), r['port']),
+    'host': lambda r: (r.get('host', ''), r['port']),
+}
+
+class ResultSelection(Sequence):
+    """Read-only, ordered view of a subset of the indexed results"""
+
+    def __init__(self, records: List[Dict], ids: List[int], descending: bool = False):
+        self.records = records
+        self.ids = ids
+        self.descending = descending
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self.ids)
+        if self.descending:
+            index = len(self.ids) - 1 - index
+        return self.records[self.ids[index]]
+
+class ResultIndex:
+    """Indexed result model with buckets per field and cached sorted views.
+
+    Records are stored once and referred to by their insertion id.  Bucket
+    sets allow filters to be combined as set intersections, sorted views are
+    built lazily per sort key and kept up to date on insertion, and text
+    searches narrow the previous match set when the query is refined.
+    Records inserted with upsert() are replaced in place when a record with
+    the same key arrives again.
+    """
+
+    BUCKET_FIELDS = ('risk_level', 'protocol', 'state', 'host')
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self.buckets: Dict[str, Dict[str, Set[int]]] = {field: {} for field in self.BUCKET_FIELDS}
+        self.search_text: List[str] = []
+        self.sorted_views: Dict[str, List[int]] = {}
+        self.ids_by_key: Dict[Hashable, int] = {}
+        self._last_search = None
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def clear(self):
+        """Remove all results"""
+        self.records = []
+        self.buckets = {field: {} for field in self.BUCKET_FIELDS}
+        self.search_text = []
+        self.sorted_views = {}
+        self.ids_by_key = {}
+        self._last_search = None
+
+    def add(self, record: Dict) -> int:
+        """Add a result and return its id"""
+        record_id = len(self.records)
+        self.records.append(record)
+        self.search_text.append(self._make_search_text(record))
+        self._index_record(record_id, record)
+
+        for sort_key, view in self.sorted_views.items():
+            key_func = SORT_KEYS[sort_key]
+            bisect.insort(view, record_id, key=lambda i: key_func(self.records[i]))
+
+        self._last_search = None
+        return record_id
+
+    def add_many(self, records: List[Dict]):
+        """Add several results at once"""
+        for record in records:
+            self.add(record)
+
+    def update(self, record_id: int, record: Dict):
+        """Replace a result, moving it to its new buckets and sort positions"""
+        old = self.records[record_id]
+        records = self.records
+
+        # Locate the id in every sorted view by its old key before replacing it
+        for sort_key, view in self.sorted_views.items():
+            key_func = SORT_KEYS[sort_key]
+            old_key = key_func(old)
+            low = bisect.bisect_left(view, old_key, key=lambda i: key_func(records[i]))
+            high = bisect.bisect_right(view, old_key, lo=low, key=lambda i: key_func(records[i]))
+            del view[view.index(record_id, low, high)]
+
+        for field in self.BUCKET_FIELDS:
+            value = old.get(field)
+            if value is not None:
+                self.buckets[field][value].discard(record_id)
+
+        records[record_id] = record
+        self.search_text[record_id] = self._make_search_text(record)
+        self._index_record(record_id, record)
+
+        for sort_key, view in self.sorted_views.items():
+            key_func = SORT_KEYS[sort_key]
+            bisect.insort(view, record_id, key=lambda i: key_func(records[i]))
+
+        self._last_search = None
+
+    def upsert(self, key: Hashable, record: Dict) -> int:
+        """Add a result, or replace the result previously added under key"""
+        record_id = self.ids_by_key.get(key)
+        if record_id is None:
+            record_id = self.add(record)
+            self.ids_by_key[key] = record_id
+        else:
+            self.update(record_id, record)
+        return record_id
+
+    def get_values(self, field: str) -> List[str]:
+        """Get the distinct values present for a bucketed field"""
+        return sorted(value for value, ids in self.buckets[field].items() if ids)
+
+    def count(self, field: str, value: str) -> int:
+        """Count results with the given field value"""
+        return len(self.buckets[field].get(value, ()))
+
+    def query(self, filters: Optional[Dict[str, str]] = None, text: str = '',
+              sort_key: str = 'port', descending: bool = False) -> ResultSelection:
+        """Get the results matching all filters and the search text, sorted.
+
+        Filter values of None or "All" are ignored.  The search text is split
+        into terms that must all occur in the port, protocol, service, state
+        or host of a result.
+        """
+        active = {field: value for field, value in (filters or {}).items()
+                  if value not in (None, '', 'All')}
+
+        candidates = self._filter(active)
+        candidates = self._search(active, text.strip().lower(), candidates)
+        ids = self._order(candidates, sort_key)
+        return ResultSelection(self.records, ids, descending)
+
+    def _index_record(self, record_id: int, record: Dict):
+        """Add a record id to the buckets of its field values"""
+        for field in self.BUCKET_FIELDS:
+            value = record.get(field)
+            if value is not None:
+                self.buckets[field].setdefault(value, set()).add(record_id)
+
+    def _make_search_text(self, record: Dict) -> str:
+        """Build the lowercase text searched for a record"""
+        return ' '.join(str(record.get(field, '')) for field in
+                        ('port', 'protocol', 'service', 'state', 'host')).lower()
+
+    def _filter(self, active: Dict[str, str]) -> Optional[Set[int]]:
+        """Intersect the buckets of the active filters, None meaning all"""
+        if not active:
+            return None
+        buckets = sorted((self.buckets[field].get(value, set()) for field, value in active.items()),
+                         key=len)
+        result = set(buckets[0])
+        for bucket in buckets[1:]:
+            result &= bucket
+        return result
+
+    def _search(self, active: Dict[str, str], text: str,
+                candidates: Optional[Set[int]]) -> Optional[Set[int]]:
+        """Narrow the candidates to those matching every search term"""
+        if not text:
+            self._last_search = None
+            return candidates
+
+        # Refining the previous query can only remove matches, so only the
+        # previous matches need to be searched again
+        last = self._last_search
+        if last and last[0] == active and text.startswith(last[1]):
+            pool = last[2]
+        else:
+            pool = candidates if candidates is not None else range(len(self.records))
+
+        terms = text.split()
+        search_text = self.search_text
+        matches = {i for i in pool if all(term in search_text[i] for term in terms)}
+        self._last_search = (active, text, matches)
+        return matches
+
+    def _order(self, candidates: Optional[Set[int]], sort_key: str) -> List[int]:
+        """Return the candidate ids in sort order"""
+        if sort_key not in SORT_KEYS:
+            sort_key = 'port'
+        key_func = SORT_KEYS[sort_key]
+        records = self.records
+
+        # Sorting a small subset directly is cheaper than walking the full view
+        if candidates is not None and len(candidates) * 8 < len(records):
+            return sorted(sorted(candidates), key=lambda i: key_func(records[i]))
+
+        # Ids are sorted stably, so equal keys keep their insertion order
+        view = self.sorted_views.get(sort_key)
+        if view is None:
+            keys = [key_func(record) for record in records]
+            view = sorted(range(len(records)), key=keys.__getitem__)
+            self.sorted_views[sort_key] = view
+
+        if candidates is None:
+            return list(view)
+        return [i for i in view if i in candidates]
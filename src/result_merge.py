@@ -0,0 +1,140 @@
+"""
+Merging of findings from several scan sources into one record per port
+"""
+
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from result_index import RISK_ORDER
+
+# Display priority of states when several sources report the same port;
+# exposure through UPnP matters more than the port merely being open
+STATE_PRIORITY = {'UPnP MAPPED': 0, 'UPnP EXPOSED': 1, 'LISTENING': 2, 'OPEN': 3}
+
+# Host under which findings for any local address are merged
+LOCAL_HOST = '127.0.0.1'
+
+ResultKey = Tuple[str, str, int]
+
+def result_key(record: Dict) -> ResultKey:
+    """Get the (host, protocol, port) key identifying a result"""
+    return (record.get('host', ''), record.get('protocol', ''), record['port'])
+
+def most_severe(risks: Iterable[Optional[str]]) -> Optional[str]:
+    """Get the most severe of several risk levels"""
+    return min(risks, key=lambda risk: RISK_ORDER.get(risk, len(RISK_ORDER)), default=None)
+
+class ResultMerger:
+    """Combines the evidence of every scan source into one record per key.
+
+    Findings are keyed by (host, protocol, port).  The merged record keeps
+    the highest risk level and the most significant state reported for the
+    port, and lists every source and state that reported it.  Each insertion
+    is a single dict lookup plus a merge of a few fields, so findings can be
+    merged as they stream in.
+
+    The risk of `lookup_sources` only comes from the port number; once a
+    fingerprint identifies the service, its risk replaces theirs, while the
+    risk reported by any other source still counts.
+    """
+
+    def __init__(self, local_addresses: Optional[Iterable[str]] = None,
+                 lookup_sources: Iterable[str] = ()):
+        self.records: Dict[ResultKey, Dict] = {}
+        self.risks: Dict[ResultKey, Dict[str, str]] = {}
+        self.local_addresses = set(local_addresses or ())
+        self.lookup_sources = set(lookup_sources)
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def clear(self):
+        """Forget all merged results"""
+        with self.lock:
+            self.records = {}
+            self.risks = {}
+
+    def add(self, source: str, finding: Dict) -> Tuple[Optional[Dict], bool]:
+        """Merge a finding into its record.
+
+        Returns a snapshot of the merged record and whether the port was not
+        seen before.  The snapshot is None when the finding added nothing
+        new, so callers only pass on changes.
+        """
+        if finding.get('host') in self.local_addresses:
+            finding = dict(finding, host=LOCAL_HOST)
+        key = result_key(finding)
+
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                record = dict(finding)
+                record['sources'] = [source]
+                record['states'] = [finding['state']]
+                self.records[key] = record
+                self.risks[key] = {source: finding.get('risk_level')}
+                return self._snapshot(record), True
+
+            if not self._merge(record, self.risks[key], source, finding):
+                return None, False
+            return self._snapshot(record), False
+
+    def get(self, key: ResultKey) -> Optional[Dict]:
+        """Get the merged record for a key"""
+        with self.lock:
+            return self.records.get(key)
+
+    def _snapshot(self, record: Dict) -> Dict:
+        """Copy a record so later merges do not change what was handed out"""
+        return dict(record, sources=list(record['sources']), states=list(record['states']))
+
+    def _merge(self, record: Dict, risks: Dict[str, str], source: str, finding: Dict) -> bool:
+        """Merge a finding into an existing record; returns True if it changed"""
+        changed = False
+        if source not in record['sources']:
+            record['sources'].append(source)
+            changed = True
+
+        state = finding['state']
+        if state not in record['states']:
+            record['states'].append(state)
+            if (STATE_PRIORITY.get(state, len(STATE_PRIORITY)) <
+                    STATE_PRIORITY.get(record['state'], len(STATE_PRIORITY))):
+                record['state'] = state
+            changed = True
+
+        # An identified service replaces the name that was looked up by
+        # port number, and its risk replaces the port-number risk below
+        fingerprint = finding.get('fingerprint')
+        if fingerprint is not None and record.get('fingerprint') is None:
+            record['fingerprint'] = fingerprint
+            record['service'] = finding['service']
+            changed = True
+
+        risk = finding.get('risk_level')
+        if most_severe([risks.get(source), risk]) != risks.get(source):
+            risks[source] = risk
+        counted = [value for name, value in risks.items()
+                   if not (record.get('fingerprint') is not None and name in self.lookup_sources)]
+        risk_level = most_severe(counted)
+        if risk_level != record.get('risk_level'):
+            record['risk_level'] = risk_level
+            changed = True
+
+        if record.get('service', 'Unknown') == 'Unknown' and finding.get('service', 'Unknown') != 'Unknown':
+            record['service'] = finding['service']
+            changed = True
+
+        # Plugins may report in several runs on the same port
+        plugins = finding.get('plugins')
+        if plugins and any(name not in record.get('plugins', {}) for name in plugins):
+            record['plugins'] = dict(plugins, **record.get('plugins', {}))
+            changed = True
+
+        # Keep source-specific details such as device_info or mapping
+        for field, value in finding.items():
+            if field not in record:
+                record[field] = value
+                changed = True
+        return changed
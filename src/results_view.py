@@ -0,0 +1,218 @@
+"""
+Virtualized results list for the scan results
+"""
+
+import tkinter as tk
+from tkinter import ttk
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Approximate height of the Treeview heading row in pixels
+HEADING_HEIGHT = 26
+
+class VirtualResultsView:
+    """Treeview that only materializes the rows visible in the viewport.
+
+    The view keeps a reference to the full result sequence but holds at most
+    one Treeview item per visible line.  Scrolling rewrites the values of those
+    items in place, so rendering cost depends on the window size and not on
+    the number of results.
+    """
+
+    def __init__(self, parent: tk.Widget, columns: List[Tuple[str, int]],
+                 format_row: Callable[[Dict], Tuple[Tuple, str]],
+                 on_select: Optional[Callable[[Optional[Dict]], None]] = None,
+                 on_heading_click: Optional[Callable[[str], None]] = None,
+                 row_height: int = 24, style: str = 'Results.Treeview'):
+        self.format_row = format_row
+        self.on_select = on_select
+        self.on_heading_click = on_heading_click
+        self.row_height = row_height
+
+        self.rows: Sequence[Dict] = []
+        self.offset = 0
+        self.visible_count = 1
+        self.selected_index: Optional[int] = None
+        self.slots: List[str] = []
+        self._rendering = False
+
+        self.frame = ttk.Frame(parent)
+        column_ids = [column_id for column_id, _ in columns]
+        self.tree = ttk.Treeview(self.frame, columns=column_ids, show='headings',
+                                 selectmode='browse', style=style)
+        for column_id, width in columns:
+            self.tree.column(column_id, width=width, anchor=tk.W)
+
+        self.scrollbar = ttk.Scrollbar(self.frame, orient='vertical',
+                                       command=self._on_scrollbar)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<<TreeviewSelect>>', self._on_tree_select)
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(3))
+        self.tree.bind('<Up>', lambda e: self._move_selection(-1))
+        self.tree.bind('<Down>', lambda e: self._move_selection(1))
+        self.tree.bind('<Prior>', lambda e: self._move_selection(-self.visible_count))
+        self.tree.bind('<Next>', lambda e: self._move_selection(self.visible_count))
+        self.tree.bind('<Home>', lambda e: self._select_index(0))
+        self.tree.bind('<End>', lambda e: self._select_index(len(self.rows) - 1))
+
+    def pack(self, **kwargs):
+        """Pack the view container"""
+        self.frame.pack(**kwargs)
+
+    def set_headings(self, headings: Dict[str, str]):
+        """Set the (localized) column headings"""
+        for column_id, text in headings.items():
+            if self.on_heading_click:
+                self.tree.heading(column_id, text=text,
+                                  command=lambda c=column_id: self.on_heading_click(c))
+            else:
+                self.tree.heading(column_id, text=text)
+
+    def set_row_styles(self, styles: Dict[str, str]):
+        """Configure foreground colors for row tags"""
+        for tag, color in styles.items():
+            self.tree.tag_configure(tag, foreground=color)
+
+    def set_rows(self, rows: Sequence[Dict]):
+        """Replace the displayed result sequence"""
+        self.rows = rows
+        self.offset = 0
+        self.selected_index = None
+        self.render()
+        if self.on_select:
+            self.on_select(None)
+
+    def update_rows(self, rows: Sequence[Dict]):
+        """Replace the result sequence, keeping the scroll position.
+
+        The selection is kept if the selected result is still at the same
+        position, which is the common case while results stream in.
+        """
+        selected = self.get_selected()
+        self.rows = rows
+        if selected is not None and self.get_selected() is not selected:
+            self.selected_index = None
+            if self.on_select:
+                self.on_select(None)
+        self.render()
+
+    def refresh(self):
+        """Re-render the visible rows, e.g. after a language change"""
+        self.render()
+
+    def get_selected(self) -> Optional[Dict]:
+        """Get the currently selected result, if any"""
+        if self.selected_index is None or self.selected_index >= len(self.rows):
+            return None
+        return self.rows[self.selected_index]
+
+    def scroll(self, lines: int):
+        """Scroll the viewport by a number of lines"""
+        self._set_offset(self.offset + lines)
+
+    def render(self):
+        """Write the rows of the current viewport into the slot items"""
+        total = len(self.rows)
+        self.offset = max(0, min(self.offset, total - self.visible_count))
+        needed = min(self.visible_count, total - self.offset)
+
+        self._rendering = True
+        try:
+            # Grow or shrink the pool of slot items to the viewport size
+            while len(self.slots) < needed:
+                self.slots.append(self.tree.insert('', tk.END))
+            while len(self.slots) > needed:
+                self.tree.delete(self.slots.pop())
+
+            selected_slot = None
+            for slot_number, slot in enumerate(self.slots):
+                index = self.offset + slot_number
+                values, tag = self.format_row(self.rows[index])
+                self.tree.item(slot, values=values, tags=(tag,))
+                if index == self.selected_index:
+                    selected_slot = slot
+
+            if selected_slot is not None:
+                self.tree.selection_set(selected_slot)
+            elif self.tree.selection():
+                self.tree.selection_remove(self.tree.selection())
+        finally:
+            self._rendering = False
+
+        self._update_scrollbar()
+
+    def _set_offset(self, offset: int):
+        """Move the viewport to start at the given row index"""
+        max_offset = max(0, len(self.rows) - self.visible_count)
+        offset = max(0, min(offset, max_offset))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def _update_scrollbar(self):
+        """Sync the scrollbar with the viewport position"""
+        total = len(self.rows)
+        if total <= self.visible_count:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            first = self.offset / total
+            last = (self.offset + self.visible_count) / total
+            self.scrollbar.set(first, last)
+
+    def _on_scrollbar(self, action: str, amount: str, unit: Optional[str] = None):
+        """Handle scrollbar drag and arrow clicks"""
+        if action == 'moveto':
+            self._set_offset(int(float(amount) * len(self.rows)))
+        elif action == 'scroll':
+            step = self.visible_count if unit == 'pages' else 1
+            self.scroll(int(amount) * step)
+
+    def _on_mousewheel(self, event):
+        """Handle mouse wheel scrolling"""
+        self.scroll(int(-1 * (event.delta / 120)) * 3)
+        return 'break'
+
+    def _on_resize(self, event):
+        """Recompute how many rows fit in the viewport"""
+        visible_count = max(1, (event.height - HEADING_HEIGHT) // self.row_height)
+        if visible_count != self.visible_count:
+            self.visible_count = visible_count
+            self.render()
+
+    def _on_tree_select(self, event=None):
+        """Map the selected slot back to a result row"""
+        if self._rendering:
+            return
+        selection = self.tree.selection()
+        if not selection or selection[0] not in self.slots:
+            return
+        index = self.offset + self.slots.index(selection[0])
+        if index != self.selected_index:
+            self.selected_index = index
+            if self.on_select:
+                self.on_select(self.rows[index])
+
+    def _move_selection(self, delta: int):
+        """Move the selection with the keyboard"""
+        current = self.selected_index if self.selected_index is not None else self.offset - 1
+        self._select_index(current + delta)
+        return 'break'
+
+    def _select_index(self, index: int):
+        """Select a row by index, scrolling it into view"""
+        if not self.rows:
+            return 'break'
+        index = max(0, min(index, len(self.rows) - 1))
+        self.selected_index = index
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.visible_count:
+            self.offset = index - self.visible_count + 1
+        self.render()
+        if self.on_select:
+            self.on_select(self.rows[index])
+        return 'break'
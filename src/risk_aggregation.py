@@ -0,0 +1,216 @@
+"""
+Fleet risk scoring: per-host and per-subnet rollups computed in batch
+
+Findings are converted once into parallel NumPy arrays (host index, port,
+risk code) and every score is then a bincount or a matrix product over
+those arrays, so hundreds of thousands of findings aggregate in
+milliseconds.  NumPy is an optional dependency (the "fleet" extra).
+"""
+
+import ipaddress
+import json
+import socket
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from result_merge import result_key
+
+# Risk codes; index into the weight vector and the columns of the counts
+RISK_NONE = 0
+RISK_LOW = 1
+RISK_MEDIUM = 2
+RISK_HIGH = 3
+RISK_CODES = {'Low': RISK_LOW, 'Medium': RISK_MEDIUM, 'High': RISK_HIGH}
+RISK_NAMES = ['None', 'Low', 'Medium', 'High']
+
+# Score contributed by one exposure of each risk level
+DEFAULT_WEIGHTS = {'Low': 1.0, 'Medium': 3.0, 'High': 10.0}
+
+# Subnet sizes used for rollups
+IPV4_SUBNET_PREFIX = 24
+IPV6_SUBNET_PREFIX = 64
+
+def require_numpy():
+    """Raise ImportError with an install hint if NumPy is missing"""
+    if np is None:
+        raise ImportError("risk aggregation requires NumPy; install it with the 'fleet' extra")
+
+def weight_vector(weights: Optional[Dict[str, float]] = None) -> 'np.ndarray':
+    """Build the weight vector indexed by risk code"""
+    weights = weights or DEFAULT_WEIGHTS
+    vector = np.zeros(len(RISK_NAMES))
+    for level, code in RISK_CODES.items():
+        vector[code] = weights.get(level, 0.0)
+    return vector
+
+def subnet_of(host: str, v4_prefix: int = IPV4_SUBNET_PREFIX,
+              v6_prefix: int = IPV6_SUBNET_PREFIX) -> Tuple:
+    """Get a hashable subnet key of a host; host names are their own subnet.
+
+    Addresses are parsed with inet_pton, which is much cheaper than
+    ipaddress for the tens of thousands of hosts of a fleet; subnet_name()
+    turns a key into its display form.
+    """
+    for family, bits, prefix in ((socket.AF_INET, 32, v4_prefix), (socket.AF_INET6, 128, v6_prefix)):
+        try:
+            value = int.from_bytes(socket.inet_pton(family, host.split('%', 1)[0]), 'big')
+        except OSError:
+            continue
+        return (bits, value >> (bits - prefix) << (bits - prefix), prefix)
+    return (0, host, 0)
+
+def subnet_name(key: Tuple) -> str:
+    """Display form of a subnet key, e.g. 192.168.1.0/24"""
+    bits, value, prefix = key
+    if not bits:
+        return value
+    return str(ipaddress.ip_network((value, prefix)))
+
+@dataclass
+class FindingArrays:
+    """Findings as parallel arrays; `hosts` maps host indices to addresses"""
+    hosts: List[str]
+    host_index: 'np.ndarray'
+    port: 'np.ndarray'
+    risk: 'np.ndarray'
+
+    def __len__(self) -> int:
+        return len(self.risk)
+
+    def mask(self, risk_level: str) -> 'np.ndarray':
+        """Boolean mask of the findings with a risk level; "All" selects all"""
+        if risk_level == 'All':
+            return np.ones(len(self), dtype=bool)
+        return self.risk == RISK_CODES.get(risk_level, RISK_NONE)
+
+def build_arrays(findings: Iterable[Dict]) -> FindingArrays:
+    """Convert findings to arrays in one pass, interning the host names"""
+    require_numpy()
+    host_ids: Dict[str, int] = {}
+    host_column: List[int] = []
+    port_column: List[int] = []
+    risk_column: List[int] = []
+    for finding in findings:
+        host = finding.get('host', '')
+        host_id = host_ids.get(host)
+        if host_id is None:
+            host_id = host_ids[host] = len(host_ids)
+        host_column.append(host_id)
+        port_column.append(finding['port'])
+        risk_column.append(RISK_CODES.get(finding.get('risk_level'), RISK_NONE))
+
+    return FindingArrays(
+        hosts=list(host_ids),
+        host_index=np.array(host_column, dtype=np.int32),
+        port=np.array(port_column, dtype=np.int32),
+        risk=np.array(risk_column, dtype=np.int8),
+    )
+
+@dataclass
+class RiskTable:
+    """Exposure counts and scores per group (host or subnet).
+
+    counts has one row per name and one column per risk code; scores are
+    the counts weighted by risk level.
+    """
+    names: List[str]
+    counts: 'np.ndarray'
+    scores: 'np.ndarray'
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def index(self) -> Dict[str, int]:
+        """Map names to rows"""
+        return {name: row for row, name in enumerate(self.names)}
+
+    def top(self, n: int = 10) -> List[Dict]:
+        """Get the n highest scoring groups, highest first"""
+        n = min(n, len(self.names))
+        if n <= 0:
+            return []
+        rows = np.argpartition(-self.scores, n - 1)[:n]
+        rows = rows[np.argsort(-self.scores[rows], kind='stable')]
+        return [self.row(int(row)) for row in rows]
+
+    def row(self, row: int) -> Dict:
+        """Describe one group"""
+        return {
+            'name': self.names[row],
+            'score': float(self.scores[row]),
+            'high': int(self.counts[row, RISK_HIGH]),
+            'medium': int(self.counts[row, RISK_MEDIUM]),
+            'low': int(self.counts[row, RISK_LOW]),
+        }
+
+    def to_rows(self) -> List[Dict]:
+        """Describe every group"""
+        return [self.row(row) for row in range(len(self.names))]
+
+def count_by_group(group_index: 'np.ndarray', risk: 'np.ndarray', group_count: int) -> 'np.ndarray':
+    """Count findings per (group, risk code) with a single bincount"""
+    flat = group_index.astype(np.int64) * len(RISK_NAMES) + risk
+    counts = np.bincount(flat, minlength=group_count * len(RISK_NAMES))
+    return counts.reshape(group_count, len(RISK_NAMES))
+
+def score_hosts(arrays: FindingArrays, weights: Optional[Dict[str, float]] = None) -> RiskTable:
+    """Score every host by its weighted exposures"""
+    require_numpy()
+    counts = count_by_group(arrays.host_index, arrays.risk, len(arrays.hosts))
+    return RiskTable(list(arrays.hosts), counts, counts @ weight_vector(weights))
+
+def score_subnets(arrays: FindingArrays, weights: Optional[Dict[str, float]] = None,
+                  v4_prefix: int = IPV4_SUBNET_PREFIX,
+                  v6_prefix: int = IPV6_SUBNET_PREFIX) -> RiskTable:
+    """Score every subnet by the weighted exposures of its hosts.
+
+    Subnets are computed per distinct host, not per finding, and the host
+    indices are then mapped to subnet indices with one gather.
+    """
+    require_numpy()
+    subnet_ids: Dict[Tuple, int] = {}
+    host_to_subnet = np.empty(len(arrays.hosts), dtype=np.int32)
+    for host_id, host in enumerate(arrays.hosts):
+        subnet = subnet_of(host, v4_prefix, v6_prefix)
+        host_to_subnet[host_id] = subnet_ids.setdefault(subnet, len(subnet_ids))
+
+    counts = count_by_group(host_to_subnet[arrays.host_index], arrays.risk, len(subnet_ids))
+    names = [subnet_name(subnet) for subnet in subnet_ids]
+    return RiskTable(names, counts, counts @ weight_vector(weights))
+
+def score_deltas(previous: RiskTable, current: RiskTable) -> RiskTable:
+    """Change of counts and scores per group between two reports.
+
+    Groups present in only one report count as zero in the other, so new
+    hosts show their full score and vanished hosts a negative one.
+    """
+    require_numpy()
+    names = list(dict.fromkeys(previous.names + current.names))
+    rows = {name: row for row, name in enumerate(names)}
+    counts = np.zeros((len(names), len(RISK_NAMES)), dtype=np.int64)
+    scores = np.zeros(len(names))
+
+    current_rows = np.array([rows[name] for name in current.names], dtype=np.int64)
+    previous_rows = np.array([rows[name] for name in previous.names], dtype=np.int64)
+    if len(current_rows):
+        counts[current_rows] += current.counts
+        scores[current_rows] += current.scores
+    if len(previous_rows):
+        counts[previous_rows] -= previous.counts
+        scores[previous_rows] -= previous.scores
+    return RiskTable(names, counts, scores)
+
+def load_ndjson(path: str) -> List[Dict]:
+    """Load the findings of an NDJSON export, latest version per port"""
+    records: Dict = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[result_key(record)] = record
+    return list(records.values())
@@ -0,0 +1,668 @@
+"""
+Long-lived local scan service with an HTTP/JSON job API
+"""
+
+import hmac
+import ipaddress
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import resource_limits
+import targets
+from cache import SOCKETS, ScanCache
+from exporters import RecordAnnotator, json_default
+from fingerprint import ServiceFingerprinter
+from plugins import PluginRunner, load_plugins
+from port_database import PortDatabase
+from result_merge import result_key
+from scan_events import ScanEventQueue
+from scan_pipeline import DEFAULT_PROBE_WINDOW, ScanPipeline
+from scanner import PortScanner
+from ssdp_listener import DeviceCache
+from tls_inspect import TLSInspector
+from upnp_scanner import UPnPScanner
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, CANCELLED, FAILED)
+
+# Listening sockets are re-read at most this often across jobs (seconds)
+SOCKET_SNAPSHOT_TTL = 2.0
+
+# How often a running job moves events from its pipeline (seconds)
+EVENT_INTERVAL = 0.1
+
+# Largest accepted request body (bytes)
+MAX_REQUEST_BYTES = 65536
+
+# Largest number of (host, port) probes one job may request, e.g. a /16
+# on the monitored ports or one host on every port
+MAX_JOB_PROBES = 2_097_152
+
+# Host names a request may address the API by, besides loopback addresses;
+# any other Host header is refused so DNS rebinding cannot reach the API
+LOOPBACK_NAMES = ('localhost',)
+
+def is_loopback_host(host: str) -> bool:
+    """Whether a host name or address from a Host or Origin header is loopback"""
+    host = host.strip('[]').lower()
+    if host in LOOPBACK_NAMES:
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the job queue is full"""
+
+class ScanJob:
+    """One submitted scan and the results it has produced so far.
+
+    Results are kept as the sequence of merged records in the order they
+    were reported; a record reported again supersedes its earlier version,
+    so clients can page through them with a cursor and `latest()` gives one
+    record per (host, protocol, port).
+    """
+
+    def __init__(self, job_id: str, settings: Dict):
+        self.id = job_id
+        self.settings = settings
+        self.status = QUEUED
+        self.progress = 0
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.results: List[Dict] = []
+        self.pipeline: Optional[ScanPipeline] = None
+        self.cancel_requested = False
+        self.changed = threading.Condition()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def add_results(self, records: List[Dict]):
+        """Append reported records and wake up streaming clients"""
+        with self.changed:
+            self.results.extend(records)
+            self.changed.notify_all()
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        """Change the job state and wake up streaming clients"""
+        with self.changed:
+            self.status = status
+            if status == RUNNING:
+                self.started = time.time()
+            elif status in FINISHED_STATES:
+                self.finished = time.time()
+                if status == DONE:
+                    self.progress = 100
+            self.error = error
+            self.changed.notify_all()
+
+    def wait_for_results(self, cursor: int, timeout: float) -> Tuple[List[Dict], bool]:
+        """Wait for results after cursor; returns them and whether the job finished"""
+        with self.changed:
+            if len(self.results) <= cursor and not self.is_finished:
+                self.changed.wait(timeout)
+            return self.results[cursor:], self.is_finished
+
+    def latest(self) -> List[Dict]:
+        """Get the latest version of every reported record"""
+        with self.changed:
+            records = {}
+            for record in self.results:
+                records[result_key(record)] = record
+            return list(records.values())
+
+    def summary(self) -> Dict:
+        """Describe the job for API responses"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'results': len(self.results),
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'settings': self.settings,
+        }
+
+class ScanService:
+    """Runs scan jobs from a bounded queue on a fixed number of workers.
+
+    The scanners and the state that is expensive to build are created once
+    and shared by every job: the port database with its service and TLS
+    lookups, the ScanCache with the socket-table snapshot, discovery
+    results, device descriptions and connection-tracking counts, the SSDP
+    device cache, the pooled HTTP session of the UPnP scanner, the
+    fingerprint signatures, the TLS context and the loaded probe plugins.
+    A job therefore only pays for its own probes.
+
+    At most `max_queued` jobs wait for a worker; further submissions raise
+    JobQueueFull.  Finished jobs are kept for polling until more than
+    `max_finished` have accumulated, oldest first.
+    """
+
+    def __init__(self, workers: int = 2, max_queued: int = 16, max_finished: int = 32,
+                 device_cache: Optional[DeviceCache] = None):
+        self.workers = workers
+        self.max_finished = max_finished
+        self.port_db = PortDatabase()
+        self.scan_cache = ScanCache(ttls={SOCKETS: SOCKET_SNAPSHOT_TTL})
+        self.port_scanner = PortScanner(fast=True, scan_cache=self.scan_cache)
+        self.device_cache = device_cache if device_cache is not None else DeviceCache()
+        self.upnp_scanner = UPnPScanner(device_cache=self.device_cache, scan_cache=self.scan_cache)
+        self.fingerprinter = ServiceFingerprinter(self.port_db)
+        self.tls_inspector = TLSInspector(self.port_db.get_tls_ports())
+        self.plugin_runner = PluginRunner(load_plugins())
+        self.annotator = RecordAnnotator(self.port_db)
+
+        # Concurrent jobs share the descriptor and ephemeral port budget
+        self.probe_workers = max(resource_limits.MIN_PROBE_WINDOW,
+                                 resource_limits.get_probe_window(DEFAULT_PROBE_WINDOW) // workers)
+
+        self.jobs: Dict[str, ScanJob] = {}
+        self.jobs_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._ids = itertools.count(1)
+        self._threads: List[threading.Thread] = []
+        self.is_running = False
+
+    def start(self):
+        """Start the job workers"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.device_cache.load()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'scan-job-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Cancel all jobs and stop the workers"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            self.cancel(job.id)
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        self.plugin_runner.stop()
+        self.device_cache.save()
+
+    def submit(self, request: Dict) -> ScanJob:
+        """Queue a scan job.
+
+        The request may give "targets" (addresses, prefixes or host names),
+        "ports" (a port specification such as "22,80,8000-8100"; the
+        monitored ports if omitted) and the engine settings "fingerprint",
+        "tls", "plugins", "traffic" (count inbound connections in the
+        connection-tracking table), "discovery_timeout", "probe_workers" and
+        "force_refresh" (bypass the cached socket table, discovery and
+        descriptions).  Jobs of a scheduled scan profile carry its name in
+        "profile".  Raises ValueError for invalid requests, including
+        ones of more than MAX_JOB_PROBES probes, and JobQueueFull when the
+        queue is full.
+        """
+        settings = self.parse_request(request)
+        job = ScanJob(str(next(self._ids)), settings)
+        with self.jobs_lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"job queue is full ({self._queue.maxsize} jobs waiting)") from None
+            self.jobs[job.id] = job
+            self._prune_finished()
+        logging.info(f"Queued scan job {job.id}")
+        return job
+
+    def parse_request(self, request: Dict) -> Dict:
+        """Validate a job request and fill in the defaults"""
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        target_specs = request.get('targets') or []
+        if isinstance(target_specs, str):
+            target_specs = [target_specs]
+        if target_specs:
+            # Expanded one target at a time so a long list of prefixes is
+            # refused before all of it is held in memory
+            hosts = []
+            for spec in target_specs:
+                hosts.extend(targets.expand_target(spec))
+                if len(hosts) > MAX_JOB_PROBES:
+                    raise ValueError(f"targets expand to more than {MAX_JOB_PROBES} hosts")
+            hosts = list(dict.fromkeys(hosts))
+        else:
+            hosts = targets.get_default_hosts()
+        if not hosts:
+            raise ValueError("no target could be resolved")
+
+        ports = request.get('ports')
+        if ports is not None and not isinstance(ports, str):
+            ports = ','.join(str(port) for port in ports)
+        port_count = len(targets.parse_port_spec(ports)) if ports else len(self.port_db.get_all_monitored_ports())
+        if len(hosts) * port_count > MAX_JOB_PROBES:
+            raise ValueError(f"{len(hosts)} hosts x {port_count} ports is more than the limit "
+                             f"of {MAX_JOB_PROBES} probes per job")
+
+        discovery_timeout = float(request.get('discovery_timeout', 5))
+        probe_workers = int(request.get('probe_workers') or self.probe_workers)
+        if discovery_timeout < 0 or probe_workers < 1:
+            raise ValueError("discovery_timeout and probe_workers must be positive")
+        return {
+            'targets': target_specs,
+            'hosts': hosts,
+            'ports': ports,
+            'fingerprint': bool(request.get('fingerprint', True)),
+            'tls': bool(request.get('tls', True)),
+            'plugins': bool(request.get('plugins', True)),
+            'traffic': bool(request.get('traffic', True)),
+            'force_refresh': bool(request.get('force_refresh', False)),
+            'discovery_timeout': discovery_timeout,
+            'probe_workers': min(probe_workers, self.probe_workers),
+            'profile': str(request['profile']) if request.get('profile') else None,
+        }
+
+    def get(self, job_id: str) -> Optional[ScanJob]:
+        """Get a job by id"""
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[ScanJob]:
+        """Get all known jobs, oldest first"""
+        with self.jobs_lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[ScanJob]:
+        """Cancel a queued or running job"""
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return job
+        job.cancel_requested = True
+        if job.status == QUEUED:
+            job.set_status(CANCELLED)
+        elif job.pipeline is not None:
+            job.pipeline.stop()
+        return job
+
+    def _prune_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while self.is_running:
+            job = self._queue.get()
+            if job is None:
+                break
+            if job.cancel_requested:
+                continue
+            try:
+                self._run_job(job)
+            except Exception as e:
+                logging.error(f"Scan job {job.id} failed: {e}")
+                job.set_status(FAILED, str(e))
+
+    def _run_job(self, job: ScanJob):
+        settings = job.settings
+        if settings['ports']:
+            ports_to_scan = self.port_db.get_ports_for_scan(targets.parse_port_spec(settings['ports']))
+        else:
+            ports_to_scan = self.port_db.get_all_monitored_ports()
+
+        events = ScanEventQueue()
+        job.pipeline = ScanPipeline(
+            self.port_scanner, self.upnp_scanner, events,
+            probe_workers=settings['probe_workers'],
+            discovery_timeout=settings['discovery_timeout'],
+            hosts=settings['hosts'],
+            fingerprinter=self.fingerprinter if settings['fingerprint'] else None,
+            tls_inspector=self.tls_inspector if settings['tls'] else None,
+            plugin_runner=self.plugin_runner if settings['plugins'] else None,
+            force_refresh=settings['force_refresh'],
+            count_traffic=settings['traffic'],
+        )
+        job.set_status(RUNNING)
+        logging.info(f"Running scan job {job.id}: {len(ports_to_scan)} ports on {len(settings['hosts'])} hosts")
+        job.pipeline.start(ports_to_scan)
+
+        while True:
+            batch = events.drain(EVENT_INTERVAL)
+            if batch.results:
+                job.add_results(batch.results)
+            if 'pipeline' in batch.progress:
+                job.progress = batch.progress['pipeline']
+            if batch.errors:
+                job.pipeline.stop()
+                job.set_status(FAILED, batch.errors[0][1])
+                return
+            if 'pipeline' in batch.done:
+                job.set_status(DONE)
+                return
+            if job.cancel_requested:
+                job.pipeline.stop()
+                job.set_status(CANCELLED)
+                return
+            time.sleep(EVENT_INTERVAL)
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of the scan service.
+
+      GET    /health                      service state
+      GET    /jobs                        all jobs
+      POST   /jobs                        submit a job
+      GET    /jobs/<id>                   job state
+      GET    /jobs/<id>/results?since=N   results from cursor N
+      GET    /jobs/<id>/stream            results as NDJSON until the job ends
+      DELETE /jobs/<id>                   cancel a job
+      DELETE /cache[/<source>]            invalidate cached scan inputs
+      GET    /schedules                   scheduled scan profiles
+      POST   /schedules/<name>/run        run a scheduled profile now
+
+    Requests must address the API by a loopback host and its port, come
+    from no origin or a loopback one, and POST with an application/json
+    body, so web pages can neither submit jobs nor read results.  With a
+    token, every request must also carry "Authorization: Bearer <token>".
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if not self._check_request():
+            return
+        service = self.server.service
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['health']:
+            states: Dict[str, int] = {}
+            for job in service.list_jobs():
+                states[job.status] = states.get(job.status, 0) + 1
+            self._send_json(200, {'status': 'ok', 'workers': service.workers, 'jobs': states,
+                                  'cache': service.scan_cache.stats(),
+                                  'plugins': service.plugin_runner.timings()})
+        elif parts == ['jobs']:
+            self._send_json(200, {'jobs': [job.summary() for job in service.list_jobs()]})
+        elif parts == ['schedules']:
+            scheduler = self.server.scheduler
+            self._send_json(200, {'schedules': scheduler.status() if scheduler else []})
+        elif len(parts) >= 2 and parts[0] == 'jobs':
+            job = service.get(parts[1])
+            if job is None:
+                self._send_error(404, f"no job {parts[1]}")
+            elif len(parts) == 2:
+                self._send_json(200, job.summary())
+            elif parts[2:] == ['results']:
+                self._send_results(job, parse_qs(url.query))
+            elif parts[2:] == ['stream']:
+                self._stream_results(job)
+            else:
+                self._send_error(404, "unknown resource")
+        else:
+            self._send_error(404, "unknown resource")
+
+    def do_POST(self):
+        if not self._check_request(require_json=True):
+            return
+        parts = [part for part in urlsplit(self.path).path.split('/') if part]
+        if len(parts) == 3 and parts[0] == 'schedules' and parts[2] == 'run':
+            self._run_schedule(parts[1])
+            return
+        if parts != ['jobs']:
+            self._send_error(404, "unknown resource")
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            self._send_error(413, "request too large")
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+            job = self.server.service.submit(request)
+        except JobQueueFull as e:
+            self._send_error(429, str(e))
+            return
+        except (ValueError, TypeError) as e:
+            self._send_error(400, str(e))
+            return
+        self._send_json(202, job.summary(), {'Location': f"/jobs/{job.id}"})
+
+    def do_DELETE(self):
+        if not self._check_request():
+            return
+        parts = [part for part in urlsplit(self.path).path.split('/') if part]
+        if parts[:1] == ['cache'] and len(parts) <= 2:
+            try:
+                self.server.service.scan_cache.invalidate(parts[1] if len(parts) == 2 else None)
+            except KeyError:
+                self._send_error(404, f"no cache {parts[1]}")
+                return
+            self._send_json(200, {'cache': self.server.service.scan_cache.stats()})
+            return
+        job = self.server.service.cancel(parts[1]) if len(parts) == 2 and parts[0] == 'jobs' else None
+        if job is None:
+            self._send_error(404, "no such job")
+            return
+        self._send_json(200, job.summary())
+
+    def _check_request(self, require_json: bool = False) -> bool:
+        """Refuse requests from browsers and, with a token, unauthorized ones"""
+        # A refused request's body is not read, so the connection cannot be reused
+        self.close_connection = True
+        port = self.server.server_address[1]
+        try:
+            host = urlsplit(f"//{self.headers.get('Host', '')}")
+            host_ok = is_loopback_host(host.hostname or '') and (host.port or 80) == port
+        except ValueError:
+            host_ok = False
+        if not host_ok:
+            self._send_error(403, "the API is only served to loopback host names")
+            return False
+
+        origin = self.headers.get('Origin')
+        if origin is not None:
+            try:
+                origin_url = urlsplit(origin)
+                origin_ok = (is_loopback_host(origin_url.hostname or '')
+                             and origin_url.port == port)
+            except ValueError:
+                origin_ok = False
+            if not origin_ok:
+                self._send_error(403, "cross-origin requests are not allowed")
+                return False
+
+        token = self.server.token
+        if token:
+            authorization = self.headers.get('Authorization', '')
+            if not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+                self._send_error(401, "missing or invalid bearer token",
+                                 {'WWW-Authenticate': 'Bearer'})
+                return False
+
+        if require_json:
+            content_type = self.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+            if content_type != 'application/json':
+                self._send_error(415, "requests must be sent as application/json")
+                return False
+        self.close_connection = False
+        return True
+
+    def _run_schedule(self, name: str):
+        """Start a run of a scheduled profile outside its schedule"""
+        scheduler = self.server.scheduler
+        try:
+            job = scheduler.run_now(name) if scheduler else None
+        except KeyError:
+            job = None
+            scheduler = None
+        if scheduler is None:
+            self._send_error(404, f"no scheduled profile {name}")
+        elif job is None:
+            self._send_error(409, f"profile {name} is still running")
+        else:
+            self._send_json(202, job.summary(), {'Location': f"/jobs/{job.id}"})
+
+    def _send_results(self, job: ScanJob, query: Dict[str, List[str]]):
+        """Send a page of results; "latest" collapses them to one per port"""
+        if query.get('latest', ['0'])[0] in ('1', 'true'):
+            records = job.latest()
+            self._send_json(200, {'status': job.status, 'results': self._export(records)})
+            return
+        try:
+            cursor = max(0, int(query.get('since', ['0'])[0]))
+        except ValueError:
+            self._send_error(400, "since must be an integer")
+            return
+        with job.changed:
+            records = job.results[cursor:]
+        self._send_json(200, {'status': job.status, 'next': cursor + len(records),
+                              'results': self._export(records)})
+
+    def _stream_results(self, job: ScanJob):
+        """Stream results as NDJSON until the job finishes or the client leaves"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        cursor = 0
+        try:
+            while True:
+                records, finished = job.wait_for_results(cursor, timeout=1.0)
+                for exported in self._export(records):
+                    self.wfile.write(json.dumps(exported, default=json_default).encode('utf-8') + b'\n')
+                cursor += len(records)
+                self.wfile.flush()
+                if finished and not records:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _export(self, records: List[Dict]) -> List[Dict]:
+        return [self.server.service.annotator.annotate(record) for record in records]
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, default=json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        self._send_json(status, {'error': message}, headers)
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+class _ServiceHTTPServer(ThreadingHTTPServer):
+    """HTTP server of the scan service"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], family: int, service: ScanService,
+                 scheduler=None, token: Optional[str] = None):
+        self.address_family = family
+        self.service = service
+        self.scheduler = scheduler
+        self.token = token
+        super().__init__(address, _JobRequestHandler)
+
+class ScanDaemon:
+    """Serves a ScanService over HTTP on a loopback address.
+
+    The API is only ever bound to loopback; other addresses are refused.
+    Without a token it has no authentication, so any local process may use
+    it; with one, clients send it as a bearer token.  With a scheduler (a
+    ScanScheduler of the same service), its profiles run on their schedules
+    while the daemon is up.
+    """
+
+    def __init__(self, service: Optional[ScanService] = None, host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT, scheduler=None, token: Optional[str] = None):
+        if not ipaddress.ip_address(host).is_loopback:
+            raise ValueError(f"the scan daemon only listens on loopback addresses, not {host}")
+        self.service = service or ScanService()
+        self.host = host
+        self.port = port
+        self.scheduler = scheduler
+        self.token = token
+        self.http_server: Optional[_ServiceHTTPServer] = None
+        self.server_thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """Address the API listens on"""
+        return self.http_server.server_address[:2]
+
+    def start(self):
+        """Start the job workers and the API server in the background"""
+        family = targets.address_family(self.host)
+        self.http_server = _ServiceHTTPServer((self.host, self.port), family, self.service,
+                                              self.scheduler, self.token)
+        self.service.start()
+        if self.scheduler:
+            self.scheduler.start()
+        self.server_thread = threading.Thread(target=self.http_server.serve_forever,
+                                             name='scan-daemon', daemon=True)
+        self.server_thread.start()
+        logging.info(f"Scan daemon listening on {self.address[0]} port {self.address[1]}")
+
+    def serve_forever(self):
+        """Run until interrupted"""
+        self.start()
+        try:
+            while self.server_thread.is_alive():
+                self.server_thread.join(1.0)
+        except KeyboardInterrupt:
+            logging.info("Scan daemon interrupted")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop the API server and cancel running jobs"""
+        if self.http_server is None:
+            return
+        if self.scheduler:
+            self.scheduler.stop()
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.http_server = None
+        self.service.stop()
+
+    def __enter__(self) -> 'ScanDaemon':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
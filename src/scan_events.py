@@ -0,0 +1,91 @@
+"""
+Thread-safe event queue between the scan engines and the GUI
+"""
+
+import queue
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Event kinds
+PROGRESS = 'progress'
+RESULT = 'result'
+DONE = 'done'
+ERROR = 'error'
+
+class ScanEventQueue:
+    """Single queue that scan engines write progress and results into.
+
+    Scan threads only ever append to the queue; the consumer drains it on
+    its own schedule.  The callback factories adapt the queue to the
+    callback parameters of PortScanner and UPnPScanner.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def put_progress(self, source: str, progress: int):
+        """Report progress (0-100) of a scan source"""
+        self._queue.put((PROGRESS, source, progress))
+
+    def put_result(self, source: str, port_info: Dict):
+        """Report a single finding"""
+        self._queue.put((RESULT, source, port_info))
+
+    def put_done(self, source: str):
+        """Report that a scan source has finished"""
+        self._queue.put((DONE, source, None))
+
+    def put_error(self, source: str, message: str):
+        """Report that a scan source failed"""
+        self._queue.put((ERROR, source, message))
+
+    def progress_callback(self, source: str) -> Callable[[int], None]:
+        """Create a progress callback that writes into the queue"""
+        return lambda progress: self.put_progress(source, progress)
+
+    def found_callback(self, source: str) -> Callable[[Dict], None]:
+        """Create a per-finding callback that writes into the queue"""
+        return lambda port_info: self.put_result(source, port_info)
+
+    def drain(self, time_budget: float, max_events: int = 10000) -> 'ScanEventBatch':
+        """Collect queued events until the queue is empty or the budget is spent.
+
+        Progress events are coalesced so only the latest value per source is
+        kept, and findings are collected into a single batch.
+        """
+        batch = ScanEventBatch()
+        deadline = time.perf_counter() + time_budget
+
+        for count in range(max_events):
+            try:
+                kind, source, payload = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == PROGRESS:
+                batch.progress[source] = payload
+            elif kind == RESULT:
+                batch.results.append(payload)
+            elif kind == DONE:
+                batch.done.append(source)
+            elif kind == ERROR:
+                batch.errors.append((source, payload))
+
+            # Checking the clock is cheap but not free; do it every few events
+            if count % 64 == 63 and time.perf_counter() >= deadline:
+                break
+
+        return batch
+
+class ScanEventBatch:
+    """Coalesced events drained from a ScanEventQueue in one frame"""
+
+    def __init__(self):
+        self.progress: Dict[str, int] = {}
+        self.results: List[Dict] = []
+        self.done: List[str] = []
+        self.errors: List[Tuple[str, str]] = []
+
+    def is_empty(self) -> bool:
+        """Check whether the batch contains any events"""
+        return not (self.progress or self.results or self.done or self.errors)
@@ -0,0 +1,589 @@
+"""
+Scan pipeline running the independent scan phases concurrently
+"""
+
+import threading
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scanner import PortScanner
+from upnp_scanner import UPnPScanner
+from scan_events import ScanEventQueue
+from result_merge import LOCAL_HOST, ResultMerger
+from fingerprint import ServiceFingerprinter
+from tls_inspect import TLSInspector
+from exporters import StreamingExporter
+from plugins import PluginRunner
+import conntrack
+import ssdp
+import targets
+import resource_limits
+from cancellation import CancelToken
+from log_setup import debug_enabled
+
+# Interval at which the pipeline reports overall progress
+PROGRESS_INTERVAL = 0.1
+
+# Concurrent probes wanted when the limits allow it
+DEFAULT_PROBE_WINDOW = 256
+
+# How often the probe feeder, while waiting for a free slot, checks
+# whether the scan was stopped (seconds)
+FEED_CHECK_INTERVAL = 0.5
+
+# Phase names, also used as event sources for the findings they produce
+SOCKET_TABLE = 'socket_table'
+PROBE = 'probe'
+SSDP = 'ssdp'
+DESCRIPTION = 'description'
+FINGERPRINT = 'fingerprint'
+TLS = 'tls'
+PLUGINS = 'plugins'
+CONNTRACK = 'conntrack'
+
+# Phases that find open ports; their findings feed the follow-up phases
+PORT_PHASES = (SOCKET_TABLE, PROBE)
+
+# Host under which local sockets of each address family are reported
+LOOPBACK = {'IPv4': '127.0.0.1', 'IPv6': '::1'}
+
+class ScanPhase:
+    """Work accounting for one pipeline phase.
+
+    Each phase counts finished and known work units and measures the time a
+    unit takes, so the remaining time of the phase can be estimated.
+    """
+
+    def __init__(self, name: str, total: int = 0, workers: int = 1,
+                 unit_estimate: float = 0.01):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.workers = workers
+        self.unit_estimate = unit_estimate
+        self.finished = False
+        self.started_at = time.monotonic()
+        self._busy_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_work(self, units: int = 1):
+        """Add newly discovered work units"""
+        with self._lock:
+            self.total += units
+
+    def complete_unit(self, duration: float):
+        """Record a finished work unit and how long it took"""
+        with self._lock:
+            self.done += 1
+            self._busy_time += duration
+
+    def finish(self):
+        """Mark the phase as finished"""
+        self.finished = True
+
+    def remaining_time(self) -> float:
+        """Estimate the seconds of work left in this phase"""
+        if self.finished:
+            return 0.0
+        with self._lock:
+            unit_time = self._busy_time / self.done if self.done else self.unit_estimate
+            remaining_units = max(0, self.total - self.done)
+        return remaining_units * unit_time / self.workers
+
+class TimedPhase(ScanPhase):
+    """Phase whose length is a fixed listening window rather than work units"""
+
+    def __init__(self, name: str, duration: float):
+        super().__init__(name)
+        self.duration = duration
+
+    def remaining_time(self) -> float:
+        if self.finished:
+            return 0.0
+        return max(0.0, self.duration - (time.monotonic() - self.started_at))
+
+class FollowUpPhase(ScanPhase):
+    """Phase that examines the open ports found by the port phases.
+
+    Work arrives while the port phases run; `accepts` selects the findings
+    the phase wants and `examine` returns an updated finding or None.  The
+    phase has its own bounded worker pool, and finishes once it is idle and
+    every phase in `sources`, the phases that hand it work, has finished.
+    """
+
+    def __init__(self, name: str, workers: int, accepts: Callable[[Dict], bool],
+                 examine: Callable[[Dict], Optional[Dict]], unit_estimate: float = 0.5,
+                 sources: Tuple[str, ...] = PORT_PHASES):
+        super().__init__(name, workers=workers, unit_estimate=unit_estimate)
+        self.accepts = accepts
+        self.examine = examine
+        self.sources = sources
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+class ScanPipeline:
+    """Runs the local and UPnP scan phases concurrently and merges their results.
+
+    The phases are:
+      - socket_table: read the listening sockets of the local system
+      - probe: actively probe the monitored ports on every target host, with
+        IPv4 and IPv6 addresses interleaved so both stacks are probed at once
+      - ssdp: listen for UPnP devices
+      - description: fetch each device description as soon as it is discovered
+      - fingerprint (optional): identify the service on each open TCP port
+        from its banner as soon as the port is found
+      - tls (optional): inspect the TLS handshake of open TLS ports
+      - plugins (optional): run the probe plugins that handle each open
+        port; plugins matching a service rather than a port number run once
+        fingerprinting has identified the service
+      - conntrack (optional): count the inbound connections to each
+        monitored local port in the kernel connection-tracking table, and
+        annotate the local findings with them
+
+    Findings are merged per (host, protocol, port) so a port reported by
+    several phases becomes one record listing all of them; every new or
+    changed record is written into a single ScanEventQueue, and into the
+    exporter if one is given; a record exported again supersedes the
+    earlier version.  Overall progress is estimated from the remaining time
+    of the slowest phase, since the phases run in parallel and the scan
+    ends when the last one does.
+
+    The socket table, discovery results and descriptions come from the
+    scanners' caches while they are fresh; with force_refresh they are all
+    read again, and the caches updated.
+    """
+
+    def __init__(self, port_scanner: PortScanner, upnp_scanner: UPnPScanner,
+                 event_queue: ScanEventQueue, probe_workers: Optional[int] = None,
+                 description_workers: Optional[int] = None, discovery_timeout: int = 5,
+                 hosts: Optional[List[str]] = None,
+                 fingerprinter: Optional[ServiceFingerprinter] = None,
+                 tls_inspector: Optional[TLSInspector] = None,
+                 plugin_runner: Optional[PluginRunner] = None,
+                 exporter: Optional[StreamingExporter] = None,
+                 force_refresh: bool = False, count_traffic: bool = True):
+        self.port_scanner = port_scanner
+        self.upnp_scanner = upnp_scanner
+        self.event_queue = event_queue
+        # Without an explicit size, the probe window is derived from the
+        # open file limit and the ephemeral port range
+        self.probe_workers = probe_workers or resource_limits.get_probe_window(DEFAULT_PROBE_WINDOW)
+        self.description_workers = description_workers or upnp_scanner.fetch_workers
+        self.discovery_timeout = discovery_timeout
+        self.hosts = targets.interleave_families(hosts or targets.get_default_hosts())
+        self.fingerprinter = fingerprinter
+        self.tls_inspector = tls_inspector
+        self.plugin_runner = plugin_runner
+        self.exporter = exporter
+        # Read sockets, devices and descriptions again instead of using caches
+        self.force_refresh = force_refresh
+        # Annotate local findings with connection-tracking counts where readable
+        self.count_traffic = count_traffic
+
+        self.is_running = False
+        self.cancel_token = CancelToken()
+        self.phases: Dict[str, ScanPhase] = {}
+        self.listening_ports: Optional[set] = None
+        # Inbound connections per (protocol, port) once the table was read
+        self.traffic: Optional[Dict] = None
+        self._traffic_lock = threading.Lock()
+        self.coordinator_thread = None
+
+        self.merger = ResultMerger()
+        self._last_progress = 0
+        self._finished = threading.Event()
+        self._probe_pool = None
+        self._description_pool = None
+        self.follow_ups: List[FollowUpPhase] = []
+
+    def start(self, ports_to_scan: List[Dict]):
+        """Start all phases in the background"""
+        self.is_running = True
+        self.cancel_token = CancelToken()
+        self._finished.clear()
+        self.merger = ResultMerger(local_addresses=ssdp.get_local_ipv4_addresses(include_loopback=True),
+                                   lookup_sources=PORT_PHASES)
+        self._last_progress = 0
+        self.listening_ports = None
+        self.traffic = None
+        started_at = time.monotonic()
+
+        self.phases = {
+            SOCKET_TABLE: ScanPhase(SOCKET_TABLE, total=1, unit_estimate=0.1),
+            PROBE: ScanPhase(PROBE, total=len(ports_to_scan) * len(self.hosts),
+                             workers=self.probe_workers),
+            SSDP: TimedPhase(SSDP, self.discovery_timeout),
+            DESCRIPTION: ScanPhase(DESCRIPTION, workers=self.description_workers,
+                                   unit_estimate=0.5),
+        }
+
+        self._probe_pool = ThreadPoolExecutor(max_workers=self.probe_workers,
+                                              thread_name_prefix='probe')
+        self._description_pool = ThreadPoolExecutor(max_workers=self.description_workers,
+                                                    thread_name_prefix='description')
+
+        self.follow_ups = []
+        if self.fingerprinter:
+            self.follow_ups.append(FollowUpPhase(FINGERPRINT, self.fingerprinter.workers,
+                                                 lambda finding: finding.get('protocol') == 'TCP',
+                                                 self._fingerprint))
+        if self.tls_inspector:
+            self.follow_ups.append(FollowUpPhase(TLS, self.tls_inspector.workers,
+                                                 self.tls_inspector.wants, self._inspect_tls))
+        if self.plugin_runner:
+            # With fingerprinting, service plugins wait for the identified service
+            if self.fingerprinter:
+                accepts = self.plugin_runner.port_plugins
+                sources = PORT_PHASES + (FINGERPRINT,)
+            else:
+                accepts, sources = self.plugin_runner.wants, PORT_PHASES
+            self.follow_ups.append(FollowUpPhase(PLUGINS, self.plugin_runner.workers,
+                                                 accepts, self._run_plugins,
+                                                 unit_estimate=1.0, sources=sources))
+        for phase in self.follow_ups:
+            self.phases[phase.name] = phase
+        if self.count_traffic:
+            self.phases[CONNTRACK] = ScanPhase(CONNTRACK, total=1, unit_estimate=0.5)
+
+        threading.Thread(target=self._run_socket_table, args=(ports_to_scan,), daemon=True).start()
+        if self.count_traffic:
+            threading.Thread(target=self._run_conntrack, args=(ports_to_scan,), daemon=True).start()
+        threading.Thread(target=self._run_discovery, daemon=True).start()
+        self._run_probes(ports_to_scan)
+
+        self.coordinator_thread = threading.Thread(target=self._coordinate, args=(started_at,),
+                                                   daemon=True)
+        self.coordinator_thread.start()
+
+    def stop(self):
+        """Stop the pipeline without waiting for in-flight work.
+
+        The cancel token aborts the probes, searches, fetches and handshakes
+        in flight, so the worker threads are free again within milliseconds.
+        """
+        self.is_running = False
+        self.upnp_scanner.is_scanning = False
+        self.cancel_token.cancel()
+        pools = [self._probe_pool, self._description_pool] + [phase.pool for phase in self.follow_ups]
+        for pool in pools:
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._finished.set()
+
+    def get_progress(self) -> int:
+        """Estimate overall progress (0-100) from the slowest phase"""
+        elapsed = time.monotonic() - min(phase.started_at for phase in self.phases.values())
+        remaining = max(phase.remaining_time() for phase in self.phases.values())
+        progress = int(100 * elapsed / (elapsed + remaining)) if elapsed + remaining > 0 else 100
+        if not all(phase.finished for phase in self.phases.values()):
+            progress = min(progress, 99)
+
+        # Estimates can shift as unit timings are measured; never move backwards
+        self._last_progress = max(self._last_progress, progress)
+        return self._last_progress
+
+    def _report(self, source: str, finding: Dict) -> bool:
+        """Merge a finding and write the merged record into the event queue if it changed"""
+        if not self.is_running:
+            return False
+        record, is_new = self.merger.add(source, finding)
+        if record is None:
+            return False
+        self.event_queue.put_result(source, record)
+        if self.exporter:
+            self.exporter.put(record)
+        if is_new and source in PORT_PHASES:
+            for phase in self.follow_ups:
+                if phase.accepts(finding):
+                    self._submit_follow_up(phase, finding)
+            if self.count_traffic:
+                with self._traffic_lock:
+                    traffic = self.traffic
+                # Before the table is read, the conntrack phase annotates the record
+                if traffic is not None:
+                    self._annotate_traffic(record, traffic)
+        if (source == FINGERPRINT and PLUGINS in self.phases
+                and self.plugin_runner.service_plugins(finding)):
+            self._submit_follow_up(self.phases[PLUGINS], finding)
+        return True
+
+    def _annotate_traffic(self, record: Dict, traffic: Dict):
+        """Report the inbound connections counted for a local record"""
+        if record['host'] not in (LOCAL_HOST, LOOPBACK['IPv6']):
+            return
+        counts = traffic.get((record['protocol'], record['port']))
+        if counts is not None:
+            finding = {field: record[field] for field in ('host', 'port', 'protocol', 'state')}
+            self._report(CONNTRACK, conntrack.annotate(finding, counts))
+
+    def _submit_follow_up(self, phase: 'FollowUpPhase', finding: Dict):
+        """Queue a finding for a follow-up phase"""
+        with phase.lock:
+            phase.pending += 1
+        phase.add_work()
+        try:
+            phase.pool.submit(self._run_follow_up, phase, finding)
+        except RuntimeError:
+            # Pool already shut down by stop()
+            with phase.lock:
+                phase.pending -= 1
+
+    def _run_follow_up(self, phase: 'FollowUpPhase', finding: Dict):
+        """Follow-up phases: examine one open port and report what was learned"""
+        start = time.monotonic()
+        updated = None
+        try:
+            if self.is_running:
+                updated = phase.examine(finding)
+                if updated:
+                    self._report(phase.name, updated)
+        except Exception as e:
+            if debug_enabled():
+                logging.debug("%s of %s port %d failed: %s", phase.name, finding['host'], finding['port'], e)
+        finally:
+            # Queued while this unit is pending, so the plugin phase cannot
+            # finish in between
+            if phase.name == FINGERPRINT and not updated:
+                self._plugins_unidentified(finding)
+            phase.complete_unit(time.monotonic() - start)
+            with phase.lock:
+                phase.pending -= 1
+            self._check_follow_ups_finished()
+
+    def _check_follow_ups_finished(self):
+        """Finish idle follow-up phases once the phases feeding them are done"""
+        for phase in self.follow_ups:
+            with phase.lock:
+                idle = phase.pending == 0
+            sources_done = all(self.phases[name].finished for name in phase.sources)
+            if idle and sources_done and not phase.finished:
+                phase.finish()
+        self._check_finished()
+
+    def _plugins_unidentified(self, finding: Dict):
+        """Queue the service plugins of a port fingerprinting did not identify.
+
+        They match on the service name looked up by port number instead; a
+        fingerprint of None marks the finding as past fingerprinting.
+        """
+        if not self.is_running or PLUGINS not in self.phases:
+            return
+        unidentified = dict(finding, fingerprint=None)
+        if self.plugin_runner.service_plugins(unidentified):
+            self._submit_follow_up(self.phases[PLUGINS], unidentified)
+
+    def _fingerprint(self, finding: Dict) -> Optional[Dict]:
+        """Identify the service on an open port"""
+        fingerprint = self.fingerprinter.identify(finding['host'], finding['port'], self.cancel_token)
+        return self.fingerprinter.apply(finding, fingerprint) if fingerprint else None
+
+    def _inspect_tls(self, finding: Dict) -> Optional[Dict]:
+        """Inspect the TLS configuration of an open port"""
+        info = self.tls_inspector.inspect(finding['host'], finding['port'], token=self.cancel_token)
+        return self.tls_inspector.apply(finding, info) if info else None
+
+    def _run_plugins(self, finding: Dict) -> Optional[Dict]:
+        """Run the probe plugins that handle an open port"""
+        if 'fingerprint' in finding:
+            # Past fingerprinting, identified or not
+            plugins = self.plugin_runner.service_plugins(finding)
+        elif self.fingerprinter:
+            plugins = self.plugin_runner.port_plugins(finding)
+        else:
+            plugins = None
+        results = self.plugin_runner.run(finding, self.cancel_token, plugins)
+        return self.plugin_runner.apply(finding, results) if results else None
+
+    def _run_socket_table(self, ports_to_scan: List[Dict]):
+        """Phase: read the listening sockets and report monitored ones"""
+        phase = self.phases[SOCKET_TABLE]
+        start = time.monotonic()
+        try:
+            # Sockets are reported on the loopback address of their family
+            sockets = {(LOOPBACK[p.get('family', 'IPv4')], p['port'], p['protocol'])
+                       for p in self.port_scanner.get_listening_ports(self.force_refresh)}
+            self.listening_ports = {(host, port) for host, port, _ in sockets}
+            by_port: Dict[int, List] = {}
+            for host, port, protocol in sorted(sockets):
+                by_port.setdefault(port, []).append((host, protocol))
+            for port_info in ports_to_scan:
+                for host, protocol in by_port.get(port_info['port'], ()):
+                    self._report(SOCKET_TABLE, self.port_scanner.make_finding(
+                        port_info, protocol, 'LISTENING', host))
+        except Exception as e:
+            logging.error(f"Socket table phase failed: {e}")
+        finally:
+            phase.complete_unit(time.monotonic() - start)
+            phase.finish()
+            self._check_follow_ups_finished()
+
+    def _run_conntrack(self, ports_to_scan: List[Dict]):
+        """Phase: count inbound connections to the monitored ports"""
+        phase = self.phases[CONNTRACK]
+        start = time.monotonic()
+        try:
+            local_addresses = self.merger.local_addresses | conntrack.get_local_ipv6_addresses()
+            ports = {(protocol, port_info['port']) for port_info in ports_to_scan
+                     for protocol in port_info.get('protocols', ['TCP'])}
+            traffic = self.port_scanner.get_connection_traffic(local_addresses, ports,
+                                                               self.force_refresh, self.cancel_token)
+            if traffic is None:
+                logging.info("Connection tracking table not readable; traffic counts skipped")
+            # Records merged so far are annotated here, later ones as they arrive
+            with self._traffic_lock:
+                self.traffic = traffic or {}
+                with self.merger.lock:
+                    records = [dict(record) for record in self.merger.records.values()]
+            for record in records:
+                self._annotate_traffic(record, self.traffic)
+        except Exception as e:
+            logging.error(f"Connection tracking phase failed: {e}")
+        finally:
+            phase.complete_unit(time.monotonic() - start)
+            phase.finish()
+            self._check_finished()
+
+    def _run_probes(self, ports_to_scan: List[Dict]):
+        """Phase: probe the monitored ports in a worker pool.
+
+        Probes are handed to the pool by a feeder thread as earlier ones
+        complete, so at most probe_workers are queued or in flight however
+        many hosts and ports the scan covers.
+        """
+        phase = self.phases[PROBE]
+        total = len(ports_to_scan) * len(self.hosts)
+        if not total:
+            phase.finish()
+            self._check_follow_ups_finished()
+            return
+
+        remaining = [total]
+        remaining_lock = threading.Lock()
+        slots = threading.Semaphore(self.probe_workers)
+
+        def probe(host: str, port_info: Dict):
+            start = time.monotonic()
+            try:
+                # Ports already known from the socket table need no probe
+                listening = self.listening_ports
+                if self.is_running and not (listening and (host, port_info['port']) in listening):
+                    finding = self.port_scanner.probe_port(port_info, host, token=self.cancel_token)
+                    if finding:
+                        self._report(PROBE, finding)
+            except Exception as e:
+                if debug_enabled():
+                    logging.debug("Probe of %s port %d failed: %s", host, port_info['port'], e)
+            finally:
+                slots.release()
+                phase.complete_unit(time.monotonic() - start)
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    phase.finish()
+                    self._check_follow_ups_finished()
+
+        def feed():
+            for port_info in ports_to_scan:
+                for host in self.hosts:
+                    while not slots.acquire(timeout=FEED_CHECK_INTERVAL):
+                        if not self.is_running:
+                            return
+                    try:
+                        self._probe_pool.submit(probe, host, port_info)
+                    except RuntimeError:
+                        # Pool already shut down by stop()
+                        return
+
+        threading.Thread(target=feed, name='probe-feed', daemon=True).start()
+
+    def _run_discovery(self):
+        """Phase: listen for UPnP devices, handing each one to the description phase"""
+        phase = self.phases[SSDP]
+        description_phase = self.phases[DESCRIPTION]
+        pending = [0]
+        pending_lock = threading.Lock()
+
+        def fetch(location: str):
+            start = time.monotonic()
+            try:
+                if self.is_running:
+                    device_info = self.upnp_scanner.get_device_info(location, self.force_refresh,
+                                                                    self.cancel_token)
+                    if device_info:
+                        finding = self.upnp_scanner.make_finding(location, device_info)
+                        if finding:
+                            self._report(DESCRIPTION, finding)
+                        for mapping_finding in self.upnp_scanner.get_mapping_findings(
+                                location, device_info, self.cancel_token):
+                            self._report(DESCRIPTION, mapping_finding)
+            finally:
+                description_phase.complete_unit(time.monotonic() - start)
+                with pending_lock:
+                    pending[0] -= 1
+                    last = pending[0] == 0 and phase.finished
+                if last:
+                    description_phase.finish()
+                    self._check_finished()
+
+        def on_location(location: str):
+            if not self.is_running:
+                return
+            with pending_lock:
+                pending[0] += 1
+            description_phase.add_work()
+            try:
+                self._description_pool.submit(fetch, location)
+            except RuntimeError:
+                # Pool already shut down by stop()
+                pass
+
+        if self.discovery_timeout <= 0:
+            # Discovery disabled for this scan
+            phase.finish()
+            description_phase.finish()
+            self._check_finished()
+            return
+
+        self.upnp_scanner.is_scanning = True
+        try:
+            self.upnp_scanner.discover_upnp_devices(timeout=self.discovery_timeout,
+                                                    location_callback=on_location,
+                                                    force_refresh=self.force_refresh,
+                                                    token=self.cancel_token)
+        except Exception as e:
+            logging.error(f"UPnP discovery phase failed: {e}")
+        finally:
+            phase.finish()
+            with pending_lock:
+                idle = pending[0] == 0
+            if idle:
+                description_phase.finish()
+            self._check_finished()
+
+    def _check_finished(self):
+        """Signal the coordinator once every phase has finished"""
+        if all(phase.finished for phase in self.phases.values()):
+            self._finished.set()
+
+    def _coordinate(self, started_at: float):
+        """Report progress until all phases finish, then report completion"""
+        while not self._finished.wait(PROGRESS_INTERVAL):
+            self.event_queue.put_progress('pipeline', self.get_progress())
+
+        self.upnp_scanner.is_scanning = False
+        for pool in [self._probe_pool, self._description_pool] + [phase.pool for phase in self.follow_ups]:
+            pool.shutdown(wait=False)
+        if self.exporter:
+            self.exporter.close()
+
+        if self.is_running:
+            self.is_running = False
+            logging.info(f"Scan pipeline finished in {time.monotonic() - started_at:.2f}s")
+            if self.plugin_runner:
+                self.plugin_runner.log_timings()
+            self.event_queue.put_progress('pipeline', 100)
+            self.event_queue.put_done('pipeline')
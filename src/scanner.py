@@ -2,49 +2,244 @@
 Port scanning functionality for local system
 """
 
+import errno
 import socket
+import struct
+import sys
 import threading
 import logging
 from typing import List, Dict, Tuple, Callable, Optional
 import time
 import subprocess
 import platform
+import os
+
+import conntrack
+import probe_trace
+from cache import CONNTRACK, SOCKETS, ScanCache, TTLCache
+from cancellation import CancelToken, is_cancelled, watch
+from log_setup import debug_enabled
+
+# Kernel socket tables (Linux) and the protocol/family each one lists
+PROC_NET_DIR = '/proc/net'
+PROC_NET_TABLES = {
+    'tcp': ('TCP', 'IPv4'),
+    'tcp6': ('TCP', 'IPv6'),
+    'udp': ('UDP', 'IPv4'),
+    'udp6': ('UDP', 'IPv6'),
+}
+
+def decode_proc_address(address_hex: str) -> str:
+    """Decode an address from /proc/net/tcp*; stored as native-endian 32-bit words"""
+    raw = bytes.fromhex(address_hex)
+    words = b''.join(raw[i:i + 4][::-1] if sys.byteorder == 'little' else raw[i:i + 4]
+                     for i in range(0, len(raw), 4))
+    family = socket.AF_INET if len(words) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, words)
+
+# SO_LINGER with a zero timeout: close() sends RST and skips TIME_WAIT
+ABORTIVE_LINGER = struct.pack('ii', 1, 0)
+
+# Retries when the system briefly runs out of local ports
+CONNECT_RETRIES = 3
+CONNECT_RETRY_DELAY = 0.05
 
 class PortScanner:
-    """Local port scanner for TCP and UDP ports"""
+    """Local port scanner for TCP and UDP ports
+    
+    In fast mode probe sockets are closed abortively (SO_LINGER 0), so
+    repeated sweeps do not leave thousands of connections in TIME_WAIT
+    holding local ports.
     
-    def __init__(self):
+    With a scan_cache, the listening sockets are read at most once per
+    socket TTL and the snapshot is shared by every scan in that time, e.g.
+    by consecutive GUI scans or the jobs of the scan daemon.  A snapshot_ttl
+    without a scan_cache keeps a private snapshot for that long.
+    """
+    
+    def __init__(self, fast: bool = False, snapshot_ttl: float = 0.0,
+                 scan_cache: Optional[ScanCache] = None):
+        self.fast = fast
+        if scan_cache is not None:
+            self.snapshot_cache = scan_cache.source(SOCKETS)
+            self.conntrack_cache = scan_cache.source(CONNTRACK)
+        elif snapshot_ttl > 0:
+            self.snapshot_cache = TTLCache(snapshot_ttl, max_entries=1)
+            self.conntrack_cache = TTLCache(snapshot_ttl, max_entries=1)
+        else:
+            self.snapshot_cache = None
+            self.conntrack_cache = None
         self.is_scanning = False
         self.scan_thread = None
+        self.cancel_token = None
         self.progress_callback = None
         self.result_callback = None
         
-    def scan_tcp_port(self, host: str, port: int, timeout: float = 1.0) -> bool:
-        """Scan a single TCP port"""
+    def resolve(self, host: str, port: int, socktype: int) -> List[Tuple]:
+        """Resolve a host to (family, sockaddr) pairs for IPv4 and IPv6"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(timeout)
-            result = sock.connect_ex((host, port))
-            sock.close()
-            return result == 0
-        except Exception as e:
-            logging.debug(f"TCP scan error on port {port}: {e}")
-            return False
+            return [(family, sockaddr) for family, _, _, _, sockaddr in
+                    socket.getaddrinfo(host, port, socket.AF_UNSPEC, socktype)]
+        except socket.gaierror as e:
+            if debug_enabled():
+                logging.debug("Cannot resolve %s: %s", host, e)
+            return []
     
-    def scan_udp_port(self, host: str, port: int, timeout: float = 1.0) -> bool:
+    def scan_tcp_port(self, host: str, port: int, timeout: float = 1.0,
+                      token: Optional[CancelToken] = None) -> bool:
+        """Scan a single TCP port on every address of the host
+        
+        Cancelling the token aborts a connect in progress.
+        """
+        traced = probe_trace.sampled()
+        for family, sockaddr in self.resolve(host, port, socket.SOCK_STREAM):
+            if is_cancelled(token):
+                break
+            sock = None
+            result = None
+            start = time.perf_counter() if traced else 0.0
+            try:
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.settimeout(timeout)
+                with watch(token, sock):
+                    result = self.connect(sock, sockaddr, token)
+                if result == 0 and not is_cancelled(token):
+                    return True
+            except Exception as e:
+                result = e
+                if debug_enabled():
+                    logging.debug("TCP scan error on %s port %d: %s", host, port, e)
+            finally:
+                if sock is not None:
+                    self.close_socket(sock)
+                if traced:
+                    probe_trace.emit('tcp_probe', host=host, port=port, address=sockaddr[0],
+                                     result=probe_trace.describe_result(result),
+                                     duration_ms=round((time.perf_counter() - start) * 1000, 3))
+        return False
+    
+    def connect(self, sock: socket.socket, sockaddr: Tuple,
+                token: Optional[CancelToken] = None) -> int:
+        """Connect a probe socket, backing off while local ports are exhausted"""
+        delay = CONNECT_RETRY_DELAY
+        for attempt in range(CONNECT_RETRIES + 1):
+            result = sock.connect_ex(sockaddr)
+            if result != errno.EADDRNOTAVAIL or attempt == CONNECT_RETRIES:
+                return result
+            if token is not None:
+                if token.wait(delay):
+                    return result
+            else:
+                time.sleep(delay)
+            delay *= 2
+        return result
+    
+    def close_socket(self, sock: socket.socket):
+        """Close a probe socket, abortively in fast mode"""
+        if self.fast:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, ABORTIVE_LINGER)
+            except OSError:
+                pass
+        sock.close()
+    
+    def scan_udp_port(self, host: str, port: int, timeout: float = 1.0,
+                      token: Optional[CancelToken] = None) -> bool:
         """Scan a single UDP port (basic check)"""
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(timeout)
-            sock.sendto(b'', (host, port))
-            sock.close()
-            return True
-        except Exception as e:
-            logging.debug(f"UDP scan error on port {port}: {e}")
-            return False
+        traced = probe_trace.sampled()
+        for family, sockaddr in self.resolve(host, port, socket.SOCK_DGRAM):
+            if is_cancelled(token):
+                break
+            try:
+                with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                    sock.settimeout(timeout)
+                    sock.sendto(b'', sockaddr)
+                if traced:
+                    probe_trace.emit('udp_probe', host=host, port=port, address=sockaddr[0], result='sent')
+                return True
+            except Exception as e:
+                if debug_enabled():
+                    logging.debug("UDP scan error on %s port %d: %s", host, port, e)
+                if traced:
+                    probe_trace.emit('udp_probe', host=host, port=port, address=sockaddr[0],
+                                     result=probe_trace.describe_result(e))
+        return False
+    
+    def get_listening_ports(self, force_refresh: bool = False) -> List[Dict]:
+        """Get currently listening ports, from the snapshot while it is fresh"""
+        if self.snapshot_cache is None:
+            return self.read_listening_ports()
+        return list(self.snapshot_cache.get_or_load('listening', self.read_listening_ports,
+                                                    force_refresh))
+    
+    def get_connection_traffic(self, local_addresses: Optional[set] = None,
+                               ports: Optional[set] = None, force_refresh: bool = False,
+                               token: Optional[CancelToken] = None) -> Optional[Dict]:
+        """Count inbound connections per (protocol, port) in the connection-tracking table
+        
+        Returns None where the table cannot be read (not Linux, or not
+        root).  Counts are cached like the listening sockets; the table is
+        read in a single streaming pass however large it is.
+        """
+        def load():
+            return conntrack.read_conntrack(local_addresses, ports, token)
+        
+        if self.conntrack_cache is None:
+            return load()
+        key = tuple(frozenset(values) if values is not None else None
+                    for values in (local_addresses, ports))
+        counts = self.conntrack_cache.get_or_load(key, load, force_refresh)
+        if is_cancelled(token):
+            # Counts of an interrupted read are incomplete
+            self.conntrack_cache.invalidate(key)
+        return counts
+    
+    def read_listening_ports(self) -> List[Dict]:
+        """Read the currently listening ports
+        
+        The kernel socket tables are read directly where available (Linux),
+        which covers IPv4 and IPv6; netstat is used elsewhere.
+        """
+        if os.path.exists(PROC_NET_DIR):
+            listening_ports = self.read_proc_net()
+            if listening_ports is not None:
+                return listening_ports
+        return self.read_netstat()
     
-    def get_listening_ports(self) -> List[Dict]:
-        """Get currently listening ports using netstat"""
+    def read_proc_net(self) -> Optional[List[Dict]]:
+        """Read listening sockets from /proc/net/{tcp,tcp6,udp,udp6}"""
+        listening_ports = []
+        found_table = False
+        
+        for table, (protocol, family) in PROC_NET_TABLES.items():
+            try:
+                with open(os.path.join(PROC_NET_DIR, table), 'r') as f:
+                    lines = f.readlines()[1:]
+            except OSError:
+                continue
+            found_table = True
+            
+            listen_state = '0A' if protocol == 'TCP' else '07'
+            for line in lines:
+                fields = line.split()
+                if len(fields) < 4 or fields[3] != listen_state:
+                    continue
+                try:
+                    address_hex, port_hex = fields[1].split(':')
+                    listening_ports.append({
+                        'port': int(port_hex, 16),
+                        'protocol': protocol,
+                        'family': family,
+                        'address': decode_proc_address(address_hex),
+                        'state': 'LISTENING'
+                    })
+                except ValueError:
+                    continue
+        
+        return listening_ports if found_table else None
+    
+    def read_netstat(self) -> List[Dict]:
+        """Get listening ports by parsing netstat output"""
         listening_ports = []
         
         try:
@@ -54,37 +249,79 @@ class PortScanner:
                 cmd = ["netstat", "-tuln"]
             
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            lines = result.stdout.split('\n')
             
-            for line in lines:
-                if 'LISTEN' in line or 'LISTENING' in line:
-                    parts = line.split()
-                    if len(parts) >= 4:
-                        address = parts[3] if platform.system() == "Windows" else parts[3]
-                        if ':' in address:
-                            try:
-                                port = int(address.split(':')[-1])
-                                protocol = 'TCP' if 'tcp' in line.lower() else 'UDP'
-                                listening_ports.append({
-                                    'port': port,
-                                    'protocol': protocol,
-                                    'address': address,
-                                    'state': 'LISTENING'
-                                })
-                            except ValueError:
-                                continue
+            for line in result.stdout.split('\n'):
+                parts = line.split()
+                if len(parts) < 4:
+                    continue
+                proto = parts[0].lower()
+                # UDP sockets have no LISTEN state; every bound one counts
+                if not (proto.startswith('udp') or 'LISTEN' in line):
+                    continue
+                if not proto.startswith(('tcp', 'udp')):
+                    continue
+                
+                # Windows puts the local address in the second column
+                address = parts[1] if platform.system() == "Windows" else parts[3]
+                # IPv6 literals contain colons; the port follows the last one
+                host, sep, port = address.rpartition(':')
+                if not sep:
+                    continue
+                try:
+                    host = host.strip('[]')
+                    listening_ports.append({
+                        'port': int(port),
+                        'protocol': 'TCP' if proto.startswith('tcp') else 'UDP',
+                        'family': 'IPv6' if ':' in host or proto.endswith('6') else 'IPv4',
+                        'address': host,
+                        'state': 'LISTENING'
+                    })
+                except ValueError:
+                    continue
         except Exception as e:
             logging.error(f"Error getting listening ports: {e}")
         
         return listening_ports
     
+    def make_finding(self, port_info: Dict, protocol: str, state: str,
+                     host: str = '127.0.0.1') -> Dict:
+        """Build a result entry for a port"""
+        return {
+            'host': host,
+            'port': port_info['port'],
+            'protocol': protocol,
+            'service': port_info.get('service', 'Unknown'),
+            'risk_level': port_info.get('risk_level', 'Low'),
+            'state': state
+        }
+    
+    def probe_port(self, port_info: Dict, host: str = '127.0.0.1',
+                   timeout: float = 0.5, token: Optional[CancelToken] = None) -> Optional[Dict]:
+        """Probe a port with each of its protocols, returning a finding if open"""
+        for protocol in port_info.get('protocols', ['TCP']):
+            is_open = False
+            if protocol == 'TCP':
+                is_open = self.scan_tcp_port(host, port_info['port'], timeout=timeout, token=token)
+            elif protocol == 'UDP':
+                is_open = self.scan_udp_port(host, port_info['port'], timeout=timeout, token=token)
+            
+            if is_open:
+                return self.make_finding(port_info, protocol, 'OPEN', host)
+        return None
+    
     def scan_common_ports(self, ports_to_scan: List[Dict], 
                          progress_callback: Optional[Callable] = None,
-                         result_callback: Optional[Callable] = None) -> None:
-        """Scan a list of common ports"""
+                         result_callback: Optional[Callable] = None,
+                         found_callback: Optional[Callable] = None) -> None:
+        """Scan a list of common ports
+
+        found_callback is called with each open port as soon as it is found;
+        result_callback receives the complete list when the scan ends.
+        """
         self.progress_callback = progress_callback
         self.result_callback = result_callback
         self.is_scanning = True
+        token = self.cancel_token = CancelToken()
         
         def scan_worker():
             open_ports = []
@@ -92,49 +329,35 @@ class PortScanner:
             
             # Get currently listening ports for reference
             listening_ports = self.get_listening_ports()
-            listening_port_numbers = [p['port'] for p in listening_ports]
+            listening_protocols = {}
+            for p in listening_ports:
+                listening_protocols.setdefault(p['port'], p['protocol'])
             
             for i, port_info in enumerate(ports_to_scan):
-                if not self.is_scanning:
+                if token.cancelled:
                     break
                 
                 port = port_info['port']
-                protocols = port_info.get('protocols', ['TCP'])
                 
                 # Check if port is in listening ports first
-                if port in listening_port_numbers:
-                    open_ports.append({
-                        'port': port,
-                        'protocol': 'TCP/UDP',
-                        'service': port_info.get('service', 'Unknown'),
-                        'risk_level': port_info.get('risk_level', 'Low'),
-                        'state': 'LISTENING'
-                    })
+                if port in listening_protocols:
+                    finding = self.make_finding(port_info, listening_protocols[port], 'LISTENING')
                 else:
-                    # Scan the port
-                    for protocol in protocols:
-                        is_open = False
-                        if protocol == 'TCP':
-                            is_open = self.scan_tcp_port('127.0.0.1', port, timeout=0.5)
-                        elif protocol == 'UDP':
-                            is_open = self.scan_udp_port('127.0.0.1', port, timeout=0.5)
-                        
-                        if is_open:
-                            open_ports.append({
-                                'port': port,
-                                'protocol': protocol,
-                                'service': port_info.get('service', 'Unknown'),
-                                'risk_level': port_info.get('risk_level', 'Low'),
-                                'state': 'OPEN'
-                            })
-                            break
+                    finding = self.probe_port(port_info, token=token)
+                
+                if finding:
+                    open_ports.append(finding)
+                    if found_callback:
+                        found_callback(finding)
                 
                 # Update progress
                 if progress_callback:
                     progress = int((i + 1) / total_ports * 100)
                     progress_callback(progress)
                 
-                time.sleep(0.01)  # Small delay to prevent overwhelming the system
+                # Small delay to prevent overwhelming the system
+                if token.wait(0.01):
+                    break
             
             self.is_scanning = False
             if result_callback:
@@ -144,7 +367,7 @@ class PortScanner:
         self.scan_thread.start()
     
     def stop_scan(self):
-        """Stop the current scan"""
+        """Stop the current scan, aborting the probe in flight; does not wait"""
         self.is_scanning = False
-        if self.scan_thread and self.scan_thread.is_alive():
-            self.scan_thread.join(timeout=2)
+        if self.cancel_token:
+            self.cancel_token.cancel()
@@ -0,0 +1,377 @@
+"""
+Recurring scans of named profiles on interval or cron schedules
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, FrozenSet, List, Optional, Union
+
+from scan_daemon import JobQueueFull, ScanJob, ScanService
+
+# Default location of the schedule configuration
+DEFAULT_SCHEDULE_FILE = os.path.join(os.path.expanduser('~'), '.portscope', 'schedules.json')
+
+# Profile keys passed on to the scan service as the job request; the rate
+# of a profile is its "probe_workers" window
+REQUEST_FIELDS = ('targets', 'ports', 'fingerprint', 'tls', 'plugins', 'traffic',
+                  'discovery_timeout', 'probe_workers', 'force_refresh')
+SCHEDULE_FIELDS = ('name', 'every', 'cron', 'jitter', 'overlap', 'enabled')
+
+# What happens when a run comes due while the previous one is still going
+SKIP = 'skip'
+QUEUE = 'queue'
+
+# Duration suffixes accepted for "every" and "jitter"
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Cron fields: name, lowest and highest value; 7 is also Sunday
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12),
+               ('weekday', 0, 7))
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# Steps after which a cron expression is taken to never match (e.g. Feb 30)
+MAX_CRON_STEPS = 10000
+
+# Longest the scheduler sleeps before looking at the clock again (seconds),
+# and how often it checks whether an overlapping run may start
+MAX_SLEEP = 60.0
+OVERLAP_POLL = 1.0
+
+def parse_duration(value) -> float:
+    """Parse seconds given as a number or as "90s", "15m", "2h" or "1d" """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    elif isinstance(value, str) and value.strip():
+        text = value.strip().lower()
+        unit = DURATION_UNITS.get(text[-1])
+        try:
+            seconds = float(text[:-1]) * unit if unit else float(text)
+        except ValueError:
+            raise ValueError(f"invalid duration {value!r}") from None
+    else:
+        raise ValueError(f"invalid duration {value!r}")
+    if seconds < 0:
+        raise ValueError(f"negative duration {value!r}")
+    return seconds
+
+class IntervalSchedule:
+    """Runs every `interval` seconds, the first time when the scheduler starts"""
+
+    def __init__(self, interval: float):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.interval = interval
+
+    def first(self, now: float) -> float:
+        return now
+
+    def next_after(self, previous: float, now: float) -> float:
+        """The next run time; runs missed while the system slept are dropped"""
+        missed = max(0, int((now - previous) // self.interval))
+        return previous + (missed + 1) * self.interval
+
+    def describe(self) -> str:
+        return f"every {self.interval:g}s"
+
+def parse_cron_field(text: str, name: str, low: int, high: int) -> FrozenSet[int]:
+    """Parse one cron field: "*", "5", "1-5", "*/15", "10-50/20" or a list of them"""
+    values = set()
+    for part in text.split(','):
+        body, slash, step_text = part.partition('/')
+        try:
+            step = int(step_text) if slash else 1
+            if body == '*':
+                start, end = low, high
+            elif '-' in body:
+                start, end = (int(value) for value in body.split('-', 1))
+            else:
+                start = int(body)
+                end = high if slash else start
+        except ValueError:
+            raise ValueError(f"invalid cron {name} {text!r}") from None
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"cron {name} {text!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    if name == 'weekday' and 7 in values:
+        values.discard(7)
+        values.add(0)
+    return frozenset(values)
+
+class CronSchedule:
+    """Runs at the local times matching a five-field cron expression.
+
+    Fields are minute, hour, day of month, month and day of week (0 or 7 is
+    Sunday).  As in cron, when both day fields are restricted a day matching
+    either one is run.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = CRON_ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"cron expression {expression!r} needs {len(CRON_FIELDS)} fields")
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = (
+            parse_cron_field(text, name, low, high)
+            for text, (name, low, high) in zip(fields, CRON_FIELDS))
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        # Fails now for expressions that never match
+        self.next_after(time.time(), time.time())
+
+    def first(self, now: float) -> float:
+        return self.next_after(now, now)
+
+    def next_after(self, previous: float, now: float) -> float:
+        """The first matching minute after both previous and now"""
+        moment = datetime.fromtimestamp(max(previous, now)).replace(second=0, microsecond=0)
+        moment += timedelta(minutes=1)
+        for _ in range(MAX_CRON_STEPS):
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"cron expression {self.expression!r} never matches")
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        # datetime counts weekdays from Monday, cron from Sunday
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def describe(self) -> str:
+        return f"cron {self.expression}"
+
+@dataclass
+class ScanProfile:
+    """A named scan and when to run it"""
+    name: str
+    request: Dict
+    schedule: Union[IntervalSchedule, CronSchedule]
+    jitter: float = 0.0
+    overlap: str = SKIP
+
+def parse_profile(config: Dict) -> ScanProfile:
+    """Build a profile from its configuration; raises ValueError if invalid"""
+    if not isinstance(config, dict):
+        raise ValueError("a profile must be a JSON object")
+    name = config.get('name')
+    if not name or not isinstance(name, str):
+        raise ValueError("a profile needs a name")
+    unknown = set(config) - set(REQUEST_FIELDS) - set(SCHEDULE_FIELDS)
+    if unknown:
+        raise ValueError(f"profile {name}: unknown settings {', '.join(sorted(unknown))}")
+
+    if ('every' in config) == ('cron' in config):
+        raise ValueError(f"profile {name}: give either \"every\" or \"cron\"")
+    try:
+        if 'every' in config:
+            schedule = IntervalSchedule(parse_duration(config['every']))
+        else:
+            schedule = CronSchedule(str(config['cron']))
+        jitter = parse_duration(config.get('jitter', 0))
+    except ValueError as e:
+        raise ValueError(f"profile {name}: {e}") from None
+
+    overlap = config.get('overlap', SKIP)
+    if overlap not in (SKIP, QUEUE):
+        raise ValueError(f"profile {name}: overlap must be \"{SKIP}\" or \"{QUEUE}\"")
+
+    request = {key: config[key] for key in REQUEST_FIELDS if key in config}
+    request['profile'] = name
+    return ScanProfile(name, request, schedule, jitter, overlap)
+
+def load_profiles(path: str = DEFAULT_SCHEDULE_FILE) -> List[ScanProfile]:
+    """Load the enabled profiles of a schedule file.
+
+    The file holds {"profiles": [...]}, each profile giving a "name", either
+    "every" (seconds, or e.g. "15m") or "cron", and optionally "jitter",
+    "overlap" ("skip" or "queue"), "enabled" and the job settings of the
+    scan daemon such as "targets", "ports" and "probe_workers".  See
+    data/schedules.example.json.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid schedule file {path}: {e}") from None
+    profiles = config.get('profiles') if isinstance(config, dict) else None
+    if not isinstance(profiles, list):
+        raise ValueError(f"schedule file {path} has no \"profiles\" list")
+
+    loaded = [parse_profile(profile) for profile in profiles
+              if not (isinstance(profile, dict) and profile.get('enabled') is False)]
+    names = [profile.name for profile in loaded]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"duplicate profile names: {', '.join(sorted(duplicates))}")
+    return loaded
+
+@dataclass
+class _ProfileState:
+    """Run bookkeeping of one profile"""
+    profile: ScanProfile
+    # Scheduled time before jitter, and when the run actually starts
+    base_time: float = 0.0
+    due_time: float = 0.0
+    job: Optional[ScanJob] = None
+    queued: bool = False
+    runs: int = 0
+    skipped: int = 0
+    history: List[str] = field(default_factory=list)
+
+class ScanScheduler:
+    """Submits the runs of scan profiles to a ScanService on their schedules.
+
+    Each run is delayed by a random jitter of up to the profile's jitter, so
+    profiles on the same cadence do not all start at once.  A run that comes
+    due while the profile's previous job is still queued or running is
+    skipped, or with overlap "queue" started once that job ends; at most one
+    run waits this way.  All runs go through the one service, so they share
+    its warm caches, HTTP connection pool and probe budget with each other
+    and with jobs submitted over the API.
+    """
+
+    def __init__(self, service: ScanService, profiles: List[ScanProfile],
+                 clock: Callable[[], float] = time.time, rng: Optional[random.Random] = None):
+        self.service = service
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.states = {profile.name: _ProfileState(profile) for profile in profiles}
+        self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.is_running = False
+
+    def start(self):
+        """Validate the profiles and start scheduling in the background"""
+        if self.is_running:
+            return
+        for state in self.states.values():
+            try:
+                self.service.parse_request(state.profile.request)
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"profile {state.profile.name}: {e}") from None
+
+        now = self.clock()
+        with self.lock:
+            for state in self.states.values():
+                self._plan(state, state.profile.schedule.first(now))
+        logging.info(f"Scheduling {len(self.states)} scan profiles")
+        self.is_running = True
+        self._wakeup.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop scheduling; jobs already submitted are left to the service"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def run_now(self, name: str) -> Optional[ScanJob]:
+        """Start a run of a profile right away, subject to its overlap policy"""
+        with self.lock:
+            state = self.states.get(name)
+            if state is None:
+                raise KeyError(name)
+            return self._fire(state)
+
+    def status(self) -> List[Dict]:
+        """Describe every profile and its runs"""
+        with self.lock:
+            return [{
+                'name': state.profile.name,
+                'schedule': state.profile.schedule.describe(),
+                'jitter': state.profile.jitter,
+                'overlap': state.profile.overlap,
+                'next_run': state.due_time if self.is_running else None,
+                'runs': state.runs,
+                'skipped': state.skipped,
+                'queued': state.queued,
+                'last_job': state.job.id if state.job else None,
+                'last_status': state.job.status if state.job else None,
+                'jobs': list(state.history),
+            } for state in self.states.values()]
+
+    def _plan(self, state: _ProfileState, base_time: float):
+        """Set the next run of a profile, delayed by its jitter"""
+        state.base_time = base_time
+        state.due_time = base_time + self.rng.uniform(0, state.profile.jitter)
+
+    def _run(self):
+        while self.is_running:
+            now = self.clock()
+            with self.lock:
+                for state in self.states.values():
+                    if state.queued and self._idle(state):
+                        state.queued = False
+                        self._submit(state)
+                    if now >= state.due_time:
+                        self._fire(state)
+                        self._plan(state, state.profile.schedule.next_after(state.base_time, now))
+                delay = min((state.due_time - now for state in self.states.values()),
+                            default=MAX_SLEEP)
+                if any(state.queued for state in self.states.values()):
+                    delay = min(delay, OVERLAP_POLL)
+            self._wakeup.wait(max(0.0, min(delay, MAX_SLEEP)))
+
+    def _idle(self, state: _ProfileState) -> bool:
+        return state.job is None or state.job.is_finished
+
+    def _fire(self, state: _ProfileState) -> Optional[ScanJob]:
+        """A run came due: submit it, queue it or skip it"""
+        if self._idle(state):
+            return self._submit(state)
+        if state.profile.overlap == QUEUE and not state.queued:
+            state.queued = True
+            logging.info(f"Scan profile {state.profile.name}: job {state.job.id} still "
+                         f"{state.job.status}, run queued")
+        else:
+            state.skipped += 1
+            logging.info(f"Scan profile {state.profile.name}: job {state.job.id} still "
+                         f"{state.job.status}, run skipped")
+        return None
+
+    def _submit(self, state: _ProfileState) -> Optional[ScanJob]:
+        try:
+            job = self.service.submit(state.profile.request)
+        except JobQueueFull as e:
+            state.skipped += 1
+            logging.warning(f"Scan profile {state.profile.name}: run skipped, {e}")
+            return None
+        except (ValueError, TypeError) as e:
+            state.skipped += 1
+            logging.error(f"Scan profile {state.profile.name}: run failed to start: {e}")
+            return None
+        state.job = job
+        state.runs += 1
+        state.history = (state.history + [job.id])[-self.service.max_finished:]
+        logging.info(f"Scan profile {state.profile.name}: started job {job.id}")
+        return job
@@ -0,0 +1,356 @@
+"""
+Asynchronous SSDP discovery for UPnP devices
+"""
+
+import asyncio
+import logging
+import socket
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cancellation import CancelToken, run_cancellable
+from log_setup import debug_enabled
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; interfaces are found through the host name there
+    fcntl = None
+
+SSDP_ADDR = '239.255.255.250'
+SSDP_ADDR_V6 = 'ff02::c'
+SSDP_PORT = 1900
+
+# Search targets sent on every interface, most specific first
+SEARCH_TARGETS = [
+    'urn:schemas-upnp-org:device:InternetGatewayDevice:1',
+    'upnp:rootdevice',
+    'ssdp:all',
+]
+
+# ioctl request to read the IPv4 address of an interface (Linux)
+SIOCGIFADDR = 0x8915
+
+# Interfaces with their IPv6 addresses (Linux)
+PROC_IF_INET6 = '/proc/net/if_inet6'
+
+def get_local_ipv4_addresses(include_loopback: bool = False) -> List[str]:
+    """Get the IPv4 addresses of the local network interfaces"""
+    addresses = []
+
+    if fcntl is not None and hasattr(socket, 'if_nameindex'):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for _, name in socket.if_nameindex():
+                try:
+                    request = struct.pack('256s', name[:15].encode())
+                    result = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+                    addresses.append(socket.inet_ntoa(result[20:24]))
+                except OSError:
+                    # Interface without an IPv4 address
+                    continue
+        finally:
+            sock.close()
+
+    if not addresses:
+        try:
+            addresses = socket.gethostbyname_ex(socket.gethostname())[2]
+        except OSError:
+            addresses = []
+
+    if not include_loopback:
+        addresses = [address for address in addresses if not address.startswith('127.')]
+
+    # Fall back to letting the OS choose the interface
+    return list(dict.fromkeys(addresses)) or ['0.0.0.0']
+
+def get_local_ipv6_interfaces(include_loopback: bool = False) -> List[int]:
+    """Get the indices of the network interfaces that have an IPv6 address"""
+    if not socket.has_ipv6:
+        return []
+
+    indices = []
+    try:
+        with open(PROC_IF_INET6, 'r') as f:
+            for line in f:
+                # address, index, prefix length, scope, flags, name
+                fields = line.split()
+                if len(fields) >= 6 and (include_loopback or fields[5] != 'lo'):
+                    indices.append(int(fields[1], 16))
+    except OSError:
+        if hasattr(socket, 'if_nameindex'):
+            try:
+                indices = [index for index, name in socket.if_nameindex()
+                           if include_loopback or not name.startswith('lo')]
+            except OSError:
+                indices = []
+
+    return list(dict.fromkeys(indices))
+
+def is_ipv6(host: str) -> bool:
+    """Check whether a target host is an IPv6 literal"""
+    return ':' in host
+
+def format_host(host: str, port: int) -> str:
+    """Format a HOST header value, bracketing IPv6 literals"""
+    return f"[{host}]:{port}" if is_ipv6(host) else f"{host}:{port}"
+
+def build_msearch(search_target: str, mx: int = 1,
+                  host: str = f"{SSDP_ADDR}:{SSDP_PORT}") -> bytes:
+    """Build an M-SEARCH request"""
+    return (
+        'M-SEARCH * HTTP/1.1\r\n'
+        f'HOST: {host}\r\n'
+        'MAN: "ssdp:discover"\r\n'
+        f'ST: {search_target}\r\n'
+        f'MX: {mx}\r\n\r\n'
+    ).encode()
+
+def parse_ssdp_message(data: bytes) -> Optional[Dict[str, str]]:
+    """Parse an SSDP response or NOTIFY message into a header dict.
+
+    Header names are upper-cased; the start line is stored under 'START_LINE'.
+    Returns None for messages that are not SSDP.
+    """
+    text = data.decode('utf-8', errors='ignore')
+    lines = text.split('\r\n') if '\r\n' in text else text.split('\n')
+    if not lines:
+        return None
+
+    start_line = lines[0].strip()
+    if not (start_line.startswith('HTTP/') or start_line.startswith('NOTIFY')):
+        return None
+
+    headers = {'START_LINE': start_line}
+    for line in lines[1:]:
+        if not line:
+            break
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().upper()] = value.strip()
+    return headers
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol feeding received SSDP responses to a handler"""
+
+    def __init__(self, handler: Callable[[bytes, Tuple], None]):
+        self.handler = handler
+
+    def datagram_received(self, data: bytes, addr: Tuple):
+        self.handler(data, addr)
+
+    def error_received(self, exc: Exception):
+        if debug_enabled():
+            logging.debug("SSDP socket error: %s", exc)
+
+class SSDPDiscovery:
+    """Multi-interface SSDP discovery with early termination.
+
+    An M-SEARCH for every search target is sent from every local interface and
+    repeated `retransmissions` times, as UDP may drop any single datagram.
+    With ipv6 enabled the search also goes to the link-local group ff02::c on
+    every interface that has an IPv6 address.
+    Responses are deduplicated by USN.  Devices answer after a random delay
+    of up to MX seconds, so once responses arrive the engine waits for a
+    quiet period derived from the observed gaps between them and stops early
+    instead of always waiting for `max_wait`.
+    """
+
+    def __init__(self, search_targets: Optional[List[str]] = None, mx: int = 1,
+                 retransmissions: int = 2, retransmit_interval: float = 0.1,
+                 min_quiet: float = 0.25, max_wait: float = 5.0,
+                 interfaces: Optional[List[str]] = None,
+                 target: Optional[Tuple[str, int]] = None,
+                 targets: Optional[List[Tuple[str, int]]] = None,
+                 ipv6: bool = True, ipv6_interfaces: Optional[List[int]] = None):
+        self.search_targets = search_targets or SEARCH_TARGETS
+        self.mx = mx
+        self.retransmissions = retransmissions
+        self.retransmit_interval = retransmit_interval
+        self.min_quiet = min_quiet
+        self.max_wait = max_wait
+        self.interfaces = interfaces
+        self.ipv6_interfaces = ipv6_interfaces
+        # Several targets allow unicast searches to known devices
+        if targets or target:
+            self.targets = targets or [target]
+        else:
+            self.targets = [(SSDP_ADDR, SSDP_PORT)]
+            if ipv6 and socket.has_ipv6:
+                self.targets.append((SSDP_ADDR_V6, SSDP_PORT))
+
+    async def discover(self, response_callback: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+        """Run discovery and return the unique responses.
+
+        response_callback is called with each new response as it arrives.
+        """
+        loop = asyncio.get_running_loop()
+        responses: Dict[str, Dict] = {}
+        arrivals: List[float] = []
+        new_response = asyncio.Event()
+
+        def handle(data: bytes, addr: Tuple):
+            headers = parse_ssdp_message(data)
+            if not headers or not headers['START_LINE'].startswith('HTTP/'):
+                return
+            key = headers.get('USN') or headers.get('LOCATION')
+            if not key or key in responses:
+                return
+            headers['ADDRESS'] = addr[0]
+            responses[key] = headers
+            arrivals.append(loop.time())
+            new_response.set()
+            if response_callback:
+                response_callback(headers)
+
+        transports = await self._open_transports(loop, handle)
+        if not transports:
+            return []
+
+        start = loop.time()
+        try:
+            sender = asyncio.ensure_future(self._send_searches(transports))
+            await self._wait_until_quiet(loop, start, arrivals, new_response)
+            sender.cancel()
+        finally:
+            for _, _, transport in transports:
+                transport.close()
+
+        if debug_enabled():
+            logging.debug("SSDP discovery found %d responses in %.2fs",
+                          len(responses), loop.time() - start)
+        return list(responses.values())
+
+    async def _open_transports(self, loop, handle) -> List[Tuple[int, int, asyncio.DatagramTransport]]:
+        """Open one datagram socket per local interface and address family.
+
+        Returns (family, interface index, transport) tuples; the index is only
+        set for IPv6 sockets, which need it to reach the link-local group.
+        """
+        transports = []
+        families = {socket.AF_INET6 if is_ipv6(host) else socket.AF_INET
+                    for host, _ in self.targets}
+
+        if socket.AF_INET in families:
+            for address in self.interfaces or get_local_ipv4_addresses():
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+                    if address != '0.0.0.0':
+                        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                        socket.inet_aton(address))
+                    sock.bind((address, 0))
+                    transports.append((socket.AF_INET, 0,
+                                       await self._create_endpoint(loop, sock, handle)))
+                except OSError as e:
+                    sock.close()
+                    if debug_enabled():
+                        logging.debug("Cannot open SSDP socket on %s: %s", address, e)
+
+        if socket.AF_INET6 in families:
+            indices = self.ipv6_interfaces
+            if indices is None:
+                indices = get_local_ipv6_interfaces()
+            # Index 0 lets the OS choose, enough for unicast targets
+            for index in indices or [0]:
+                try:
+                    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+                except OSError as e:
+                    if debug_enabled():
+                        logging.debug("Cannot open IPv6 SSDP socket: %s", e)
+                    break
+                try:
+                    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 2)
+                    if index:
+                        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, index)
+                    sock.bind(('::', 0))
+                    transports.append((socket.AF_INET6, index,
+                                       await self._create_endpoint(loop, sock, handle)))
+                except OSError as e:
+                    sock.close()
+                    if debug_enabled():
+                        logging.debug("Cannot open IPv6 SSDP socket on interface %s: %s",
+                                      index, e)
+        return transports
+
+    async def _create_endpoint(self, loop, sock: socket.socket, handle) -> asyncio.DatagramTransport:
+        """Wrap a bound socket in a datagram transport"""
+        sock.setblocking(False)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DiscoveryProtocol(handle), sock=sock)
+        return transport
+
+    async def _send_searches(self, transports: List[Tuple[int, int, asyncio.DatagramTransport]]):
+        """Send every search target on every interface, with retransmissions"""
+        messages = [(build_msearch(st, self.mx, format_host(host, port)), (host, port))
+                    for host, port in self.targets for st in self.search_targets]
+
+        # Work out the destinations per socket once
+        sends = []
+        first_v6 = next((transport for family, _, transport in transports
+                         if family == socket.AF_INET6), None)
+        for family, index, transport in transports:
+            for message, (host, port) in messages:
+                if is_ipv6(host) != (family == socket.AF_INET6):
+                    continue
+                if family == socket.AF_INET:
+                    sends.append((transport, message, (host, port)))
+                elif host.lower().startswith('ff'):
+                    # Link-local multicast is scoped to the sending interface
+                    sends.append((transport, message, (host, port, 0, index)))
+                elif transport is first_v6:
+                    # Unicast IPv6 is routed; one socket is enough
+                    sends.append((transport, message, (host, port)))
+
+        for attempt in range(self.retransmissions + 1):
+            if attempt:
+                await asyncio.sleep(self.retransmit_interval)
+            for transport, message, destination in sends:
+                try:
+                    transport.sendto(message, destination)
+                except OSError as e:
+                    if debug_enabled():
+                        logging.debug("SSDP send failed: %s", e)
+
+    async def _wait_until_quiet(self, loop, start: float, arrivals: List[float],
+                                new_response: asyncio.Event):
+        """Wait until responses stop arriving or max_wait is reached"""
+        # Until the searches are retransmitted there is nothing to judge from
+        send_window = self.retransmissions * self.retransmit_interval
+        deadline = start + self.max_wait
+
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                return
+
+            if arrivals:
+                # Expect the next response within a few typical gaps
+                gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+                typical_gap = sum(gaps) / len(gaps) if gaps else arrivals[0] - start
+                quiet = min(max(self.min_quiet, 4 * typical_gap), float(self.mx))
+                wake_at = arrivals[-1] + quiet
+            else:
+                # No device answered; give the slowest allowed responder a chance
+                wake_at = start + send_window + max(self.min_quiet * 2, min(self.mx, 0.75))
+
+            wake_at = max(wake_at, start + send_window + self.min_quiet)
+            if now >= wake_at:
+                return
+
+            new_response.clear()
+            try:
+                await asyncio.wait_for(new_response.wait(), timeout=min(wake_at, deadline) - now)
+            except asyncio.TimeoutError:
+                pass
+
+def discover(timeout: float = 5.0, response_callback: Optional[Callable[[Dict], None]] = None,
+             token: Optional[CancelToken] = None, **options) -> List[Dict]:
+    """Run SSDP discovery synchronously, for use from worker threads.
+
+    Cancelling the token cancels the discovery task and closes its sockets;
+    an empty list is returned, the responses seen so far having gone to
+    response_callback already.
+    """
+    engine = SSDPDiscovery(max_wait=timeout, **options)
+    return asyncio.run(run_cancellable(engine.discover(response_callback), token, default=[]))
@@ -0,0 +1,243 @@
+"""
+Passive SSDP listener and persistent UPnP device cache
+"""
+
+import json
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import ssdp
+from log_setup import debug_enabled
+
+# Lifetime assumed for announcements without a usable CACHE-CONTROL header
+DEFAULT_MAX_AGE = 1800
+
+# Default location of the persisted device cache
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.portscope', 'ssdp_devices.json')
+
+def parse_max_age(cache_control: Optional[str]) -> int:
+    """Extract max-age (seconds) from a CACHE-CONTROL header"""
+    if cache_control:
+        match = re.search(r'max-age\s*=\s*(\d+)', cache_control, re.IGNORECASE)
+        if match:
+            return int(match.group(1))
+    return DEFAULT_MAX_AGE
+
+class DeviceCache:
+    """UPnP devices seen through SSDP, keyed by USN.
+
+    Every entry expires after the max-age its device announced.  Expiry
+    times are wall-clock timestamps so the cache stays valid when it is
+    saved and loaded again by a later run.  Expired entries are kept until
+    the scanner has searched for them again, then purged.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self.last_full_discovery = 0.0
+        self.lock = threading.Lock()
+        self.dirty = False
+
+    def update(self, headers: Dict[str, str], now: Optional[float] = None) -> bool:
+        """Add or refresh a device from an alive announcement or search response.
+
+        Returns True if the device was not known before.
+        """
+        usn = headers.get('USN')
+        location = headers.get('LOCATION')
+        if not usn or not location:
+            return False
+
+        now = now if now is not None else time.time()
+        entry = {
+            'usn': usn,
+            'location': location,
+            'type': headers.get('NT') or headers.get('ST', ''),
+            'server': headers.get('SERVER', ''),
+            'address': headers.get('ADDRESS', ''),
+            'last_seen': now,
+            'expires_at': now + parse_max_age(headers.get('CACHE-CONTROL'))
+        }
+        with self.lock:
+            is_new = usn not in self.entries
+            self.entries[usn] = entry
+            self.dirty = True
+        return is_new
+
+    def remove(self, usn: str):
+        """Remove a device after a byebye announcement"""
+        with self.lock:
+            if self.entries.pop(usn, None) is not None:
+                self.dirty = True
+
+    def split(self, now: Optional[float] = None) -> Tuple[List[Dict], List[Dict]]:
+        """Split the entries into fresh and expired ones"""
+        now = now if now is not None else time.time()
+        with self.lock:
+            entries = list(self.entries.values())
+        fresh = [entry for entry in entries if entry['expires_at'] > now]
+        expired = [entry for entry in entries if entry['expires_at'] <= now]
+        return fresh, expired
+
+    def purge_expired(self, now: Optional[float] = None):
+        """Drop entries that have expired"""
+        now = now if now is not None else time.time()
+        with self.lock:
+            expired = [usn for usn, entry in self.entries.items() if entry['expires_at'] <= now]
+            for usn in expired:
+                del self.entries[usn]
+            if expired:
+                self.dirty = True
+
+    def mark_full_discovery(self):
+        """Record that a full active discovery has just completed"""
+        with self.lock:
+            self.last_full_discovery = time.time()
+            self.dirty = True
+
+    def load(self):
+        """Load the cache from disk, ignoring a missing or corrupt file"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self.lock:
+                self.entries = {entry['usn']: entry for entry in data.get('devices', [])}
+                self.last_full_discovery = data.get('last_full_discovery', 0.0)
+                self.dirty = False
+            logging.info(f"Loaded {len(self.entries)} cached UPnP devices")
+        except Exception as e:
+            logging.error(f"Failed to load UPnP device cache: {e}")
+
+    def save(self):
+        """Write the cache to disk if it changed"""
+        if not self.path or not self.dirty:
+            return
+        try:
+            with self.lock:
+                data = {
+                    'last_full_discovery': self.last_full_discovery,
+                    'devices': list(self.entries.values())
+                }
+                self.dirty = False
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logging.error(f"Failed to save UPnP device cache: {e}")
+
+class SSDPListener:
+    """Background listener for SSDP NOTIFY announcements.
+
+    Joins the SSDP multicast group on every local interface and keeps a
+    DeviceCache up to date from ssdp:alive, ssdp:update and ssdp:byebye
+    messages.  The cache is saved periodically and when the listener stops.
+    """
+
+    def __init__(self, cache: DeviceCache, save_interval: float = 60.0):
+        self.cache = cache
+        self.save_interval = save_interval
+        self.is_running = False
+        self.listen_thread = None
+        self.sock = None
+
+    def start(self) -> bool:
+        """Start listening; returns False if the SSDP port cannot be bound"""
+        if self.is_running:
+            return True
+        try:
+            self.sock = self._open_socket()
+        except OSError as e:
+            logging.warning(f"Cannot start SSDP listener: {e}")
+            return False
+
+        self.is_running = True
+        self.listen_thread = threading.Thread(target=self._listen, daemon=True)
+        self.listen_thread.start()
+        logging.info("SSDP listener started")
+        return True
+
+    def stop(self):
+        """Stop listening and save the cache"""
+        self.is_running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+        self.cache.save()
+
+    def _open_socket(self) -> socket.socket:
+        """Open a socket bound to the SSDP port and joined to the group"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', ssdp.SSDP_PORT))
+
+            joined = 0
+            for address in ssdp.get_local_ipv4_addresses():
+                membership = struct.pack('4s4s', socket.inet_aton(ssdp.SSDP_ADDR),
+                                         socket.inet_aton(address))
+                try:
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+                    joined += 1
+                except OSError as e:
+                    if debug_enabled():
+                        logging.debug("Cannot join SSDP group on %s: %s", address, e)
+            if not joined:
+                raise OSError("could not join the SSDP multicast group on any interface")
+
+            sock.settimeout(1.0)
+            return sock
+        except OSError:
+            sock.close()
+            raise
+
+    def _listen(self):
+        """Receive loop run on the listener thread"""
+        last_save = time.monotonic()
+        sock = self.sock
+        while self.is_running:
+            try:
+                data, addr = sock.recvfrom(65535)
+                self.handle_message(data, addr)
+            except socket.timeout:
+                pass
+            except OSError:
+                # Socket closed by stop()
+                break
+            except Exception as e:
+                if debug_enabled():
+                    logging.debug("SSDP listener error: %s", e)
+
+            if time.monotonic() - last_save >= self.save_interval:
+                self.cache.save()
+                last_save = time.monotonic()
+
+    def handle_message(self, data: bytes, addr: Tuple):
+        """Apply a received announcement to the cache"""
+        headers = ssdp.parse_ssdp_message(data)
+        if not headers or not headers['START_LINE'].startswith('NOTIFY'):
+            return
+        headers['ADDRESS'] = addr[0]
+
+        nts = headers.get('NTS', '').lower()
+        if nts in ('ssdp:alive', 'ssdp:update'):
+            if self.cache.update(headers):
+                if debug_enabled():
+                    logging.debug("New UPnP device announced: %s", headers.get('LOCATION'))
+        elif nts == 'ssdp:byebye' and headers.get('USN'):
+            self.cache.remove(headers['USN'])
@@ -0,0 +1,121 @@
+"""
+Scan target parsing for IPv4 and IPv6 hosts, prefixes and port ranges
+"""
+
+import ipaddress
+import logging
+import socket
+from typing import Iterable, List
+
+# Hosts probed when no targets are given: the local system on both stacks
+DEFAULT_HOSTS = ['127.0.0.1', '::1']
+
+# Valid TCP/UDP port numbers
+MIN_PORT = 1
+MAX_PORT = 65535
+
+# Upper bound on the hosts a single prefix may expand to; an IPv6 /64
+# cannot be swept address by address
+MAX_PREFIX_HOSTS = 65536
+
+def ipv6_available() -> bool:
+    """Check whether the system can open IPv6 sockets"""
+    if not socket.has_ipv6:
+        return False
+    try:
+        socket.socket(socket.AF_INET6, socket.SOCK_STREAM).close()
+        return True
+    except OSError:
+        return False
+
+def get_default_hosts() -> List[str]:
+    """Get the default targets the system can actually reach"""
+    if ipv6_available():
+        return list(DEFAULT_HOSTS)
+    return [host for host in DEFAULT_HOSTS if ':' not in host]
+
+def address_family(host: str) -> int:
+    """Get the address family of an IP literal, AF_UNSPEC for host names"""
+    try:
+        address = ipaddress.ip_address(host.split('%', 1)[0])
+    except ValueError:
+        return socket.AF_UNSPEC
+    return socket.AF_INET6 if address.version == 6 else socket.AF_INET
+
+def expand_target(spec: str, max_hosts: int = MAX_PREFIX_HOSTS) -> List[str]:
+    """Expand a target to host addresses.
+
+    A target is an IPv4 or IPv6 address, a prefix such as 192.168.1.0/24 or
+    fd00::/120, or a host name, which resolves to all of its IPv4 and IPv6
+    addresses.  Raises ValueError for prefixes larger than max_hosts.
+    """
+    spec = spec.strip().strip('[]')
+    if not spec:
+        return []
+
+    if '/' in spec:
+        network = ipaddress.ip_network(spec, strict=False)
+        if network.num_addresses > max_hosts:
+            raise ValueError(f"prefix {spec} has {network.num_addresses} addresses, "
+                             f"more than the limit of {max_hosts}")
+        if network.num_addresses <= 2:
+            return [str(address) for address in network]
+        return [str(address) for address in network.hosts()]
+
+    if address_family(spec) != socket.AF_UNSPEC:
+        return [spec]
+
+    try:
+        infos = socket.getaddrinfo(spec, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        logging.warning(f"Cannot resolve target {spec}: {e}")
+        return []
+    return list(dict.fromkeys(sockaddr[0] for _, _, _, _, sockaddr in infos))
+
+def expand_targets(specs: Iterable[str], max_hosts: int = MAX_PREFIX_HOSTS) -> List[str]:
+    """Expand several targets, dropping duplicate addresses"""
+    hosts = []
+    for spec in specs:
+        hosts.extend(expand_target(spec, max_hosts))
+    return list(dict.fromkeys(hosts))
+
+def interleave_families(hosts: List[str]) -> List[str]:
+    """Order hosts so IPv4 and IPv6 addresses alternate.
+
+    Work is submitted in this order, so a dual-stack host has its v4 and v6
+    addresses probed side by side instead of one family after the other.
+    """
+    v4 = [host for host in hosts if address_family(host) != socket.AF_INET6]
+    v6 = [host for host in hosts if address_family(host) == socket.AF_INET6]
+    ordered = []
+    for index in range(max(len(v4), len(v6))):
+        ordered.extend(group[index] for group in (v4, v6) if index < len(group))
+    return ordered
+
+def parse_port_spec(spec: str) -> List[int]:
+    """Parse a port specification such as "22,80,8000-8100" or "all".
+
+    Returns the ports in ascending order without duplicates.  Raises
+    ValueError for malformed parts or ports outside 1-65535.
+    """
+    spec = spec.strip().lower()
+    if spec in ('all', '-', '*'):
+        return list(range(MIN_PORT, MAX_PORT + 1))
+
+    ports = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        try:
+            first = int(start) if start else MIN_PORT
+            last = (int(end) if end else MAX_PORT) if sep else first
+        except ValueError:
+            raise ValueError(f"invalid port range '{part}'") from None
+        if first > last:
+            raise ValueError(f"invalid port range '{part}'")
+        if first < MIN_PORT or last > MAX_PORT:
+            raise ValueError(f"port range '{part}' is outside {MIN_PORT}-{MAX_PORT}")
+        ports.update(range(first, last + 1))
+    return sorted(ports)
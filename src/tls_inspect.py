@@ -0,0 +1,278 @@
+"""
+TLS handshake inspection for ports that speak TLS
+"""
+
+import logging
+import socket
+import ssl
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from cancellation import CancelToken, create_connection, watch
+from log_setup import debug_enabled
+
+# Protocol versions considered too old to accept
+WEAK_VERSIONS = ('SSLv2', 'SSLv3', 'TLSv1', 'TLSv1.1')
+
+# Cipher name fragments that indicate broken or export-grade ciphers
+WEAK_CIPHER_MARKERS = ('NULL', 'EXPORT', 'RC4', 'DES-CBC', '3DES', 'MD5', 'anon')
+
+# Certificate fields by OID
+OID_NAMES = {
+    '2.5.4.3': 'CN',
+    '2.5.4.6': 'C',
+    '2.5.4.7': 'L',
+    '2.5.4.8': 'ST',
+    '2.5.4.10': 'O',
+    '2.5.4.11': 'OU',
+}
+OID_SUBJECT_ALT_NAME = '2.5.29.17'
+
+# DER tags used by certificates
+TAG_SEQUENCE = 0x30
+TAG_OID = 0x06
+TAG_OCTET_STRING = 0x04
+TAG_UTC_TIME = 0x17
+TAG_GENERALIZED_TIME = 0x18
+TAG_CONTEXT_0 = 0xa0
+TAG_CONTEXT_3 = 0xa3
+TAG_SAN_DNS = 0x82
+TAG_SAN_IP = 0x87
+
+class DERError(ValueError):
+    """Raised for certificates that cannot be decoded"""
+
+def read_tlv(data: bytes, offset: int) -> Tuple[int, int, int]:
+    """Read a DER element header; returns (tag, content start, content end)"""
+    if offset + 2 > len(data):
+        raise DERError("truncated element")
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0 or count > 4 or offset + count > len(data):
+            raise DERError("invalid length")
+        length = int.from_bytes(data[offset:offset + count], 'big')
+        offset += count
+    if offset + length > len(data):
+        raise DERError("element exceeds its container")
+    return tag, offset, offset + length
+
+def read_children(data: bytes, start: int, end: int) -> List[Tuple[int, int, int]]:
+    """Read the elements inside a constructed element"""
+    children = []
+    while start < end:
+        tag, content_start, content_end = read_tlv(data, start)
+        children.append((tag, content_start, content_end))
+        start = content_end
+    return children
+
+def decode_oid(raw: bytes) -> str:
+    """Decode an OBJECT IDENTIFIER"""
+    if not raw:
+        return ''
+    arcs = [raw[0] // 40, raw[0] % 40]
+    value = 0
+    for byte in raw[1:]:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    return '.'.join(str(arc) for arc in arcs)
+
+def decode_time(tag: int, raw: bytes) -> datetime:
+    """Decode a UTCTime or GeneralizedTime"""
+    text = raw.decode('ascii').rstrip('Z')
+    if tag == TAG_UTC_TIME:
+        year = int(text[:2])
+        text = str(1900 + year if year >= 50 else 2000 + year) + text[2:]
+    return datetime.strptime(text[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+def decode_name(data: bytes, start: int, end: int) -> str:
+    """Decode a Name into "CN=..., O=..." form"""
+    parts = []
+    for _, set_start, set_end in read_children(data, start, end):
+        for _, attr_start, attr_end in read_children(data, set_start, set_end):
+            attribute = read_children(data, attr_start, attr_end)
+            if len(attribute) < 2:
+                continue
+            (_, oid_start, oid_end), (_, value_start, value_end) = attribute[:2]
+            oid = decode_oid(data[oid_start:oid_end])
+            value = data[value_start:value_end].decode('utf-8', errors='replace')
+            parts.append(f"{OID_NAMES.get(oid, oid)}={value}")
+    return ', '.join(parts)
+
+def decode_san(data: bytes, start: int, end: int) -> List[str]:
+    """Decode the DNS names and IP addresses of a subjectAltName extension"""
+    names = []
+    _, seq_start, seq_end = read_tlv(data, start)
+    for tag, name_start, name_end in read_children(data, seq_start, seq_end):
+        raw = data[name_start:name_end]
+        if tag == TAG_SAN_DNS:
+            names.append(raw.decode('ascii', errors='replace'))
+        elif tag == TAG_SAN_IP and len(raw) in (4, 16):
+            family = socket.AF_INET if len(raw) == 4 else socket.AF_INET6
+            names.append(socket.inet_ntop(family, raw))
+    return names
+
+def parse_certificate(der: bytes) -> Dict:
+    """Extract subject, issuer, validity and SAN from a DER certificate.
+
+    Only the fields needed for inspection are decoded; signatures and keys
+    are skipped.
+    """
+    _, cert_start, cert_end = read_tlv(der, 0)
+    tag, tbs_start, tbs_end = read_tlv(der, cert_start)
+    if tag != TAG_SEQUENCE:
+        raise DERError("certificate does not start with a sequence")
+    fields = read_children(der, tbs_start, tbs_end)
+
+    # The version is an optional explicit [0] element
+    if fields and fields[0][0] == TAG_CONTEXT_0:
+        fields = fields[1:]
+    if len(fields) < 6:
+        raise DERError("incomplete certificate")
+    _, _, issuer, validity, subject, _ = fields[:6]
+
+    times = read_children(der, validity[1], validity[2])
+    not_before = decode_time(times[0][0], der[times[0][1]:times[0][2]])
+    not_after = decode_time(times[1][0], der[times[1][1]:times[1][2]])
+
+    san = []
+    for tag, ext_start, ext_end in fields[6:]:
+        if tag != TAG_CONTEXT_3:
+            continue
+        _, list_start, list_end = read_tlv(der, ext_start)
+        for _, item_start, item_end in read_children(der, list_start, list_end):
+            extension = read_children(der, item_start, item_end)
+            oid = decode_oid(der[extension[0][1]:extension[0][2]])
+            if oid == OID_SUBJECT_ALT_NAME:
+                # The value is the last element, after an optional critical flag
+                _, value_start, value_end = extension[-1]
+                san = decode_san(der, value_start, value_end)
+
+    return {
+        'subject': decode_name(der, subject[1], subject[2]),
+        'issuer': decode_name(der, issuer[1], issuer[2]),
+        'self_signed': der[subject[1]:subject[2]] == der[issuer[1]:issuer[2]],
+        'not_before': not_before,
+        'not_after': not_after,
+        'san': san,
+    }
+
+@dataclass
+class TLSInfo:
+    """Result of a TLS handshake inspection"""
+    version: str = ''
+    cipher: str = ''
+    bits: int = 0
+    subject: str = ''
+    issuer: str = ''
+    san: List[str] = field(default_factory=list)
+    not_before: Optional[datetime] = None
+    not_after: Optional[datetime] = None
+    self_signed: bool = False
+    issues: List[str] = field(default_factory=list)
+
+    @property
+    def is_weak(self) -> bool:
+        return bool(self.issues)
+
+def create_inspection_context() -> ssl.SSLContext:
+    """Create a client context that completes handshakes with any server.
+
+    Certificates are not verified, since the point is to report on them,
+    and old protocol versions and ciphers stay enabled so that servers
+    still offering them can be detected.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    try:
+        context.minimum_version = ssl.TLSVersion.TLSv1
+        context.set_ciphers('ALL:@SECLEVEL=0')
+    except (ValueError, ssl.SSLError):
+        # The OpenSSL build may not allow lowering the limits
+        pass
+    return context
+
+class TLSInspector:
+    """Inspects the TLS handshake of ports that speak TLS.
+
+    One SSLContext is created up front and shared by every handshake, so
+    the per-connection cost is the handshake itself.  Inspections run on the
+    scan pipeline's worker pool, bounded by `workers`.
+    """
+
+    def __init__(self, tls_ports: Optional[set] = None, timeout: float = 3.0, workers: int = 8):
+        self.tls_ports = set(tls_ports or ())
+        self.timeout = timeout
+        self.workers = workers
+        self.context = create_inspection_context()
+
+    def wants(self, finding: Dict) -> bool:
+        """Check whether a finding is on a TLS port"""
+        return finding.get('protocol') == 'TCP' and finding['port'] in self.tls_ports
+
+    def inspect(self, host: str, port: int, now: Optional[datetime] = None,
+                token: Optional[CancelToken] = None) -> Optional[TLSInfo]:
+        """Handshake with a port and describe its protocol and certificate"""
+        try:
+            with create_connection((host, port), self.timeout, token) as sock:
+                # The TLS socket takes over the connection, so it is the one watched
+                with self.context.wrap_socket(sock, server_hostname=None,
+                                              do_handshake_on_connect=False) as tls:
+                    with watch(token, tls):
+                        tls.do_handshake()
+                    version = tls.version() or ''
+                    cipher_name, _, bits = tls.cipher() or ('', '', 0)
+                    der = tls.getpeercert(binary_form=True)
+        except (OSError, ssl.SSLError) as e:
+            if debug_enabled():
+                logging.debug("TLS handshake with %s port %d failed: %s", host, port, e)
+            return None
+
+        info = TLSInfo(version=version, cipher=cipher_name, bits=bits or 0)
+        if der:
+            try:
+                certificate = parse_certificate(der)
+                info.subject = certificate['subject']
+                info.issuer = certificate['issuer']
+                info.san = certificate['san']
+                info.not_before = certificate['not_before']
+                info.not_after = certificate['not_after']
+                info.self_signed = certificate['self_signed']
+            except (DERError, ValueError, IndexError) as e:
+                if debug_enabled():
+                    logging.debug("Cannot decode certificate of %s port %d: %s", host, port, e)
+                info.issues.append('unreadable certificate')
+
+        info.issues.extend(self.find_issues(info, now or datetime.now(timezone.utc)))
+        return info
+
+    def find_issues(self, info: TLSInfo, now: datetime) -> List[str]:
+        """List the weaknesses of an inspected configuration"""
+        issues = []
+        if info.version in WEAK_VERSIONS:
+            issues.append(f"outdated protocol {info.version}")
+        if any(marker in info.cipher for marker in WEAK_CIPHER_MARKERS):
+            issues.append(f"weak cipher {info.cipher}")
+        if info.self_signed:
+            issues.append('self-signed certificate')
+        if info.not_after and info.not_after < now:
+            issues.append('expired certificate')
+        if info.not_before and info.not_before > now:
+            issues.append('certificate not yet valid')
+        return issues
+
+    def apply(self, finding: Dict, info: TLSInfo) -> Dict:
+        """Build the finding updated with the inspection; weak setups are High risk.
+
+        A sound setup carries no risk of its own, so the risk looked up for
+        the port or its identified service stays in effect.
+        """
+        updated = dict(finding, tls=info)
+        updated['risk_level'] = 'High' if info.is_weak else None
+        return updated
@@ -0,0 +1,243 @@
+"""
+Streaming parser for UPnP device description documents
+"""
+
+import urllib.parse
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+# Limits that keep oversized or malicious descriptions from using
+# unbounded memory or CPU
+MAX_DESCRIPTION_BYTES = 1024 * 1024
+MAX_DEPTH = 32
+MAX_ELEMENTS = 20000
+MAX_DEVICES = 64
+MAX_SERVICES = 256
+MAX_TEXT_LENGTH = 4096
+
+# Device fields read from the description, by element name
+DEVICE_FIELDS = {
+    'deviceType': 'device_type',
+    'friendlyName': 'friendly_name',
+    'manufacturer': 'manufacturer',
+    'manufacturerURL': 'manufacturer_url',
+    'modelName': 'model_name',
+    'modelNumber': 'model_number',
+    'modelDescription': 'model_description',
+    'serialNumber': 'serial_number',
+    'UDN': 'udn',
+    'presentationURL': 'presentation_url',
+}
+
+# Service fields read from the description, by element name
+SERVICE_FIELDS = {
+    'serviceType': 'service_type',
+    'serviceId': 'service_id',
+    'controlURL': 'control_url',
+    'eventSubURL': 'event_sub_url',
+    'SCPDURL': 'scpd_url',
+}
+
+class DescriptionError(ValueError):
+    """Raised when a device description is malformed or exceeds the limits"""
+
+@dataclass
+class ServiceRecord:
+    """A service listed in a device description"""
+    service_type: str = ''
+    service_id: str = ''
+    control_url: str = ''
+    event_sub_url: str = ''
+    scpd_url: str = ''
+
+@dataclass
+class DeviceRecord:
+    """A device and its embedded devices from a device description"""
+    device_type: str = ''
+    friendly_name: str = ''
+    manufacturer: str = ''
+    manufacturer_url: str = ''
+    model_name: str = ''
+    model_number: str = ''
+    model_description: str = ''
+    serial_number: str = ''
+    udn: str = ''
+    presentation_url: str = ''
+    services: List[ServiceRecord] = field(default_factory=list)
+    devices: List['DeviceRecord'] = field(default_factory=list)
+
+    def iter_devices(self) -> Iterator['DeviceRecord']:
+        """Iterate over this device and all embedded devices"""
+        yield self
+        for device in self.devices:
+            yield from device.iter_devices()
+
+    def iter_services(self) -> Iterator[ServiceRecord]:
+        """Iterate over the services of this device and all embedded devices"""
+        for device in self.iter_devices():
+            yield from device.services
+
+@dataclass
+class DeviceDescription:
+    """Parsed device description document"""
+    location: str
+    url_base: str = ''
+    root_device: Optional[DeviceRecord] = None
+
+    def iter_services(self) -> Iterator[ServiceRecord]:
+        """Iterate over all services in the device tree"""
+        if self.root_device:
+            yield from self.root_device.iter_services()
+
+    def to_device_info(self) -> Dict:
+        """Build the device info dict used by the scanners and the GUI"""
+        device = self.root_device or DeviceRecord()
+        return {
+            'location': self.location,
+            'friendly_name': device.friendly_name,
+            'device_type': device.device_type,
+            'manufacturer': device.manufacturer,
+            'model_name': device.model_name,
+            'services': [service.service_type for service in self.iter_services()],
+            'description': self
+        }
+
+class DescriptionParser:
+    """Incremental device description parser with size and structure limits.
+
+    Feed the document in chunks as it is downloaded; the parser walks the
+    full deviceList/serviceList tree and discards each element once it has
+    been read, so memory stays bounded by the limits rather than the input.
+    Documents with a DOCTYPE are rejected, which rules out entity expansion
+    attacks.
+    """
+
+    def __init__(self, location: str, max_bytes: int = MAX_DESCRIPTION_BYTES,
+                 max_depth: int = MAX_DEPTH, max_elements: int = MAX_ELEMENTS,
+                 max_devices: int = MAX_DEVICES, max_services: int = MAX_SERVICES):
+        self.location = location
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_devices = max_devices
+        self.max_services = max_services
+
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._bytes = 0
+        self._tail = b''
+        self._depth = 0
+        self._elements = 0
+        self._device_count = 0
+        self._service_count = 0
+        self._device_stack: List[DeviceRecord] = []
+        self._device_depths: List[int] = []
+        self._service: Optional[ServiceRecord] = None
+        self._description = DeviceDescription(location)
+
+    def feed(self, chunk: bytes):
+        """Parse the next chunk of the document"""
+        self._bytes += len(chunk)
+        if self._bytes > self.max_bytes:
+            raise DescriptionError(f"description larger than {self.max_bytes} bytes")
+
+        # Check across chunk boundaries as well
+        window = self._tail + chunk
+        if b'<!DOCTYPE' in window or b'<!ENTITY' in window:
+            raise DescriptionError("description contains a DOCTYPE")
+        self._tail = chunk[-8:]
+
+        try:
+            self._parser.feed(chunk)
+        except ET.ParseError as e:
+            raise DescriptionError(f"malformed description: {e}") from e
+        self._process_events()
+
+    def close(self) -> DeviceDescription:
+        """Finish parsing and return the description with absolute URLs"""
+        try:
+            self._parser.close()
+        except ET.ParseError as e:
+            raise DescriptionError(f"malformed description: {e}") from e
+        self._process_events()
+
+        description = self._description
+        if description.root_device is None:
+            raise DescriptionError("description has no device element")
+
+        base = description.url_base or self.location
+        for device in description.root_device.iter_devices():
+            if device.presentation_url:
+                device.presentation_url = urllib.parse.urljoin(base, device.presentation_url)
+            for service in device.services:
+                for name in ('control_url', 'event_sub_url', 'scpd_url'):
+                    value = getattr(service, name)
+                    if value:
+                        setattr(service, name, urllib.parse.urljoin(base, value))
+        return description
+
+    def _process_events(self):
+        """Apply the events produced by the pull parser so far"""
+        for event, element in self._parser.read_events():
+            tag = element.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                self._start(tag)
+            else:
+                self._end(tag, element)
+
+    def _start(self, tag: str):
+        self._depth += 1
+        self._elements += 1
+        if self._depth > self.max_depth:
+            raise DescriptionError(f"description nested deeper than {self.max_depth} levels")
+        if self._elements > self.max_elements:
+            raise DescriptionError(f"description has more than {self.max_elements} elements")
+
+        if tag == 'device':
+            self._device_count += 1
+            if self._device_count > self.max_devices:
+                raise DescriptionError(f"description has more than {self.max_devices} devices")
+            device = DeviceRecord()
+            if self._device_stack:
+                self._device_stack[-1].devices.append(device)
+            elif self._description.root_device is None:
+                self._description.root_device = device
+            self._device_stack.append(device)
+            self._device_depths.append(self._depth)
+        elif tag == 'service' and self._device_stack:
+            self._service_count += 1
+            if self._service_count > self.max_services:
+                raise DescriptionError(f"description has more than {self.max_services} services")
+            self._service = ServiceRecord()
+            self._device_stack[-1].services.append(self._service)
+
+    def _end(self, tag: str, element: ET.Element):
+        self._depth -= 1
+        text = (element.text or '').strip()[:MAX_TEXT_LENGTH]
+
+        if tag == 'device' and self._device_stack:
+            self._device_stack.pop()
+            self._device_depths.pop()
+        elif tag == 'service':
+            self._service = None
+        elif self._service is not None and tag in SERVICE_FIELDS:
+            setattr(self._service, SERVICE_FIELDS[tag], text)
+        elif self._device_stack and tag in DEVICE_FIELDS and self._depth == self._device_depth():
+            setattr(self._device_stack[-1], DEVICE_FIELDS[tag], text)
+        elif tag == 'URLBase' and not self._device_stack:
+            self._description.url_base = text
+
+        # The values have been copied out; drop the subtree
+        element.clear()
+
+    def _device_depth(self) -> int:
+        """Depth at which the fields of the current device are found"""
+        return self._device_depths[-1] if self._device_depths else -1
+
+def parse_description(location: str, content: bytes, chunk_size: int = 65536,
+                      **limits) -> DeviceDescription:
+    """Parse a complete description document"""
+    parser = DescriptionParser(location, **limits)
+    for start in range(0, len(content), chunk_size):
+        parser.feed(content[start:start + chunk_size])
+    return parser.close()
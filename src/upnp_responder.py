@@ -0,0 +1,392 @@
+"""
+Local stand-in for UPnP devices, used by benchmarks and offline testing
+"""
+
+import heapq
+import logging
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+IGD_DEVICE_TYPE = 'urn:schemas-upnp-org:device:InternetGatewayDevice:1'
+WAN_DEVICE_TYPE = 'urn:schemas-upnp-org:device:WANDevice:1'
+WAN_CONNECTION_DEVICE_TYPE = 'urn:schemas-upnp-org:device:WANConnectionDevice:1'
+WAN_IP_SERVICE_TYPE = 'urn:schemas-upnp-org:service:WANIPConnection:1'
+
+# Request paths served for every simulated device
+DESCRIPTION_PATH = re.compile(r'^/device/(\d+)/desc\.xml$')
+CONTROL_PATH = re.compile(r'^/device/(\d+)/ctl/IPConn$')
+
+class SimulatedDevice:
+    """One simulated Internet Gateway Device and its port mappings"""
+
+    def __init__(self, index: int, base_url: str, mapping_count: int):
+        self.index = index
+        self.udn = f"uuid:4d696e69-5550-6e50-0000-{index:012d}"
+        self.location = f"{base_url}/device/{index}/desc.xml"
+        self.etag = f'"desc-{index}"'
+        self.mappings = [{
+            'external_port': 20000 + i,
+            'protocol': 'TCP' if i % 2 == 0 else 'UDP',
+            'internal_port': 1024 + i,
+            'internal_client': f"192.168.{index % 250}.{i % 250 + 2}",
+            'description': f"Simulated mapping {i}",
+        } for i in range(mapping_count)]
+        self.description = self._build_description()
+
+    def search_responses(self, search_target: str) -> List[Tuple[str, str]]:
+        """Get the (ST, USN) pairs this device answers a search with"""
+        root = ('upnp:rootdevice', f"{self.udn}::upnp:rootdevice")
+        igd = (IGD_DEVICE_TYPE, f"{self.udn}::{IGD_DEVICE_TYPE}")
+        if search_target == 'ssdp:all':
+            return [root, igd]
+        if search_target == 'upnp:rootdevice':
+            return [root]
+        if search_target in (IGD_DEVICE_TYPE, self.udn):
+            return [igd]
+        return []
+
+    def _build_description(self) -> bytes:
+        return (
+            '<?xml version="1.0"?>'
+            '<root xmlns="urn:schemas-upnp-org:device-1-0">'
+            '<specVersion><major>1</major><minor>0</minor></specVersion>'
+            '<device>'
+            f'<deviceType>{IGD_DEVICE_TYPE}</deviceType>'
+            f'<friendlyName>Simulated Router {self.index}</friendlyName>'
+            '<manufacturer>Port Scope</manufacturer>'
+            '<modelName>Stand-in IGD</modelName>'
+            f'<UDN>{self.udn}</UDN>'
+            '<deviceList><device>'
+            f'<deviceType>{WAN_DEVICE_TYPE}</deviceType>'
+            '<friendlyName>WANDevice</friendlyName>'
+            f'<UDN>{self.udn}-wan</UDN>'
+            '<deviceList><device>'
+            f'<deviceType>{WAN_CONNECTION_DEVICE_TYPE}</deviceType>'
+            '<friendlyName>WANConnectionDevice</friendlyName>'
+            f'<UDN>{self.udn}-conn</UDN>'
+            '<serviceList><service>'
+            f'<serviceType>{WAN_IP_SERVICE_TYPE}</serviceType>'
+            '<serviceId>urn:upnp-org:serviceId:WANIPConn1</serviceId>'
+            f'<controlURL>/device/{self.index}/ctl/IPConn</controlURL>'
+            f'<eventSubURL>/device/{self.index}/evt/IPConn</eventSubURL>'
+            f'<SCPDURL>/device/{self.index}/WANIPConnection.xml</SCPDURL>'
+            '</service></serviceList>'
+            '</device></deviceList>'
+            '</device></deviceList>'
+            '</device>'
+            '</root>'
+        ).encode()
+
+def build_search_response(device: SimulatedDevice, search_target: str, usn: str,
+                          max_age: int) -> bytes:
+    """Build the unicast answer to an M-SEARCH"""
+    return (
+        'HTTP/1.1 200 OK\r\n'
+        f'CACHE-CONTROL: max-age={max_age}\r\n'
+        'EXT:\r\n'
+        f'LOCATION: {device.location}\r\n'
+        'SERVER: Linux/5.0 UPnP/1.0 PortScopeResponder/1.0\r\n'
+        f'ST: {search_target}\r\n'
+        f'USN: {usn}\r\n\r\n'
+    ).encode()
+
+def build_mapping_response(mapping: Dict) -> bytes:
+    """Build a GetGenericPortMappingEntry response"""
+    return (
+        '<?xml version="1.0"?>'
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+        's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+        f'<u:GetGenericPortMappingEntryResponse xmlns:u="{WAN_IP_SERVICE_TYPE}">'
+        '<NewRemoteHost></NewRemoteHost>'
+        f"<NewExternalPort>{mapping['external_port']}</NewExternalPort>"
+        f"<NewProtocol>{mapping['protocol']}</NewProtocol>"
+        f"<NewInternalPort>{mapping['internal_port']}</NewInternalPort>"
+        f"<NewInternalClient>{mapping['internal_client']}</NewInternalClient>"
+        '<NewEnabled>1</NewEnabled>'
+        f"<NewPortMappingDescription>{mapping['description']}</NewPortMappingDescription>"
+        '<NewLeaseDuration>0</NewLeaseDuration>'
+        '</u:GetGenericPortMappingEntryResponse>'
+        '</s:Body></s:Envelope>'
+    ).encode()
+
+def build_upnp_fault(error_code: int, description: str) -> bytes:
+    """Build a SOAP fault carrying a UPnP error"""
+    return (
+        '<?xml version="1.0"?>'
+        '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+        's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+        '<s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring>'
+        '<detail><UPnPError xmlns="urn:schemas-upnp-org:control-1-0">'
+        f'<errorCode>{error_code}</errorCode>'
+        f'<errorDescription>{description}</errorDescription>'
+        '</UPnPError></detail></s:Fault>'
+        '</s:Body></s:Envelope>'
+    ).encode()
+
+class _DeviceRequestHandler(BaseHTTPRequestHandler):
+    """Serves the descriptions and SOAP control endpoints of the devices"""
+
+    # Keep connections alive so pooled clients are measured realistically
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; avoid Nagle/delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        responder = self.server.responder
+        match = DESCRIPTION_PATH.match(self.path)
+        device = responder.get_device(int(match.group(1))) if match else None
+        if device is None:
+            self._send(404, b'')
+            return
+
+        if responder.simulate_delay_and_failure():
+            self._send(500, b'')
+            return
+        if self.headers.get('If-None-Match') == device.etag:
+            self._send(304, b'', {'ETag': device.etag})
+            return
+        self._send(200, device.description, {'ETag': device.etag, 'Content-Type': 'text/xml'})
+
+    def do_POST(self):
+        responder = self.server.responder
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8', errors='ignore')
+
+        match = CONTROL_PATH.match(self.path)
+        device = responder.get_device(int(match.group(1))) if match else None
+        if device is None:
+            self._send(404, b'')
+            return
+
+        if responder.simulate_delay_and_failure():
+            self._send(500, build_upnp_fault(501, 'ActionFailed'))
+            return
+        if 'GetGenericPortMappingEntry' not in self.headers.get('SOAPAction', ''):
+            self._send(500, build_upnp_fault(401, 'Invalid Action'))
+            return
+
+        index_match = re.search(r'<NewPortMappingIndex>(\d+)</NewPortMappingIndex>', body)
+        index = int(index_match.group(1)) if index_match else -1
+        if 0 <= index < len(device.mappings):
+            self._send(200, build_mapping_response(device.mappings[index]))
+        else:
+            self._send(500, build_upnp_fault(713, 'SpecifiedArrayIndexInvalid'))
+
+    def _send(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        """Send a response, truncating the body when simulating broken devices"""
+        truncate = body and self.server.responder.should_truncate()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body and 'Content-Type' not in (headers or {}):
+            self.send_header('Content-Type', 'text/xml; charset="utf-8"')
+        self.send_header('Content-Length', str(len(body)))
+        if truncate:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2] if truncate else body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"UPnP responder: {format % args}")
+
+class _DeviceHTTPServer(ThreadingHTTPServer):
+    """HTTP server for the simulated devices, on IPv4 or IPv6"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], family: int, responder: 'UPnPResponder'):
+        self.address_family = family
+        self.responder = responder
+        super().__init__(address, _DeviceRequestHandler)
+
+class UPnPResponder:
+    """Stand-in for a network of UPnP Internet Gateway Devices.
+
+    Answers M-SEARCH requests on a UDP socket and serves the device
+    descriptions and the WANIPConnection control endpoint of every simulated
+    device from one local HTTP server, so the discovery, description and
+    port mapping paths can be exercised without a router.
+
+    Behaviour is configurable:
+      - device_count / mapping_count: size of the simulated network
+      - response_spread: devices answer a search after a random delay of up
+        to this many seconds (capped by the MX of the search)
+      - http_latency: delay added to every HTTP request
+      - drop_rate: fraction of search responses silently lost
+      - failure_rate: fraction of HTTP requests answered with an error
+      - truncate_rate: fraction of HTTP bodies cut short
+
+    The SSDP socket binds to an ephemeral port by default; point the
+    discovery engine at `ssdp_address` with its `target`/`targets` options.
+    An IPv6 host such as ::1 serves everything over IPv6.
+    """
+
+    def __init__(self, device_count: int = 1, mapping_count: int = 0,
+                 host: str = '127.0.0.1', ssdp_port: int = 0, http_port: int = 0,
+                 response_spread: float = 0.0, http_latency: float = 0.0,
+                 drop_rate: float = 0.0, failure_rate: float = 0.0,
+                 truncate_rate: float = 0.0, max_age: int = 1800,
+                 seed: Optional[int] = None):
+        self.device_count = device_count
+        self.mapping_count = mapping_count
+        self.host = host
+        self.ssdp_port = ssdp_port
+        self.http_port = http_port
+        self.response_spread = response_spread
+        self.http_latency = http_latency
+        self.drop_rate = drop_rate
+        self.failure_rate = failure_rate
+        self.truncate_rate = truncate_rate
+        self.max_age = max_age
+
+        self.devices: List[SimulatedDevice] = []
+        self.search_count = 0
+        self.is_running = False
+        self.ssdp_thread = None
+        self.http_thread = None
+        self.sock = None
+        self.http_server = None
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    @property
+    def ssdp_address(self) -> Tuple[str, int]:
+        """Address to send M-SEARCH requests to"""
+        return self.sock.getsockname()[:2]
+
+    @property
+    def locations(self) -> List[str]:
+        """LOCATION URLs of all simulated devices"""
+        return [device.location for device in self.devices]
+
+    def start(self):
+        """Bind the sockets and start answering"""
+        if self.is_running:
+            return
+
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.http_server = _DeviceHTTPServer((self.host, self.http_port), family, self)
+        http_host, http_port = self.http_server.server_address[:2]
+        if family == socket.AF_INET6:
+            http_host = f"[{http_host}]"
+        base_url = f"http://{http_host}:{http_port}"
+        self.devices = [SimulatedDevice(index, base_url, self.mapping_count)
+                        for index in range(self.device_count)]
+
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.bind((self.host, self.ssdp_port))
+        # Room for a burst of retransmitted searches while answers are sent
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+
+        self.is_running = True
+        self.http_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.http_thread.start()
+        self.ssdp_thread = threading.Thread(target=self._serve_ssdp, daemon=True)
+        self.ssdp_thread.start()
+        logging.info(f"UPnP responder simulating {self.device_count} devices, "
+                     f"SSDP on {self.ssdp_address}, HTTP on {base_url}")
+
+    def stop(self):
+        """Stop answering and release the sockets"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        if self.ssdp_thread:
+            self.ssdp_thread.join(timeout=2)
+        self.sock.close()
+
+    def __enter__(self) -> 'UPnPResponder':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_device(self, index: int) -> Optional[SimulatedDevice]:
+        """Get a simulated device by index"""
+        return self.devices[index] if 0 <= index < len(self.devices) else None
+
+    def simulate_delay_and_failure(self) -> bool:
+        """Apply the HTTP latency; returns True if the request should fail"""
+        if self.http_latency:
+            time.sleep(self.http_latency)
+        return self._chance(self.failure_rate)
+
+    def should_truncate(self) -> bool:
+        """Decide whether the next HTTP body is cut short"""
+        return self._chance(self.truncate_rate)
+
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def _serve_ssdp(self):
+        """Receive searches and send the delayed answers from one thread"""
+        # Pending answers as (send_at, sequence, data, address)
+        pending = []
+        sequence = 0
+        sock = self.sock
+
+        while self.is_running:
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                _, _, data, address = heapq.heappop(pending)
+                try:
+                    sock.sendto(data, address)
+                except OSError as e:
+                    logging.debug(f"UPnP responder send failed: {e}")
+
+            sock.settimeout(max(0.001, min(0.2, pending[0][0] - now)) if pending else 0.2)
+            try:
+                data, address = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            if not data.startswith(b'M-SEARCH'):
+                # Responses and NOTIFY messages are not for us
+                continue
+            request = self._parse_search(data)
+            if request is None:
+                continue
+            search_target, mx = request
+            self.search_count += 1
+
+            spread = min(self.response_spread, float(mx))
+            for device in self.devices:
+                for st, usn in device.search_responses(search_target):
+                    if self._chance(self.drop_rate):
+                        continue
+                    with self._random_lock:
+                        delay = self._random.uniform(0, spread) if spread else 0.0
+                    sequence += 1
+                    heapq.heappush(pending, (now + delay, sequence,
+                                             build_search_response(device, st, usn, self.max_age),
+                                             address))
+
+    @staticmethod
+    def _parse_search(data: bytes) -> Optional[Tuple[str, int]]:
+        """Get the search target and MX of an M-SEARCH request"""
+        headers = {}
+        for line in data.decode('utf-8', errors='ignore').split('\r\n')[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().upper()] = value.strip()
+        if headers.get('MAN', '').strip('"') != 'ssdp:discover' or 'ST' not in headers:
+            return None
+        try:
+            mx = max(1, int(headers.get('MX', '1')))
+        except ValueError:
+            mx = 1
+        return headers['ST'], mx
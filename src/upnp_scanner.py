@@ -2,119 +2,335 @@
 UPnP port discovery functionality
 """
 
-import socket
 import threading
 import logging
 import time
 from typing import List, Dict, Callable, Optional
-import xml.etree.ElementTree as ET
 import requests
-import re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ssdp
+from cache import DEFAULT_SIZES, DESCRIPTIONS, DISCOVERY, ScanCache, TTLCache
+from cancellation import CancelToken, CancellableHTTPAdapter, bind_http, is_cancelled
+from log_setup import debug_enabled
+from ssdp_listener import DeviceCache
+from igd import PortMappingEnumerator, find_wan_services
+from upnp_description import (DescriptionError, DescriptionParser, parse_description,
+                              MAX_DESCRIPTION_BYTES)
+
+# Threads reading port mapping tables, per description fetch worker
+MAPPING_WORKERS_PER_FETCH_WORKER = 4
+
+class DescriptionCache:
+    """Cache of device descriptions keyed by LOCATION URL.
+
+    Entries are served without any request while younger than the TTL.
+    Older entries keep their ETag/Last-Modified validators so the next fetch
+    can be a conditional request that the device answers with 304.  The
+    entries live in a TTLCache, by default the description source of a
+    shared ScanCache.
+    """
+    
+    def __init__(self, ttl: float = 300.0, cache: Optional[TTLCache] = None):
+        self.cache = cache if cache is not None else TTLCache(ttl, DEFAULT_SIZES[DESCRIPTIONS])
+    
+    def get_fresh(self, location: str) -> Optional[Dict]:
+        """Get the cached device info if it is still within the TTL"""
+        entry = self.cache.get(location)
+        return entry['device_info'] if entry else None
+    
+    def get_validators(self, location: str) -> Dict[str, str]:
+        """Get conditional request headers for a cached description"""
+        headers = {}
+        entry = self.cache.get_stale(location)
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def revalidated(self, location: str) -> Optional[Dict]:
+        """Mark a cached description as confirmed unchanged and return it"""
+        entry = self.cache.touch(location)
+        return entry['device_info'] if entry else None
+    
+    def store(self, location: str, device_info: Dict, etag: Optional[str],
+              last_modified: Optional[str]):
+        """Store a freshly downloaded description"""
+        self.cache.put(location, {
+            'device_info': device_info,
+            'etag': etag,
+            'last_modified': last_modified
+        })
+    
+    def clear(self):
+        """Drop all cached descriptions"""
+        self.cache.clear()
 
 class UPnPScanner:
     """UPnP port scanner for discovering exposed ports on local network"""
     
-    def __init__(self):
+    def __init__(self, fetch_workers: int = 8, description_ttl: float = 300.0,
+                 device_cache: Optional[DeviceCache] = None,
+                 full_discovery_interval: float = 1800.0,
+                 discovery_options: Optional[Dict] = None,
+                 scan_cache: Optional[ScanCache] = None):
         self.is_scanning = False
         self.scan_thread = None
+        self.cancel_token = None
+        self.fetch_workers = fetch_workers
+        
+        # Descriptions and discovery results, shared with other scanners
+        # through scan_cache; without one, discovery is not cached
+        self.description_cache = DescriptionCache(
+            ttl=description_ttl,
+            cache=scan_cache.source(DESCRIPTIONS) if scan_cache else None)
+        self.discovery_cache = scan_cache.source(DISCOVERY) if scan_cache else None
+        
+        # Devices known from SSDP announcements and earlier searches; a full
+        # search is only repeated after full_discovery_interval seconds
+        self.device_cache = device_cache
+        self.full_discovery_interval = full_discovery_interval
+        
+        # Extra SSDPDiscovery options for the full search, e.g. interfaces
+        # and target to search a local stand-in responder
+        self.discovery_options = discovery_options or {}
+        
+        # Mapping tables of all devices are read on one bounded pool, wide
+        # enough for the windows of several devices to overlap
+        mapping_workers = fetch_workers * MAPPING_WORKERS_PER_FETCH_WORKER
         
-    def discover_upnp_devices(self, timeout: int = 5) -> List[str]:
-        """Discover UPnP devices on the local network"""
+        # One pooled session so descriptions are fetched over kept-alive
+        # connections, with enough connections per device for the workers;
+        # requests made under bind_http() are aborted by its cancel token
+        self.session = requests.Session()
+        adapter = CancellableHTTPAdapter(pool_connections=fetch_workers, pool_maxsize=mapping_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.mapping_enumerator = PortMappingEnumerator(self.session, window=fetch_workers,
+                                                        workers=mapping_workers)
+        
+    def discover_upnp_devices(self, timeout: int = 5,
+                              location_callback: Optional[Callable] = None,
+                              force_refresh: bool = False,
+                              token: Optional[CancelToken] = None) -> List[str]:
+        """Discover UPnP devices on the local network
+
+        Searches on every local interface and returns as soon as responses
+        stop arriving, with timeout as the upper bound.  location_callback is
+        called with each new device LOCATION as soon as its response arrives,
+        so descriptions can be fetched while discovery is still listening.
+        
+        With a device cache, cached devices are answered instantly and only
+        devices whose entries expired are searched for again, by unicast.
+        With a discovery cache, the locations found by a discovery are
+        reused without any search until they expire.  force_refresh skips
+        both caches and runs a full search.  Cancelling the token ends the
+        search at once; the devices found so far are returned, not cached.
+        """
         devices = []
+        cache = self.device_cache
+        discovery_key = (timeout, repr(sorted(self.discovery_options.items())))
+        
+        if self.discovery_cache is not None and not force_refresh:
+            cached = self.discovery_cache.get(discovery_key)
+            if cached is not None:
+                for location in cached:
+                    devices.append(location)
+                    if location_callback:
+                        location_callback(location)
+                return devices
         
-        # SSDP discovery message
-        ssdp_msg = (
-            'M-SEARCH * HTTP/1.1\r\n'
-            'HOST: 239.255.255.250:1900\r\n'
-            'MAN: "ssdp:discover"\r\n'
-            'ST: upnp:rootdevice\r\n'
-            'MX: 3\r\n\r\n'
-        )
+        def report(location: Optional[str]):
+            if location and location not in devices:
+                devices.append(location)
+                if location_callback:
+                    location_callback(location)
+        
+        def on_response(response: Dict):
+            if cache is not None:
+                cache.update(response)
+            report(response.get('LOCATION'))
         
         try:
-            # Create UDP socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(timeout)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # Send SSDP discovery
-            sock.sendto(ssdp_msg.encode(), ('239.255.255.250', 1900))
-            
-            # Collect responses
-            end_time = time.time() + timeout
-            while time.time() < end_time:
-                try:
-                    data, addr = sock.recvfrom(1024)
-                    response = data.decode('utf-8', errors='ignore')
-                    
-                    # Extract LOCATION header
-                    location_match = re.search(r'LOCATION:\s*(.+)', response, re.IGNORECASE)
-                    if location_match:
-                        location = location_match.group(1).strip()
-                        if location not in devices:
-                            devices.append(location)
-                            
-                except socket.timeout:
-                    break
-                except Exception as e:
-                    logging.debug(f"UPnP discovery error: {e}")
-                    continue
-            
-            sock.close()
-            
+            if (cache is not None and not force_refresh
+                    and time.time() - cache.last_full_discovery < self.full_discovery_interval):
+                fresh, expired = cache.split()
+                for entry in fresh:
+                    report(entry['location'])
+                
+                expired_hosts = {entry['address'] for entry in expired if entry['address']}
+                if expired_hosts:
+                    ssdp.discover(timeout=timeout, response_callback=on_response, token=token,
+                                  search_targets=['upnp:rootdevice'],
+                                  targets=[(host, ssdp.SSDP_PORT) for host in sorted(expired_hosts)])
+                    if not is_cancelled(token):
+                        cache.purge_expired()
+            else:
+                ssdp.discover(timeout=timeout, response_callback=on_response, token=token,
+                              **self.discovery_options)
+                if cache is not None and not is_cancelled(token):
+                    cache.mark_full_discovery()
+            if self.discovery_cache is not None and not is_cancelled(token):
+                self.discovery_cache.put(discovery_key, list(devices))
         except Exception as e:
             logging.error(f"UPnP discovery failed: {e}")
         
         return devices
     
-    def get_device_info(self, location: str) -> Dict:
-        """Get device information from UPnP location"""
+    def get_device_info(self, location: str, force_refresh: bool = False,
+                        token: Optional[CancelToken] = None) -> Dict:
+        """Get device information from UPnP location
+        
+        Descriptions are served from the cache while fresh and revalidated
+        with a conditional request once they expire.  Cancelling the token
+        aborts the fetch.
+        """
+        if not force_refresh:
+            cached = self.description_cache.get_fresh(location)
+            if cached is not None:
+                return cached
+        
         try:
-            response = requests.get(location, timeout=5)
-            if response.status_code == 200:
-                root = ET.fromstring(response.content)
+            with bind_http(token):
+                headers = self.description_cache.get_validators(location)
+                response = self.session.get(location, headers=headers, timeout=5, stream=True)
                 
-                # Extract device info
-                device_info = {
-                    'location': location,
-                    'friendly_name': '',
-                    'device_type': '',
-                    'manufacturer': '',
-                    'model_name': '',
-                    'services': []
-                }
+                if response.status_code == 304:
+                    response.close()
+                    cached = self.description_cache.revalidated(location)
+                    if cached is not None:
+                        return cached
+                    # Cache entry vanished meanwhile; fetch unconditionally
+                    response = self.session.get(location, timeout=5, stream=True)
                 
-                # Find device element
-                ns = {'upnp': 'urn:schemas-upnp-org:device-1-0'}
-                device = root.find('.//upnp:device', ns)
-                
-                if device is not None:
-                    friendly_name = device.find('upnp:friendlyName', ns)
-                    if friendly_name is not None:
-                        device_info['friendly_name'] = friendly_name.text or ''
-                    
-                    device_type = device.find('upnp:deviceType', ns)
-                    if device_type is not None:
-                        device_info['device_type'] = device_type.text or ''
-                    
-                    manufacturer = device.find('upnp:manufacturer', ns)
-                    if manufacturer is not None:
-                        device_info['manufacturer'] = manufacturer.text or ''
-                    
-                    model_name = device.find('upnp:modelName', ns)
-                    if model_name is not None:
-                        device_info['model_name'] = model_name.text or ''
-                
-                return device_info
+                with response:
+                    if response.status_code == 200:
+                        device_info = self.read_device_description(location, response)
+                        self.description_cache.store(location, device_info,
+                                                     response.headers.get('ETag'),
+                                                     response.headers.get('Last-Modified'))
+                        return device_info
                 
         except Exception as e:
-            logging.debug(f"Error getting device info from {location}: {e}")
+            if debug_enabled():
+                logging.debug("Error getting device info from %s: %s", location, e)
         
         return {}
     
+    def get_devices_info(self, locations: List[str],
+                         info_callback: Optional[Callable] = None,
+                         token: Optional[CancelToken] = None) -> Dict[str, Dict]:
+        """Get device information for several locations concurrently
+        
+        info_callback is called with (location, device_info) as each fetch
+        completes.
+        """
+        devices_info = {}
+        if not locations:
+            return devices_info
+        
+        with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(locations)),
+                                thread_name_prefix='upnp-fetch') as pool:
+            futures = {pool.submit(self.get_device_info, location, token=token): location
+                       for location in locations}
+            for future in as_completed(futures):
+                location = futures[future]
+                devices_info[location] = future.result()
+                if info_callback:
+                    info_callback(location, devices_info[location])
+        
+        return devices_info
+    
+    def read_device_description(self, location: str, response: requests.Response) -> Dict:
+        """Parse a device description while it is being downloaded
+        
+        The body is fed to the parser in chunks and the download is aborted
+        as soon as a size or structure limit is exceeded.
+        """
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > MAX_DESCRIPTION_BYTES:
+            raise DescriptionError(f"description of {content_length} bytes is too large")
+        
+        parser = DescriptionParser(location)
+        for chunk in response.iter_content(chunk_size=16384):
+            parser.feed(chunk)
+        return parser.close().to_device_info()
+    
+    def parse_device_description(self, location: str, content: bytes) -> Dict:
+        """Parse a complete device description document"""
+        return parse_description(location, content).to_device_info()
+    
+    def make_finding(self, location: str, device_info: Dict) -> Optional[Dict]:
+        """Build a result entry for a device from its LOCATION URL"""
+        try:
+            # Parse URL to get port
+            parsed = urllib.parse.urlparse(location)
+            port = parsed.port or (80 if parsed.scheme == 'http' else 443)
+            
+            return {
+                'host': parsed.hostname or '',
+                'port': port,
+                'protocol': 'TCP',
+                'service': f"UPnP - {device_info.get('friendly_name', 'Unknown Device')}",
+                'risk_level': 'Medium',
+                'state': 'UPnP EXPOSED',
+                'device_info': device_info
+            }
+        except Exception as e:
+            if debug_enabled():
+                logging.debug("Error parsing UPnP device URL: %s", e)
+            return None
+    
+    def get_mapping_findings(self, location: str, device_info: Dict,
+                             token: Optional[CancelToken] = None) -> List[Dict]:
+        """List the port forwards an Internet Gateway Device has opened"""
+        return self.get_devices_mapping_findings({location: device_info}, token)
+    
+    def get_devices_mapping_findings(self, devices_info: Dict[str, Dict],
+                                     token: Optional[CancelToken] = None) -> List[Dict]:
+        """List the port forwards of several Internet Gateway Devices
+        
+        The mapping tables of all the devices are read at the same time.
+        """
+        gateways = [(location, device_info) for location, device_info in devices_info.items()
+                    if device_info and device_info.get('description') is not None
+                    and find_wan_services(device_info['description'])]
+        if not gateways:
+            return []
+        
+        mappings = self.mapping_enumerator.enumerate_devices(
+            [device_info['description'] for _, device_info in gateways], token)
+        findings = []
+        for (location, device_info), device_mappings in zip(gateways, mappings):
+            router_host = urllib.parse.urlparse(location).hostname or ''
+            for mapping in device_mappings:
+                target = f"{mapping.get('internal_client', '?')}:{mapping.get('internal_port', '?')}"
+                label = mapping.get('description') or device_info.get('friendly_name', '')
+                findings.append({
+                    'host': router_host,
+                    'port': mapping['external_port'],
+                    'protocol': mapping['protocol'],
+                    'service': f"UPnP forward -> {target} ({label})",
+                    'risk_level': 'High',
+                    'state': 'UPnP MAPPED',
+                    'mapping': mapping,
+                    'device_info': device_info
+                })
+        return findings
+    
     def scan_upnp_ports(self, progress_callback: Optional[Callable] = None,
-                       result_callback: Optional[Callable] = None) -> None:
-        """Scan for UPnP exposed ports"""
+                       result_callback: Optional[Callable] = None,
+                       found_callback: Optional[Callable] = None) -> None:
+        """Scan for UPnP exposed ports
+
+        found_callback is called with each exposed port as soon as it is
+        found; result_callback receives the complete list when the scan ends.
+        """
+        
+        token = self.cancel_token = CancelToken()
         
         def scan_worker():
             upnp_ports = []
@@ -124,39 +340,38 @@ class UPnPScanner:
                     progress_callback(10)
                 
                 # Discover UPnP devices
-                devices = self.discover_upnp_devices()
+                devices = self.discover_upnp_devices(token=token)
                 
                 if progress_callback:
                     progress_callback(40)
                 
-                # Get device information
-                for i, device_location in enumerate(devices):
-                    if not self.is_scanning:
-                        break
-                    
-                    device_info = self.get_device_info(device_location)
-                    if device_info:
-                        # Parse URL to get port
-                        try:
-                            import urllib.parse
-                            parsed = urllib.parse.urlparse(device_location)
-                            port = parsed.port or (80 if parsed.scheme == 'http' else 443)
-                            
-                            upnp_ports.append({
-                                'port': port,
-                                'protocol': 'TCP',
-                                'service': f"UPnP - {device_info.get('friendly_name', 'Unknown Device')}",
-                                'risk_level': 'Medium',
-                                'state': 'UPnP EXPOSED',
-                                'device_info': device_info
-                            })
-                        except Exception as e:
-                            logging.debug(f"Error parsing UPnP device URL: {e}")
+                # Get device information concurrently
+                completed = [0]
+                
+                def report(finding: Dict):
+                    upnp_ports.append(finding)
+                    if found_callback:
+                        found_callback(finding)
+                
+                def on_device_info(device_location: str, device_info: Dict):
+                    completed[0] += 1
+                    if device_info and not token.cancelled:
+                        finding = self.make_finding(device_location, device_info)
+                        if finding:
+                            report(finding)
                     
                     if progress_callback:
-                        progress = 40 + int((i + 1) / len(devices) * 60)
+                        progress = 40 + int(completed[0] / len(devices) * 50)
                         progress_callback(progress)
                 
+                devices_info = self.get_devices_info(devices, info_callback=on_device_info,
+                                                     token=token)
+                
+                # Port mappings of all gateways, read together
+                if not token.cancelled:
+                    for finding in self.get_devices_mapping_findings(devices_info, token):
+                        report(finding)
+                
                 if progress_callback:
                     progress_callback(100)
                 
@@ -172,7 +387,7 @@ class UPnPScanner:
         self.scan_thread.start()
     
     def stop_scan(self):
-        """Stop the current UPnP scan"""
+        """Stop the current UPnP scan, aborting searches and fetches; does not wait"""
         self.is_scanning = False
-        if self.scan_thread and self.scan_thread.is_alive():
-            self.scan_thread.join(timeout=2)
+        if self.cancel_token:
+            self.cancel_token.cancel()